@@ -15,47 +15,356 @@
 # DEALINGS IN THE SOFTWARE.
 
 
+import changelog
+import instrumentation
+import json
+import plan
+import random
 import requests
+import requests.adapters
+import threading
+import time
 import urllib
 
 
+LINODE_URL = 'https://api.linode.com/'
+
+RATE_LIMIT_ERROR = 14
+RETRYABLE_ERROR_CODES = [RATE_LIMIT_ERROR]
+IDEMPOTENT_ACTIONS = ['domain.list', 'domain.update', 'domain.delete', 'domain.resource.list',
+                      'domain.resource.update', 'domain.resource.delete']
+MAX_RETRY_DELAY = 30
+
+# The Linode API parameter of each zone and record field
+ZONE_PARAMETERS = {'soa_email': 'SOA_Email', 'refresh_seconds': 'Refresh_sec', 'retry_seconds': 'Retry_sec',
+                   'expire_seconds': 'Expire_sec', 'ttl_seconds': 'TTL_sec'}
+RECORD_PARAMETERS = {'name': 'Name', 'target': 'Target', 'priority': 'Priority', 'weight': 'Weight', 'port': 'Port',
+                     'protocol': 'Protocol', 'tag': 'Tag', 'ttl_seconds': 'TTL_sec'}
+
+
+class ApiError(Exception):
+    """
+    A failed API call.
+    code: the Linode ERRORCODE, or the HTTP status, None if the call got no answer
+    retryable: True if the call may succeed when tried again
+    """
+
+    def __init__(self, message, code=None, retryable=False):
+        Exception.__init__(self, message)
+        self.code = code
+        self.retryable = retryable
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket rate limiter. Allows rate requests per second on average, and bursts of up to
+    capacity requests. Callers that find the bucket empty reserve a token and wait for it, so waiting callers
+    are served in the order they arrived.
+    """
+
+    def __init__(self, rate, capacity, clock=time.time, sleep=time.sleep):
+        """
+        :param rate: tokens added per second
+        :param capacity: the most tokens the bucket holds
+        :param clock: function returning the current time in seconds
+        :param sleep: function that waits for the given number of seconds
+        :return: TokenBucket object
+        """
+        self.rate = float(rate)
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a token, waiting for one if the bucket is empty
+        :return: seconds waited
+        """
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+
 class Api:
     """
     Api is a class that accesses the Linode API for DNS. It is a simple wrapper of the raw API
     except that it translates dns_zone and dns_record objects into the syntax of the API.
     It supports "dry run"ing, which allows query operations, but prints what would happen for modifying operations.
+    Changes, made or not, are reported to a ChangeLog.
+
+    It also supports batching: with a batch_size above 1, modifying calls (other than domain.create, whose DomainID
+    is needed right away) are queued and sent through the api.batch action, batch_size at a time. Queued calls
+    are sent when the queue is full and when flush is called; callers must call flush once they are done.
+    Errors from a batch are reported together, each one labelled with the zone or record that caused it.
+
+    All requests go through one HTTP session, so connections to Linode are kept alive and reused. The session's
+    connection pool is thread safe and holds up to pool_size connections, so it can be shared by concurrent
+    fetches and applies. Call close when done to release the connections.
+
+    Requests are throttled by a token bucket shared by all threads, so concurrent fetches and applies stay under
+    the account's request budget. Failures that may be transient are retried after a jittered exponential backoff:
+    rate limit errors (HTTP 429 or Linode error 14) and connect timeouts, which never reach the API, are always
+    retried, while other connection failures, timeouts, HTTP 5xx errors and malformed responses are only retried
+    for calls that are safe to repeat (everything except creates).
+    Requests, with their latency and size, retries and seconds spent throttled are recorded in Metrics.
     """
 
-    def __init__(self, key, dry_run):
+    def __init__(self, key, dry_run, batch_size=0, pool_size=10, connect_timeout=10, read_timeout=60,
+                 base_url=LINODE_URL, rate_limit=None, burst=1, max_retries=3, retry_backoff=0.5, change_log=None,
+                 metrics=None, sleep=time.sleep):
         """
         :param key: the Linode API key
         :param dry_run: True means do not apply changes, just print out what changes
+        :param batch_size: number of calls sent in one api.batch call, 0 or 1 disables batching
+        :param pool_size: number of connections kept open to Linode
+        :param connect_timeout: seconds to wait for a connection to Linode
+        :param read_timeout: seconds to wait for Linode to answer a call
+        :param base_url: URL of the API, for pointing at a stand-in such as mock_server
+        :param rate_limit: most requests per second on average, None for no limit
+        :param burst: most requests sent at once before the rate limit applies
+        :param max_retries: number of times a failed call is retried
+        :param retry_backoff: seconds before the first retry, doubled for each retry after
+        :param change_log: ChangeLog the changes are reported to, None for a verbose text log on stdout
+        :param metrics: Metrics the requests are recorded in, None for new Metrics
+        :param sleep: function that waits for the given number of seconds, for retries and the rate limit
         :return: Api object
         """
-        self.url = 'https://api.linode.com/?api_key=' + key + '&api_action='
+        self.url = base_url + '?api_key=' + key + '&api_action='
         self.dry_run = dry_run
+        self.batch_size = batch_size
+        self.pending = []
+        self.pending_lock = threading.Lock()
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.rate_limiter = None
+        if rate_limit:
+            self.rate_limiter = TokenBucket(rate_limit, burst, sleep=sleep)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.sleep = sleep
+        self.metrics = metrics or instrumentation.Metrics()
+        self.change_log = change_log or changelog.ChangeLog()
 
-    def call(self, action, arguments):
+    def count(self, name, amount=1):
         """
-        Private function, does an API call.
+        Adds to a counter of the metrics
+        :param name: name of the counter: retries, throttled_seconds or batched_calls
+        :param amount: amount to add
+        :return: None
+        """
+        self.metrics.count(name, amount)
+
+    def close(self):
+        """
+        Closes the connections to Linode, and writes out the change log
+        :return: None
+        """
+        self.session.close()
+        self.change_log.close()
+
+    def request(self, action, arguments, post=False):
+        """
+        Private function, sends a single HTTP request to the API and returns the decoded JSON response.
         Note that the API key is built into the URL.
         Note that URL quoting is important, especially for TXT records that can have escapable characters
         :param action: Linode call name
         :param arguments: dictionary of name/value pairs
-        :return: The result of the call if successful
-        :raises: an error if the call fails
+        :param post: True sends the arguments in a POST body instead of the URL (used for large batches)
+        :return: the decoded JSON response
+        :raises: ApiError for HTTP errors and non-JSON responses, requests errors for connection failures and timeouts
         """
-        argument_list = []
-        for argument in arguments:
-            argument_list.append(argument + "=" + urllib.quote_plus(str(arguments[argument])))
         url = self.url + action
-        if argument_list:
-            url = url + "&" + "&".join(argument_list)
-        response = requests.get(url).json()
+        start = time.time()
+        bytes_sent = bytes_received = 0
+        try:
+            if post:
+                response = self.session.post(url, data=arguments, timeout=self.timeout)
+            else:
+                argument_list = []
+                for argument in arguments:
+                    argument_list.append(argument + "=" + urllib.quote_plus(str(arguments[argument])))
+                if argument_list:
+                    url = url + "&" + "&".join(argument_list)
+                response = self.session.get(url, timeout=self.timeout)
+            bytes_sent = len(response.request.url) + len(response.request.body or '')
+            bytes_received = len(response.content)
+        finally:
+            self.metrics.request(action, time.time() - start, bytes_sent, bytes_received)
+        if response.status_code == 429 or response.status_code >= 500:
+            raise ApiError("API call failed: HTTP " + str(response.status_code), response.status_code)
+        try:
+            return response.json()
+        except ValueError:
+            raise ApiError("API call failed: invalid JSON response (HTTP " + str(response.status_code) + ")",
+                           response.status_code)
+
+    def send(self, action, arguments, post=False, idempotent=True):
+        """
+        Private function, sends a request through the rate limiter, retrying transient failures
+        :param action: Linode call name
+        :param arguments: dictionary of name/value pairs
+        :param post: True sends the arguments in a POST body
+        :param idempotent: True if repeating the request is harmless even when the first attempt took effect
+        :return: the decoded JSON response. After the last retry this may still be a rate limit error response.
+        :raises: ApiError when the request fails and cannot be retried
+        """
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.count('throttled_seconds', self.rate_limiter.acquire())
+            response = None
+            try:
+                response = self.request(action, arguments, post)
+                error = None
+                if isinstance(response, dict) and response['ERRORARRAY']:
+                    code = response['ERRORARRAY'][0]['ERRORCODE']
+                    error = ApiError("API call failed: " + response['ERRORARRAY'][0]['ERRORMESSAGE'], code,
+                                     code in RETRYABLE_ERROR_CODES)
+            except ApiError as e:
+                error = ApiError(str(e), e.code, e.code == 429 or idempotent)
+            except requests.exceptions.ConnectTimeout as e:
+                error = ApiError("API call failed: " + str(e), retryable=True)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = ApiError("API call failed: " + str(e), retryable=idempotent)
+            if error is None or not error.retryable or attempt >= self.max_retries:
+                if response is None:
+                    raise error
+                return response
+            attempt += 1
+            self.count('retries')
+            self.back_off(attempt)
+
+    def back_off(self, attempt):
+        """
+        Private function, waits before a retry: a random time up to retry_backoff doubled for each earlier retry
+        :param attempt: the number of the retry about to be made, starting at 1
+        :return: None
+        """
+        self.sleep(random.uniform(0, min(MAX_RETRY_DELAY, self.retry_backoff * 2 ** (attempt - 1))))
+
+    def call(self, action, arguments):
+        """
+        Private function, does an API call.
+        :param action: Linode call name
+        :param arguments: dictionary of name/value pairs
+        :return: The result of the call if successful
+        :raises: ApiError if the call fails
+        """
+        response = self.send(action, arguments, idempotent=action in IDEMPOTENT_ACTIONS)
         if response['ERRORARRAY']:
-            raise Exception("API call failed: " + response['ERRORARRAY'][0]['ERRORMESSAGE'])
+            raise ApiError("API call failed: " + response['ERRORARRAY'][0]['ERRORMESSAGE'],
+                           response['ERRORARRAY'][0]['ERRORCODE'])
         return response['DATA']
 
+    def call_batch(self, calls):
+        """
+        Private function, does several API calls in a single api.batch call.
+        A failing call does not stop the calls after it, so the result of every call is returned.
+        Calls rejected by the rate limit did not take effect, so they are retried in another batch.
+        :param calls: list of (action, arguments) pairs
+        :return: list of (data, error message) pairs, one per call, the error message is None on success
+        :raises: ApiError if the batch as a whole fails
+        """
+        results = [None] * len(calls)
+        to_be_sent = range(len(calls))
+        attempt = 0
+        while to_be_sent:
+            request_array = []
+            for index in to_be_sent:
+                action, arguments = calls[index]
+                item = dict(arguments)
+                item['api_action'] = action
+                request_array.append(item)
+            idempotent = all(calls[index][0] in IDEMPOTENT_ACTIONS for index in to_be_sent)
+            self.count('batched_calls', len(to_be_sent))
+            response = self.send('api.batch', {'api_requestArray': json.dumps(request_array)}, True, idempotent)
+            if isinstance(response, dict):
+                if response['ERRORARRAY']:
+                    raise ApiError("API call failed: " + response['ERRORARRAY'][0]['ERRORMESSAGE'],
+                                   response['ERRORARRAY'][0]['ERRORCODE'])
+                response = response['DATA']
+            if len(response) != len(to_be_sent):
+                raise ApiError("API batch returned " + str(len(response)) + " results for " + str(len(to_be_sent)) +
+                               " calls")
+            rate_limited = []
+            for index, item in zip(to_be_sent, response):
+                if not item['ERRORARRAY']:
+                    results[index] = (item['DATA'], None)
+                    continue
+                results[index] = (None, item['ERRORARRAY'][0]['ERRORMESSAGE'])
+                if item['ERRORARRAY'][0]['ERRORCODE'] in RETRYABLE_ERROR_CODES:
+                    rate_limited.append(index)
+            to_be_sent = []
+            if rate_limited and attempt < self.max_retries:
+                attempt += 1
+                self.count('retries')
+                self.back_off(attempt)
+                to_be_sent = rate_limited
+        return results
+
+    def call_or_queue(self, action, arguments, description):
+        """
+        Private function, does a modifying API call, or queues it when batching.
+        :param action: Linode call name
+        :param arguments: dictionary of name/value pairs
+        :param description: the zone or record the call is for, used in error messages
+        :return: None
+        :raises: ApiError if the call fails, or if a batch sent because the queue is full fails
+        """
+        if self.batch_size <= 1:
+            self.call(action, arguments)
+            return
+        with self.pending_lock:
+            self.pending.append((action, arguments, description))
+            if len(self.pending) >= self.batch_size:
+                self.send_pending()
+
+    def flush(self):
+        """
+        Sends all queued calls.
+        :return: None
+        :raises: a single ApiError listing every queued call that failed, with its zone or record
+        """
+        if self.batch_size <= 1:
+            return
+        with self.pending_lock:
+            self.send_pending()
+
+    def send_pending(self):
+        """
+        Private function, sends the queued calls batch_size at a time. The pending lock must be held.
+        :return: None
+        :raises: a single ApiError listing every queued call that failed, with its zone or record
+        """
+        if not self.pending:
+            return
+        pending = self.pending
+        self.pending = []
+        errors = []
+        for start in range(0, len(pending), self.batch_size):
+            chunk = pending[start:start + self.batch_size]
+            try:
+                results = self.call_batch([(action, arguments) for action, arguments, _ in chunk])
+            except Exception as e:
+                results = [(None, str(e))] * len(chunk)
+            for (action, _, description), (_, error) in zip(chunk, results):
+                if error is not None:
+                    errors.append(action + " for " + description + ": " + error)
+        if errors:
+            raise ApiError("API batch failed for " + str(len(errors)) + " call(s): " + "; ".join(errors))
+
     def list_zones(self):
         """
         Linode domain.list call
@@ -63,15 +372,28 @@ class Api:
         """
         return self.call('domain.list', {})
 
+    def list_records_batch(self, zones):
+        """
+        Linode domain.resource.list calls for several zones, sent as a single api.batch call
+        :param zones: zones to list (domain IDs must exist)
+        :return: list of (records, error message) pairs, one per zone, the error message is None on success
+        :raises: an error if the batch as a whole fails
+        """
+        return self.call_batch([('domain.resource.list', {'DomainID': zone.domain_id}) for zone in zones])
+
     def add_zone(self, zone):
         """
         Linode domain.create call
         :param zone: zone to create
         :return: None
         """
-        print "Adding new zone " + zone.domain
+        self.change_log.change(plan.ADD_ZONE, zone.domain)
         if not self.dry_run:
-            result = self.call('domain.create', {'Domain': zone.domain, 'Type': 'master', 'SOA_Email': zone.soa_email})
+            args = {'Domain': zone.domain, 'Type': 'master'}
+            for field, parameter in ZONE_PARAMETERS.items():
+                if getattr(zone, field) is not None:
+                    args[parameter] = getattr(zone, field)
+            result = self.call('domain.create', args)
             zone.domain_id = result['DomainID']
 
     def delete_zone(self, zone):
@@ -80,9 +402,9 @@ class Api:
         :param zone: zone to delete (DomainID must be filled in)
         :return: None
         """
-        print "Deleting entire zone " + zone.domain
+        self.change_log.change(plan.DELETE_ZONE, zone.domain)
         if not self.dry_run:
-            self.call('domain.delete', {'DomainID': zone.domain_id})
+            self.call_or_queue('domain.delete', {'DomainID': zone.domain_id}, 'zone ' + zone.domain)
 
     def modify_zone(self, zone, desired, fields):
         """
@@ -94,14 +416,13 @@ class Api:
         """
         if len(fields) == 0:
             return
-        print "Modifying zone " + zone.domain
         args = {'DomainID': zone.domain_id}
         for field in fields:
-            print "  Field " + field + " changes from " + str(getattr(zone, field)) + " to "\
-                  + str(getattr(desired, field))
-            args[field] = getattr(desired, field)
+            args[ZONE_PARAMETERS[field]] = parameter_value(field, getattr(desired, field))
+        self.change_log.change(plan.MODIFY_ZONE, zone.domain,
+                               changes=[(field, getattr(zone, field), getattr(desired, field)) for field in fields])
         if not self.dry_run:
-            self.call('domain.update', args)
+            self.call_or_queue('domain.update', args, 'zone ' + zone.domain)
 
     def list_records(self, zone):
         """
@@ -118,14 +439,14 @@ class Api:
         :param record: record to create
         :return: None
         """
-        print 'Adding new record (in zone ' + zone.domain + ') of type ' + record.record_type + ' with name '\
-              + record.name + ', target ' + record.target + ', and priority ' + str(record.priority)
+        self.change_log.change(plan.ADD_RECORD, zone.domain, record)
         if not self.dry_run:
             args = {'DomainID': zone.domain_id, 'Type': record.record_type, 'Name': record.name,
                     'Target': record.target}
-            if record.record_type == 'MX':
-                args['Priority'] = record.priority
-            self.call('domain.resource.create', args)
+            for field in record.fields() + ('ttl_seconds',):
+                if getattr(record, field) is not None:
+                    args[RECORD_PARAMETERS[field]] = getattr(record, field)
+            self.call_or_queue('domain.resource.create', args, record_description(zone.domain, record))
 
     def delete_record(self, record):
         """
@@ -133,10 +454,10 @@ class Api:
         :param record: record to delete (DomainID and Resource ID must both exist)
         :return: None
         """
-        print 'Deleting record (in zone ' + record.domain_name + "): " + record.record_type + ' named ' + record.name\
-              + ', target ' + record.target + ', and priority ' + str(record.priority)
+        self.change_log.change(plan.DELETE_RECORD, record.domain_name, record)
         if not self.dry_run:
-            self.call('domain.resource.delete', {'DomainID': record.domain_id, 'ResourceID': record.resource_id})
+            args = {'DomainID': record.domain_id, 'ResourceID': record.resource_id}
+            self.call_or_queue('domain.resource.delete', args, record_description(record.domain_name, record))
 
     def modify_record(self, record, desired, fields):
         """
@@ -148,11 +469,31 @@ class Api:
         """
         if len(fields) == 0:
             return
-        print "Modifying record (in zone " + record.domain_name + ") " + record.record_type + " " + record.name
         args = {'DomainID': record.domain_id, 'ResourceID': record.resource_id}
         for field in fields:
-            print "  Field " + field + " changes from " + str(getattr(record, field))\
-                  + " to " + str(getattr(desired, field))
-            args[field] = getattr(desired, field)
+            args[RECORD_PARAMETERS[field]] = parameter_value(field, getattr(desired, field))
+        self.change_log.change(plan.MODIFY_RECORD, record.domain_name, record,
+                               [(field, getattr(record, field), getattr(desired, field)) for field in fields])
         if not self.dry_run:
-            self.call('domain.resource.update', args)
+            self.call_or_queue('domain.resource.update', args, record_description(record.domain_name, record))
+
+
+def parameter_value(field, value):
+    """
+    :param field: name of a zone or record field
+    :param value: its value
+    :return: the value to send to Linode: None stands for the default, which Linode takes as 0 for times
+    """
+    if value is None and field.endswith('_seconds'):
+        return 0
+    return value
+
+
+def record_description(domain, record):
+    """
+    Describes a record for error messages
+    :param domain: name of the zone the record is in
+    :param record: the record
+    :return: description string
+    """
+    return 'record (in zone ' + domain + ') ' + record.record_type + ' ' + record.name + ' -> ' + record.target
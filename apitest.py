@@ -0,0 +1,244 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import io
+import json
+import unittest
+from multiprocessing.pool import ThreadPool
+
+import requests
+
+import api
+import changelog
+import dns_record
+import dns_zone
+import mock_server
+import update
+
+
+class RecordingApi(api.Api):
+    """
+    Api that records requests instead of sending them. Batched calls whose target is 'bad' fail.
+    """
+    def __init__(self, batch_size):
+        api.Api.__init__(self, 'key', False, batch_size, change_log=changelog.ChangeLog(level=changelog.QUIET))
+        self.requests = []
+
+    def request(self, action, arguments, post=False):
+        self.requests.append((action, arguments))
+        if action != 'api.batch':
+            return {'ERRORARRAY': [], 'DATA': {}}
+        response = []
+        for item in json.loads(arguments['api_requestArray']):
+            if item.get('Target') == 'bad':
+                response.append({'ERRORARRAY': [{'ERRORCODE': 8, 'ERRORMESSAGE': 'bad target'}], 'DATA': {}})
+            else:
+                response.append({'ERRORARRAY': [], 'DATA': {}})
+        return response
+
+
+class HtmlSession:
+    """
+    Session stand-in that answers every request with an HTML page, like a proxy in front of the API might
+    """
+    def __init__(self):
+        self.requests = 0
+
+    def get(self, url, timeout=None):
+        self.requests += 1
+        response = requests.Response()
+        response.status_code = 200
+        response.raw = io.BytesIO('<html><body>Bad Gateway</body></html>')
+        response.request = requests.Request('GET', url).prepare()
+        return response
+
+
+class BatchTestCase(unittest.TestCase):
+    def test_batching(self):
+        """
+        Modifying calls are queued and sent batch_size at a time
+        """
+        linode_api = RecordingApi(2)
+        zone = dns_zone.Zone('zone.com', 1, 'master', 'a@b.com', None, None, None, None)
+        for i in range(5):
+            linode_api.add_record(zone, dns_record.Record('zone.com', 1, None, 'A', 'www' + str(i), '1.1.1.1', None,
+                                                          None))
+        self.assertEqual(2, len(linode_api.requests))
+        linode_api.flush()
+        self.assertEqual(3, len(linode_api.requests))
+        self.assertEqual(['api.batch'] * 3, [action for action, _ in linode_api.requests])
+
+    def test_flush_without_batching(self):
+        """
+        Flushing is a no-op when batching is disabled, as calls were sent straight away
+        """
+        linode_api = RecordingApi(0)
+        zone = dns_zone.Zone('zone.com', 1, 'master', 'a@b.com', None, None, None, None)
+        linode_api.add_record(zone, dns_record.Record('zone.com', 1, None, 'A', 'www', '1.1.1.1', None, None))
+        linode_api.flush()
+        self.assertEqual(['domain.resource.create'], [action for action, _ in linode_api.requests])
+
+    def test_batch_errors(self):
+        """
+        Errors in a batch are mapped back to the record that caused them
+        """
+        linode_api = RecordingApi(10)
+        zone = dns_zone.Zone('zone.com', 1, 'master', 'a@b.com', None, None, None, None)
+        linode_api.add_record(zone, dns_record.Record('zone.com', 1, None, 'CNAME', 'good', 'zone.com', None, None))
+        linode_api.add_record(zone, dns_record.Record('zone.com', 1, None, 'CNAME', 'www', 'bad', None, None))
+        try:
+            linode_api.flush()
+            self.fail("Missed batch error")
+        except api.ApiError as e:
+            self.assertEqual("API batch failed for 1 call(s): domain.resource.create for record (in zone zone.com) "
+                             "CNAME www -> bad: bad target", e.message)
+
+
+class SessionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = mock_server.MockServer()
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_pooled_connections(self):
+        """
+        Concurrent calls reuse the pooled connections instead of opening one per call
+        """
+        linode_api = api.Api('key', False, pool_size=3, base_url=self.server.url)
+        pool = ThreadPool(3)
+        for _ in range(3):
+            pool.map(lambda _: linode_api.list_zones(), range(30))
+        pool.close()
+        pool.join()
+        self.assertEqual(90, self.server.mock.requests)
+        self.assertTrue(1 <= self.server.mock.connections <= 3)
+        linode_api.close()
+
+    def test_read_timeout(self):
+        """
+        A call that Linode does not answer within the read timeout fails
+        """
+        self.server.mock.latency = 0.1
+        linode_api = api.Api('key', False, read_timeout=0.01, base_url=self.server.url, max_retries=0)
+        self.assertRaises(api.ApiError, linode_api.list_zones)
+        linode_api.close()
+
+
+class MockServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = mock_server.MockServer()
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_round_trip(self):
+        """
+        Zones and records created through the API are listed back, with and without batching
+        """
+        for batch_size in [0, 10]:
+            linode_api = api.Api('key', False, batch_size, base_url=self.server.url,
+                                 change_log=changelog.ChangeLog(level=changelog.QUIET))
+            domain = 'zone' + str(batch_size) + '.com'
+            zone = dns_zone.Zone(domain, None, None, 'a@b.com', None, None, None, None)
+            linode_api.add_zone(zone)
+            linode_api.add_record(zone, dns_record.Record(domain, None, None, 'MX', '', 'mx.b.com', 10, None))
+            linode_api.flush()
+            existing = update.get_linode_dns(linode_api)
+            self.assertEqual('a@b.com', existing[domain].soa_email)
+            record = existing[domain].records[dns_record.RecordKey('MX', '', 'mx.b.com')]
+            self.assertEqual(10, record.priority)
+            linode_api.close()
+
+    def test_injected_errors(self):
+        """
+        Injected errors surface as API errors once the retries are used up
+        """
+        self.server.mock.error_rate = 1
+        linode_api = api.Api('key', False, base_url=self.server.url, max_retries=2, sleep=lambda seconds: None)
+        self.assertRaises(api.ApiError, linode_api.list_zones)
+        self.assertEqual(2, linode_api.metrics.counters['retries'])
+        self.assertEqual(3, self.server.mock.requests)
+        linode_api.close()
+
+    def test_transient_errors_retried(self):
+        """
+        Rate limit errors and server errors are retried until the call succeeds
+        """
+        self.server.mock.random.seed(1)
+        self.server.mock.error_rate = 0.5
+        self.server.mock.server_error_rate = 0.3
+        linode_api = api.Api('key', False, base_url=self.server.url, max_retries=50, sleep=lambda seconds: None)
+        for _ in range(20):
+            self.assertEqual([], linode_api.list_zones())
+        self.assertTrue(linode_api.metrics.counters['retries'] > 0)
+        linode_api.close()
+
+    def test_create_not_retried_after_server_error(self):
+        """
+        Creates are not repeated after a server error, in case the first attempt took effect
+        """
+        self.server.mock.server_error_rate = 1
+        linode_api = api.Api('key', False, base_url=self.server.url,
+                             change_log=changelog.ChangeLog(level=changelog.QUIET), sleep=lambda seconds: None)
+        zone = dns_zone.Zone('zone.com', None, None, 'a@b.com', None, None, None, None)
+        self.assertRaises(api.ApiError, linode_api.add_zone, zone)
+        self.assertEqual(1, self.server.mock.requests)
+        linode_api.close()
+
+
+class InvalidResponseTestCase(unittest.TestCase):
+    def test_invalid_json(self):
+        """
+        A response that is not JSON fails as an API error, retried only for calls that are safe to repeat
+        """
+        linode_api = api.Api('key', False, max_retries=2, change_log=changelog.ChangeLog(level=changelog.QUIET),
+                             sleep=lambda seconds: None)
+        linode_api.session = HtmlSession()
+        try:
+            linode_api.list_zones()
+            self.fail("Missed invalid response")
+        except api.ApiError as e:
+            self.assertEqual("API call failed: invalid JSON response (HTTP 200)", str(e))
+            self.assertEqual(200, e.code)
+        self.assertEqual(3, linode_api.session.requests)
+        linode_api.session = HtmlSession()
+        zone = dns_zone.Zone('zone.com', None, None, 'a@b.com', None, None, None, None)
+        self.assertRaises(api.ApiError, linode_api.add_zone, zone)
+        self.assertEqual(1, linode_api.session.requests)
+
+
+class TokenBucketTestCase(unittest.TestCase):
+    def test_rate(self):
+        """
+        After the burst, requests are spaced out to the rate
+        """
+        now = [0.0]
+        slept = []
+        bucket = api.TokenBucket(4, 2, clock=lambda: now[0], sleep=slept.append)
+        waits = [bucket.acquire() for _ in range(4)]
+        self.assertEqual([0, 0, 0.25, 0.5], waits)
+        self.assertEqual([0.25, 0.5], slept)
+        now[0] = 0.75
+        self.assertEqual(0, bucket.acquire())
+        self.assertEqual(0.25, bucket.acquire())
+
+
+if __name__ == '__main__':
+    unittest.main()
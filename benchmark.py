@@ -0,0 +1,113 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""
+End-to-end benchmark of fetching, diffing and applying against a local mock_server stand-in for Linode.
+Generates a synthetic fleet of N zones with M records each at the stand-in, and a desired configuration in which
+a fraction of the records changed. Reports wall time, HTTP requests and API calls for each phase.
+"""
+
+
+import api
+import argparse
+import changelog
+import dns_record
+import dns_zone
+import mock_server
+import time
+import update
+
+
+def build_fleet(mock, zone_count, record_count, change_fraction):
+    """
+    Creates the existing fleet at the stand-in, and the matching desired zones
+    :param mock: the MockLinode
+    :param zone_count: number of zones
+    :param record_count: number of records in each zone
+    :param change_fraction: fraction of the records whose target is different in the desired zones
+    :return: dictionary of desired zones
+    """
+    desired = {}
+    changes_every = int(1 / change_fraction) if change_fraction > 0 else 0
+    for zone_index in range(zone_count):
+        domain = 'zone' + str(zone_index) + '.example.com'
+        domain_id = mock.add_domain(domain, 'hostmaster@example.com')
+        zone = dns_zone.Zone(domain, None, None, 'hostmaster@example.com', None, None, None, None)
+        for record_index in range(record_count):
+            name = 'host' + str(record_index)
+            target = '10.' + str(zone_index % 256) + '.' + str(record_index // 256) + '.' + str(record_index % 256)
+            mock.add_resource(domain_id, 'A', name, target)
+            if changes_every and (zone_index * record_count + record_index) % changes_every == 0:
+                target = '192.0.2.' + str(record_index % 256)
+            zone.add_record(dns_record.Record(domain, None, None, 'A', name, target, None, None))
+        desired[domain] = zone
+    return desired
+
+
+def measure(mock, name, function):
+    """
+    Runs one phase, and prints its wall time and call counts
+    :param mock: the MockLinode, whose counters are reset first
+    :param name: name of the phase
+    :param function: function of no arguments running the phase
+    :return: the result of function
+    """
+    mock.reset_counters()
+    start = time.time()
+    result = function()
+    elapsed = time.time() - start
+    calls = sum(mock.calls.values())
+    print "%-6s %10.3f s %8d requests %8d calls" % (name, elapsed, mock.requests, calls)
+    return result
+
+
+def run(zone_count, record_count, change_fraction, latency, fetch_concurrency, apply_concurrency, batch_size):
+    """
+    Runs the benchmark
+    :return: None
+    """
+    mock = mock_server.MockLinode(latency)
+    desired = build_fleet(mock, zone_count, record_count, change_fraction)
+    server = mock_server.MockServer(mock)
+    server.start()
+    linode_api = api.Api('benchmark', False, batch_size, max(fetch_concurrency, apply_concurrency),
+                         base_url=server.url, change_log=changelog.ChangeLog(level=changelog.QUIET))
+    try:
+        print str(zone_count) + " zones x " + str(record_count) + " records, " + str(latency) + " s latency"
+        existing = measure(mock, 'fetch', lambda: update.get_linode_dns(linode_api, fetch_concurrency))
+        change_plan = measure(mock, 'diff', lambda: update.plan_changes(existing, desired))
+        measure(mock, 'apply', lambda: update.execute_plan(linode_api, change_plan, apply_concurrency))
+        print str(len(change_plan)) + " operations applied"
+    finally:
+        linode_api.close()
+        server.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark fetch, diff and apply against a mock Linode API")
+    parser.add_argument('--zones', type=int, default=100, help='Number of zones')
+    parser.add_argument('--records', type=int, default=20, help='Number of records in each zone')
+    parser.add_argument('--change-fraction', type=float, default=0.05,
+                        help='Fraction of records that change (default 0.05)')
+    parser.add_argument('--latency', type=float, default=0.01, metavar='SECONDS', help='Delay for each HTTP request')
+    parser.add_argument('--fetch-concurrency', type=int, default=1, metavar='N')
+    parser.add_argument('--apply-concurrency', type=int, default=1, metavar='N')
+    parser.add_argument('--batch-size', type=int, default=0, metavar='N')
+    args = parser.parse_args()
+
+    run(args.zones, args.records, args.change_fraction, args.latency, args.fetch_concurrency,
+        args.apply_concurrency, args.batch_size)
@@ -0,0 +1,164 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import collections
+import json
+import plan
+import sys
+import threading
+
+
+QUIET = 'quiet'
+SUMMARY = 'summary'
+VERBOSE = 'verbose'
+LEVELS = [QUIET, SUMMARY, VERBOSE]
+
+TEXT = 'text'
+JSON = 'json'
+FORMATS = [TEXT, JSON]
+
+
+class ChangeLog:
+    """
+    Where the changes made (or, in a dry run, planned) are reported.
+    Each change is an event: the action (one of the plan actions), the zone, and for records the record's fields,
+    and for modifies the changed fields with their old and new values.
+
+    Level verbose writes every change, as the familiar text lines or as one JSON object per line. Level summary only
+    counts the changes and writes the counts when closed, and level quiet writes nothing. Below verbose, events are
+    only counted, so nothing is formatted. Lines are collected in a buffer and written buffer_size at a time; the
+    lines of one change are never split. Events may come from several threads.
+    """
+
+    def __init__(self, out=None, level=VERBOSE, output_format=TEXT, buffer_size=1000):
+        """
+        :param out: file to write to, None for whatever sys.stdout is when writing
+        :param level: one of the LEVELS
+        :param output_format: one of the FORMATS
+        :param buffer_size: number of lines buffered before they are written
+        :return: ChangeLog object
+        """
+        self.out = out
+        self.level = level
+        self.output_format = output_format
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+
+    def change(self, action, zone, record=None, changes=()):
+        """
+        Reports a change
+        :param action: one of the plan actions
+        :param zone: name of the zone
+        :param record: the record added, deleted or modified, None for zone changes
+        :param changes: list of (field, old value, new value) triples, for modifies
+        :return: None
+        """
+        if self.level != VERBOSE:
+            with self.lock:
+                self.counts[action] += 1
+            return
+        if self.output_format == JSON:
+            lines = [json_line(action, zone, record, changes)]
+        else:
+            lines = text_lines(action, zone, record, changes)
+        with self.lock:
+            self.counts[action] += 1
+            self.buffer.extend(lines)
+            if len(self.buffer) >= self.buffer_size:
+                self.write()
+
+    def write(self):
+        """
+        Writes the buffered lines. The caller holds the lock.
+        :return: None
+        """
+        if self.buffer:
+            out = self.out or sys.stdout
+            out.write('\n'.join(self.buffer) + '\n')
+            self.buffer = []
+
+    def flush(self):
+        """
+        Writes the buffered lines
+        :return: None
+        """
+        with self.lock:
+            self.write()
+            (self.out or sys.stdout).flush()
+
+    def close(self):
+        """
+        Writes the buffered lines, and for level summary the number of changes of each kind
+        :return: None
+        """
+        with self.lock:
+            if self.level == SUMMARY:
+                if self.output_format == JSON:
+                    self.buffer.append(json.dumps({'summary': dict(self.counts)}, sort_keys=True))
+                else:
+                    self.buffer.append('Changes: ' + (', '.join(action + ' ' + str(self.counts[action])
+                                                                for action in sorted(self.counts)) or 'none'))
+            self.write()
+            (self.out or sys.stdout).flush()
+
+
+def json_line(action, zone, record, changes):
+    """
+    :param action: one of the plan actions
+    :param zone: name of the zone
+    :param record: the record added, deleted or modified, None for zone changes
+    :param changes: list of (field, old value, new value) triples, for modifies
+    :return: the change as a line of JSON
+    """
+    event = {'action': action, 'zone': zone}
+    if record is not None:
+        event['record'] = {'type': record.record_type, 'name': record.name, 'target': record.target,
+                           'priority': record.priority, 'ttl_seconds': record.ttl_seconds}
+        for field in record.fields():
+            event['record'][field] = getattr(record, field)
+    if changes:
+        event['changes'] = [{'field': field, 'old': old, 'new': new} for field, old, new in changes]
+    return json.dumps(event, sort_keys=True)
+
+
+def text_lines(action, zone, record, changes):
+    """
+    :param action: one of the plan actions
+    :param zone: name of the zone
+    :param record: the record added, deleted or modified, None for zone changes
+    :param changes: list of (field, old value, new value) triples, for modifies
+    :return: the change as lines of text
+    """
+    if action == plan.ADD_ZONE:
+        lines = ['Adding new zone ' + zone]
+    elif action == plan.DELETE_ZONE:
+        lines = ['Deleting entire zone ' + zone]
+    elif action == plan.MODIFY_ZONE:
+        lines = ['Modifying zone ' + zone]
+    elif action == plan.ADD_RECORD:
+        lines = ['Adding new record (in zone %s) of type %s with name %s, target %s, and priority %s' %
+                 (zone, record.record_type, record.name, record.target, record.priority)]
+    elif action == plan.DELETE_RECORD:
+        lines = ['Deleting record (in zone %s): %s named %s, target %s, and priority %s' %
+                 (zone, record.record_type, record.name, record.target, record.priority)]
+    else:
+        lines = ['Modifying record (in zone %s) %s %s' % (zone, record.record_type, record.name)]
+    for field, old, new in changes:
+        lines.append('  Field %s changes from %s to %s' % (field, old, new))
+    return lines
@@ -0,0 +1,83 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import StringIO
+import json
+import unittest
+
+import changelog
+import dns_record
+import plan
+
+
+def record():
+    return dns_record.Record('zone.com', 1, 2, 'MX', '', 'mx.zone.com', 10, None)
+
+
+class ChangeLogTestCase(unittest.TestCase):
+    def test_text(self):
+        """
+        Text lines are written when the buffer fills up or the log is closed
+        """
+        out = StringIO.StringIO()
+        change_log = changelog.ChangeLog(out, buffer_size=4)
+        change_log.change(plan.ADD_RECORD, 'zone.com', record())
+        change_log.change(plan.MODIFY_RECORD, 'zone.com', record(), [('priority', 10, 20)])
+        self.assertEqual('', out.getvalue())
+        change_log.change(plan.DELETE_ZONE, 'old.com')
+        self.assertEqual('Adding new record (in zone zone.com) of type MX with name , target mx.zone.com, and '
+                         'priority 10\n'
+                         'Modifying record (in zone zone.com) MX \n'
+                         '  Field priority changes from 10 to 20\n'
+                         'Deleting entire zone old.com\n', out.getvalue())
+        change_log.change(plan.ADD_ZONE, 'new.com')
+        change_log.close()
+        self.assertTrue(out.getvalue().endswith('old.com\nAdding new zone new.com\n'))
+
+    def test_json(self):
+        """
+        JSON output has one object per change
+        """
+        out = StringIO.StringIO()
+        change_log = changelog.ChangeLog(out, output_format=changelog.JSON)
+        change_log.change(plan.ADD_ZONE, 'zone.com')
+        change_log.change(plan.MODIFY_RECORD, 'zone.com', record(), [('priority', 10, 20)])
+        change_log.close()
+        events = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual({'action': 'add_zone', 'zone': 'zone.com'}, events[0])
+        self.assertEqual('mx.zone.com', events[1]['record']['target'])
+        self.assertEqual([{'field': 'priority', 'old': 10, 'new': 20}], events[1]['changes'])
+
+    def test_summary_and_quiet(self):
+        """
+        Summary only writes the number of changes of each kind, and quiet writes nothing
+        """
+        for level, output_format, expected in [
+                (changelog.SUMMARY, changelog.TEXT, 'Changes: add_record 2, delete_zone 1\n'),
+                (changelog.SUMMARY, changelog.JSON, '{"summary": {"add_record": 2, "delete_zone": 1}}\n'),
+                (changelog.QUIET, changelog.TEXT, '')]:
+            out = StringIO.StringIO()
+            change_log = changelog.ChangeLog(out, level, output_format)
+            change_log.change(plan.ADD_RECORD, 'zone.com', record())
+            change_log.change(plan.ADD_RECORD, 'zone.com', record())
+            change_log.change(plan.DELETE_ZONE, 'old.com')
+            change_log.close()
+            self.assertEqual(expected, out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import config
+import dns_zone
+import hashlib
+import instrumentation
+import json
+import os
+
+
+COMPILED_VERSION = 4
+
+
+class CompiledConfig:
+    """
+    A compiled copy of a YAML configuration file: the desired zones after families, aliases, IP address parsing and
+    {{ zone }} expansion, kept in a JSON file between runs.
+    The compiled zones are keyed by a hash of the configuration file's content. While the file is unchanged they
+    are loaded from the JSON file, which skips YAML parsing, address validation and template rendering. When the
+    file changes, it is parsed again and the compiled copy replaced.
+    """
+
+    def __init__(self, file_name):
+        """
+        :param file_name: name of the compiled configuration file
+        :return: CompiledConfig object
+        """
+        self.file_name = file_name
+        self.hits = 0
+        self.misses = 0
+
+    def get_desired_dns(self, config_file_name):
+        """
+        Loads the desired zones of a configuration file, from the compiled copy if it is up to date
+        :param config_file_name: name of the YAML configuration file
+        :return: dictionary of zone name to zone, like config.Config.get_desired_dns
+        :raises errors from parsing the configuration file
+        """
+        with open(config_file_name, 'rb') as config_file:
+            content_hash = hashlib.sha1(config_file.read()).hexdigest()
+        if os.path.exists(self.file_name):
+            with open(self.file_name) as compiled_file:
+                data = json.load(compiled_file)
+            if data.get('version') == COMPILED_VERSION and data.get('hash') == content_hash:
+                self.hits += 1
+                return dict((zone_name, dns_zone.from_dict(zone_dict))
+                            for zone_name, zone_dict in data['zones'].iteritems())
+        self.misses += 1
+        zones = config.Config(config_file_name).get_desired_dns()
+        self.save(content_hash, zones)
+        return zones
+
+    def save(self, content_hash, zones):
+        """
+        Writes the compiled file
+        :param content_hash: hash of the configuration file the zones were parsed from
+        :param zones: dictionary of zone name to zone
+        :return: None
+        """
+        data = {'version': COMPILED_VERSION, 'hash': content_hash,
+                'zones': dict((zone_name, zone.to_dict()) for zone_name, zone in zones.iteritems())}
+        instrumentation.write_atomically(self.file_name, lambda out: json.dump(data, out, separators=(',', ':')))
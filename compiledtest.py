@@ -0,0 +1,68 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import compiled
+import config
+
+
+class CompiledConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config_file = os.path.join(self.directory, 'config.yml')
+        shutil.copy('examples/web_and_mail_server.yml', self.config_file)
+        self.compiled_config = compiled.CompiledConfig(os.path.join(self.directory, 'compiled.json'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_compiled(self):
+        """
+        The compiled zones are the same as the parsed ones, and loading them does not parse the config file
+        """
+        parsed = config.Config(self.config_file).get_desired_dns()
+        self.assertEqual(sorted(parsed), sorted(self.compiled_config.get_desired_dns(self.config_file)))
+        parse = config.Config
+        config.Config = None
+        try:
+            loaded = self.compiled_config.get_desired_dns(self.config_file)
+        finally:
+            config.Config = parse
+        self.assertEqual((1, 1), (self.compiled_config.hits, self.compiled_config.misses))
+        self.assertEqual(sorted(parsed), sorted(loaded))
+        for zone_name in parsed:
+            self.assertEqual(parsed[zone_name].fingerprint(), loaded[zone_name].fingerprint())
+            self.assertEqual(sorted(parsed[zone_name].records), sorted(loaded[zone_name].records))
+
+    def test_changed_config(self):
+        """
+        A change to the config file is parsed again
+        """
+        self.compiled_config.get_desired_dns(self.config_file)
+        with open(self.config_file, 'a') as config_file:
+            config_file.write('  added.com:\n    SOA_email: a@added.com\n')
+        zones = self.compiled_config.get_desired_dns(self.config_file)
+        self.assertEqual((0, 2), (self.compiled_config.hits, self.compiled_config.misses))
+        self.assertTrue('added.com' in zones)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,12 +15,36 @@
 # DEALINGS IN THE SOFTWARE.
 
 
+import collections
 import dns_record
 import dns_zone
 import socket
 import yaml
 
 
+# The libyaml based loader is much faster, but only there when PyYAML was built against libyaml
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+RecordSchema = collections.namedtuple('RecordSchema', ['expansion', 'defaults', 'required'])
+"""
+How records of a type are written in the configuration file.
+expansion: name of the alias mapping (FQDNs or TXTs) used to expand targets, None for none. A records are expanded
+           through IPs into A and AAAA records instead.
+defaults: dictionary of the values of the type's fields (see dns_record.RECORD_TYPES) when they are not given
+required: the type's fields that must be given
+"""
+
+RECORD_SCHEMAS = collections.OrderedDict([
+    ('A', RecordSchema(None, {}, ())),
+    ('CAA', RecordSchema(None, {}, ('tag',))),
+    ('CNAME', RecordSchema('FQDNs', {}, ())),
+    ('MX', RecordSchema('FQDNs', {}, ())),
+    ('NS', RecordSchema('FQDNs', {}, ())),
+    ('SRV', RecordSchema('FQDNs', {'priority': 0, 'weight': 0}, ('port', 'protocol'))),
+    ('TXT', RecordSchema('TXTs', {}, ())),
+])
+
+
 class Config:
     """
     Class for creating zones/records from a YAML configuration file.
@@ -42,7 +66,7 @@ class Config:
     Here foo is an alias for both an IPv4 and IPv6 address, bar is a IPv4 alias, and baz an IPv6 alias
 
     The FQDNs is a mapping from aliases to fully qualified domain names.
-    The mapping is used to expand target values in CNAME and MX records
+    The mapping is used to expand target values in CNAME, MX, NS and SRV records
     Sample:
       mx1: mx1.domain.com
       remote: remote-vpn.mycompany.com
@@ -66,10 +90,12 @@ class Config:
     retry_seconds:
     expire_seconds:
     ttl_seconds:
-    A, CNAME, MX, and TXT: lists of records.
+    A, CAA, CNAME, MX, NS, SRV and TXT: lists of records.
 
     Records are mappings, and the following keys are valid:
-    host, target, priority and ttl_seconds.
+    host, target, priority and ttl_seconds, and for SRV records weight, port and protocol, and for CAA records tag.
+    SRV records need a port and a protocol (tcp or udp), their host is the service (such as _sip); their priority
+    and weight default to 0. CAA records need a tag (issue, issuewild or iodef), their target is the value.
     For A records only, target can be a space separated list of IP addresses. If the address is IPv4, an A record
     is generated, and if IPv6 an AAAA record is generated. This makes it easier to handle hosts that are both
     IPv4 and IPv6 (very common nowadays).
@@ -108,29 +134,51 @@ class Config:
     IPs: the IPs mapping
     FQDNs: the FQDNs mapping
     TXTs: the TXTs mapping.
+    addresses: index of A record targets (IPs aliases or address lists) to their typed, canonical addresses
 
     Usage;
     Create an object (passing in the config file name). The config file is parsed.
-    Zone info is retrieved via the get_desired_dns method
+    Zone info is retrieved via the get_desired_dns method, or zone by zone via the iter_desired_dns method.
+    A lazy config does not build zone objects up front: iter_desired_dns builds each zone when it is reached and
+    keeps none of them, so only the zones in use are in memory.
+    A streaming config reads the file as a stream of YAML events and builds the raw data of one zone at a time,
+    instead of building the node tree of the whole file first. The zones must then be the last top level entry.
+    A config with a scope (see scope.Scope) only keeps and builds the zones in scope.
     """
 
-    def __init__(self, config_file_name):
+    def __init__(self, config_file_name, lazy=False, stream=False, yaml_data=None, scope=None):
         """
         Loads a config file and also parses it
         :param config_file_name:
+        :param lazy: True to build zones only as iter_desired_dns reaches them
+        :param stream: True to read the file as a stream of events, one zone at a time
+        :param yaml_data: data already loaded from YAML, parsed instead of reading the file
+        :param scope: Scope limiting the zones, None for all zones
         :return:
         :raises the parse function may raise an error
         """
         self.config_file_name = config_file_name
-        with open(config_file_name) as yaml_file:
-            self.yaml_data = yaml.safe_load(yaml_file)
+        self.lazy = lazy
+        self.scope = scope
+        self.yaml_data = None
         self.raw_zones = {}
         self.zones = {}
         self.raw_families = {}
         self.families = {}
+        self.parsing_families = set()
         self.IPs = {}
         self.FQDNs = {}
         self.TXTs = {}
+        self.addresses = {}
+        if yaml_data is not None:
+            self.yaml_data = yaml_data
+            self.parse()
+            return
+        with open(config_file_name) as yaml_file:
+            if stream:
+                self.parse_stream(yaml_file)
+                return
+            self.yaml_data = yaml.load(yaml_file, Loader=SafeLoader)
         self.parse()
 
     def parse(self):
@@ -140,23 +188,96 @@ class Config:
         :raises error for unknown top level key, also zone errors
         """
         for top_level_key in self.yaml_data:
-            if top_level_key == 'zones':
-                self.raw_zones = self.yaml_data['zones']
-            elif top_level_key == 'families':
-                self.raw_families = self.yaml_data['families']
-            elif top_level_key == 'IPs':
-                self.IPs = self.yaml_data['IPs']
-            elif top_level_key == 'FQDNs':
-                self.FQDNs = self.yaml_data['FQDNs']
-            elif top_level_key == "TXTs":
-                self.TXTs = self.yaml_data['TXTs']
-            else:
-                raise Exception("Unrecognized top level entry in YAML file: " + top_level_key)
+            self.parse_top_level(top_level_key, self.yaml_data[top_level_key])
+        self.parse_families()
+        if self.scope is not None:
+            self.raw_zones = dict((zone_name, raw_zone) for zone_name, raw_zone in self.raw_zones.iteritems()
+                                  if self.scope.selects_raw_zone(zone_name, raw_zone, self.families))
+        if not self.lazy:
+            for zone_name in self.raw_zones:
+                self.zones[zone_name] = self.parse_desired_zone(zone_name)
+
+    def parse_stream(self, yaml_file):
+        """
+        Parses top level keys from a stream of YAML events. Each zone is parsed as soon as its raw data is read.
+        :param yaml_file: the open config file
+        :return:
+        :raises error for unknown top level key or an entry after zones, also zone errors
+        """
+        zones_read = False
+        for top_level_key, value in stream_top_level(yaml_file):
+            if zones_read:
+                raise Exception("Zones must be the last top level entry when streaming the YAML file, found: " +
+                                str(top_level_key))
+            if top_level_key != 'zones':
+                self.parse_top_level(top_level_key, value)
+                continue
+            zones_read = True
+            self.parse_families()
+            for zone_name, raw_zone in value:
+                if self.scope is not None and not self.scope.selects_raw_zone(zone_name, raw_zone, self.families):
+                    continue
+                self.raw_zones[zone_name] = raw_zone
+                if not self.lazy:
+                    self.zones[zone_name] = self.parse_desired_zone(zone_name)
+        if not zones_read:
+            self.parse_families()
+
+    def parse_top_level(self, top_level_key, value):
+        """
+        Parses a top level entry other than the zones' and families' content
+        :param top_level_key:
+        :param value: the raw data of the entry
+        :return:
+        :raises error for unknown top level key
+        """
+        if top_level_key == 'zones':
+            self.raw_zones = value
+        elif top_level_key == 'families':
+            self.raw_families = value
+        elif top_level_key == 'IPs':
+            self.IPs = value
+        elif top_level_key == 'FQDNs':
+            self.FQDNs = value
+        elif top_level_key == "TXTs":
+            self.TXTs = value
+        else:
+            raise Exception("Unrecognized top level entry in YAML file: " + top_level_key)
+
+    def parse_families(self):
+        """
+        Parses the families section into zone objects
+        :return:
+        :raises zone errors
+        """
         for family_name in self.raw_families:
+            self.family(family_name)
+
+    def family(self, family_name):
+        """
+        Returns a family, parsing it on first use, so that a family can use families defined after it
+        :param family_name:
+        :return: the family's zone object
+        :raises error for a family that uses itself, also zone errors
+        """
+        if family_name not in self.families:
+            if family_name in self.parsing_families:
+                raise Exception("Family uses itself: " + family_name)
+            self.parsing_families.add(family_name)
             self.families[family_name] = self.parse_zone(family_name, self.raw_families[family_name])
-        for zone_name in self.raw_zones:
-            self.zones[zone_name] = self.parse_zone(zone_name, self.raw_zones[zone_name])
-            self.zones[zone_name].instantiate()
+            self.parsing_families.discard(family_name)
+        return self.families[family_name]
+
+    def parse_desired_zone(self, zone_name):
+        """
+        Parses a zone from the zones section, and expands {{ zone }}
+        :param zone_name:
+        :return: the zone
+        :raises error from zone parsing
+        """
+        zone = self.parse_zone(zone_name, self.raw_zones[zone_name])
+        zone.instantiate()
+        return zone
 
     def parse_zone(self, name, raw_zone):
         """
@@ -178,19 +299,21 @@ class Config:
                 zone.expire_seconds = raw_zone['expire_seconds']
             elif zone_key == 'ttl_seconds':
                 zone.ttl_seconds = raw_zone['ttl_seconds']
-            elif zone_key in ['A', 'CNAME', 'MX', 'TXT', 'families']:
+            elif zone_key in RECORD_SCHEMAS or zone_key == 'families':
                 pass
             else:
                 raise Exception("Unrecognized zone key in YAML filefor zone " + name + ", key: " + zone_key)
-        self.parse_records(zone, raw_zone, 'A')
-        self.parse_records(zone, raw_zone, 'CNAME')
-        self.parse_records(zone, raw_zone, 'MX')
-        self.parse_records(zone, raw_zone, 'TXT')
+        for record_type in RECORD_SCHEMAS:
+            self.parse_records(zone, raw_zone, record_type)
         if 'families' in raw_zone:
             for family in raw_zone['families']:
-                if not isinstance(family, str):
+                if not isinstance(family, basestring):
                     raise Exception("Family is not a string in zone: " + name)
-                zone.merge(self.families[family])
+                family_zone = self.family(family)
+                zone.merge(family_zone)
+                for family_name in [family] + family_zone.families:
+                    if family_name not in zone.families:
+                        zone.families.append(family_name)
         return zone
 
     def parse_records(self, zone, raw_zone, record_type):
@@ -202,18 +325,17 @@ class Config:
         :return: None
         :raises error from parse_record
         """
+        if record_type not in RECORD_SCHEMAS:
+            raise Exception("Unrecognized record type: " + record_type)
         if record_type in raw_zone:
+            expansion = {}
+            if RECORD_SCHEMAS[record_type].expansion is not None:
+                expansion = getattr(self, RECORD_SCHEMAS[record_type].expansion)
             for raw_record in raw_zone[record_type]:
                 if record_type == 'A':
                     self.parse_a_record(zone, raw_record)
-                elif record_type == 'CNAME':
-                    self.parse_cname_record(zone, raw_record)
-                elif record_type == 'MX':
-                    self.parse_mx_record(zone, raw_record)
-                elif record_type == 'TXT':
-                    self.parse_txt_record(zone, raw_record)
                 else:
-                    raise Exception("Unrecognized record type: " + record_type)
+                    self.parse_record(zone, raw_record, record_type, raw_record['target'], expansion)
 
     def parse_a_record(self, zone, raw_record):
         """
@@ -223,26 +345,22 @@ class Config:
         :param raw_record:
         :return:
         """
-        possible_alias = raw_record['target']
-        if possible_alias in self.IPs:
-            possible_alias = self.IPs[possible_alias]
-        targets = possible_alias.split()
-        for target in targets:
-            if is_valid_ipv4_address(target):
-                self.parse_record(zone, raw_record, 'A', target, {})
-            elif is_valid_ipv6_address(target):
-                self.parse_record(zone, raw_record, 'AAAA', target, {})
-            else:
-                raise Exception("Cannot parse IP address: " + target)
+        for record_type, target in self.resolve_addresses(raw_record['target']):
+            self.parse_record(zone, raw_record, record_type, target, {})
 
-    def parse_cname_record(self, zone, raw_record):
-        self.parse_record(zone, raw_record, 'CNAME', raw_record['target'], self.FQDNs)
-
-    def parse_mx_record(self, zone, raw_record):
-        self.parse_record(zone, raw_record, 'MX', raw_record['target'], self.FQDNs)
-
-    def parse_txt_record(self, zone, raw_record):
-        self.parse_record(zone, raw_record, 'TXT', raw_record['target'], self.TXTs)
+    def resolve_addresses(self, possible_alias):
+        """
+        Resolves the target of an A record into its addresses. Each alias or list of addresses is only resolved
+        once, and then kept in the addresses index.
+        :param possible_alias: an IPs alias, or a space separated list of IP addresses
+        :return: list of (record type, address) pairs, IPv6 addresses in canonical form
+        :raises error if an address is neither IPv4 nor IPv6
+        """
+        addresses = self.addresses.get(possible_alias)
+        if addresses is None:
+            addresses = [classify_address(target) for target in self.IPs.get(possible_alias, possible_alias).split()]
+            self.addresses[possible_alias] = addresses
+        return addresses
 
     @staticmethod
     def parse_record(zone, raw_record, record_type, target, target_expansion):
@@ -251,12 +369,15 @@ class Config:
         Special considerations:
         Missing host is replaced with an empty string
         Targets are expanded via dictionary
+        The fields of the record type are taken from the record, or from the defaults of the type (see
+        RECORD_SCHEMAS)
         :param zone: zone to put parsed records in
         :param raw_record: raw data containing record to be parsed
         :param record_type: record type to generate
         :param target: the target
         :param target_expansion: the dictionary used to possibly translate target
         :return: None
+        :raises error if a required field of the record type is missing
         """
         priority = None
         if 'priority' in raw_record:
@@ -272,11 +393,143 @@ class Config:
         if target in target_expansion:
             target = target_expansion[target]
         record = dns_record.Record(zone.domain, None, None, record_type, host, target, priority, ttl_seconds)
+        schema = RECORD_SCHEMAS.get(record_type)
+        if schema is not None:
+            for field in dns_record.record_type(record_type).fields:
+                if field in raw_record:
+                    setattr(record, field, raw_record[field])
+                elif field in schema.required:
+                    raise Exception("Missing " + field + " in " + record_type + " record " + host + " of zone " +
+                                    zone.domain)
+                elif field in schema.defaults:
+                    setattr(record, field, schema.defaults[field])
         zone.add_record(record)
 
     def get_desired_dns(self):
         return self.zones
 
+    def desired_zone_names(self):
+        """
+        :return: the names of the desired zones, without building them
+        """
+        return list(self.raw_zones.keys())
+
+    def iter_desired_dns(self):
+        """
+        Generates the desired zones one at a time. A lazy config builds each zone as it is reached.
+        :return: generator of (zone name, zone) pairs
+        """
+        for zone_name in self.raw_zones:
+            if self.lazy:
+                yield zone_name, self.parse_desired_zone(zone_name)
+            else:
+                yield zone_name, self.zones[zone_name]
+
+
+def stream_top_level(yaml_file):
+    """
+    Reads the top level mapping of a YAML file as a stream of events. Top level values are built one at a time,
+    except for zones, whose value is a generator of (zone name, raw zone) pairs built one zone at a time; it must be
+    consumed before the next top level entry is read.
+    :param yaml_file: the open YAML file
+    :return: generator of (top level key, value) pairs
+    :raises error if the file is not a single mapping
+    """
+    loader = SafeLoader(yaml_file)
+    try:
+        loader.get_event()
+        if loader.check_event(yaml.StreamEndEvent):
+            return
+        loader.get_event()
+        if not loader.check_event(yaml.MappingStartEvent):
+            raise Exception("The YAML file is not a mapping of top level entries")
+        loader.get_event()
+        anchors = {}
+        while not loader.check_event(yaml.MappingEndEvent):
+            top_level_key = construct(loader, compose_event_node(loader, anchors))
+            if top_level_key == 'zones' and loader.check_event(yaml.MappingStartEvent):
+                yield top_level_key, stream_mapping(loader, anchors)
+            else:
+                yield top_level_key, construct(loader, compose_event_node(loader, anchors))
+    finally:
+        loader.dispose()
+
+
+def stream_mapping(loader, anchors):
+    """
+    Reads a mapping one entry at a time
+    :param loader: the loader, positioned at the start of the mapping
+    :param anchors: dictionary of anchor name to node, for aliases
+    :return: generator of (key, value) pairs
+    """
+    loader.get_event()
+    while not loader.check_event(yaml.MappingEndEvent):
+        key = construct(loader, compose_event_node(loader, anchors))
+        yield key, construct(loader, compose_event_node(loader, anchors))
+    loader.get_event()
+
+
+def compose_event_node(loader, anchors):
+    """
+    Builds the node of the next value from the loader's events. PyYAML's own composer works on the whole document,
+    and is not available at all in the libyaml based loader.
+    :param loader: the loader
+    :param anchors: dictionary of anchor name to node, for aliases
+    :return: the node
+    """
+    event = loader.get_event()
+    if isinstance(event, yaml.AliasEvent):
+        if event.anchor not in anchors:
+            raise Exception("Undefined YAML alias: " + event.anchor)
+        return anchors[event.anchor]
+    tag = event.tag
+    if isinstance(event, yaml.ScalarEvent):
+        if tag is None or tag == '!':
+            tag = loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+        node = yaml.ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+    elif isinstance(event, yaml.SequenceStartEvent):
+        if tag is None or tag == '!':
+            tag = loader.resolve(yaml.SequenceNode, None, event.implicit)
+        node = yaml.SequenceNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+        while not loader.check_event(yaml.SequenceEndEvent):
+            node.value.append(compose_event_node(loader, anchors))
+        node.end_mark = loader.get_event().end_mark
+    else:
+        if tag is None or tag == '!':
+            tag = loader.resolve(yaml.MappingNode, None, event.implicit)
+        node = yaml.MappingNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+        while not loader.check_event(yaml.MappingEndEvent):
+            key_node = compose_event_node(loader, anchors)
+            node.value.append((key_node, compose_event_node(loader, anchors)))
+        node.end_mark = loader.get_event().end_mark
+    if event.anchor is not None:
+        anchors[event.anchor] = node
+    return node
+
+
+def construct(loader, node):
+    """
+    :param loader: the loader
+    :param node: a node built by compose_event_node
+    :return: the Python value of the node, as the safe loader builds it
+    """
+    return loader.construct_document(node)
+
+
+def classify_address(address):
+    """
+    :param address: an IPv4 or IPv6 address
+    :return: pair of the record type for the address, A or AAAA, and the address. IPv6 addresses are put in
+             canonical form.
+    :raises error if the address is neither IPv4 nor IPv6
+    """
+    if ':' not in address:
+        if is_valid_ipv4_address(address):
+            return 'A', address
+    elif is_valid_ipv6_address(address):
+        return 'AAAA', dns_record.canonical_ipv6(address)
+    raise Exception("Cannot parse IP address: " + address)
+
 
 def is_valid_ipv4_address(address):
     try:
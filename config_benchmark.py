@@ -0,0 +1,101 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""
+Benchmark of loading generated YAML configuration files of increasing size.
+Each file has a few families and aliases, and N zones using them. Reports the wall time of loading the file with
+the pure Python YAML loader, with the libyaml based loader (when available), and streaming one zone at a time.
+"""
+
+
+import argparse
+import config
+import os
+import shutil
+import tempfile
+import time
+import yaml
+
+
+def write_config(file_name, zone_count):
+    """
+    Writes a configuration file
+    :param file_name: name of the file to write
+    :param zone_count: number of zones
+    :return: None
+    """
+    with open(file_name, 'w') as config_file:
+        config_file.write('IPs:\n  web: 192.0.2.10 2600:3c00::10\n  mail: 192.0.2.20\n'
+                          'FQDNs:\n  mx: mail.example.com\n'
+                          'TXTs:\n  spf: v=spf1 a mx -all\n'
+                          'families:\n'
+                          '  web:\n    SOA_email: hostmaster@example.com\n    ttl_seconds: 3600\n'
+                          '    A: [ { host: , target: web }, { host: www, target: web } ]\n'
+                          '    CNAME: [ { host: ftp, target: "{{ zone }}" } ]\n'
+                          '  mailer:\n    MX: [ { host: , target: mx, priority: 10 } ]\n'
+                          '    TXT: [ { host: , target: spf } ]\n'
+                          'zones:\n')
+        for zone_index in range(zone_count):
+            config_file.write('  zone' + str(zone_index) + '.example.com:\n    families: [ web, mailer ]\n    A:\n')
+            for record_index in range(10):
+                config_file.write('      - { host: host' + str(record_index) + ', target: 10.' +
+                                  str(zone_index % 256) + '.0.' + str(record_index) + ' }\n')
+
+
+def measure(name, function):
+    """
+    Runs one way of loading, and prints its wall time
+    :param name: name of the way of loading
+    :param function: function of no arguments doing the loading
+    :return: None
+    """
+    start = time.time()
+    function()
+    print "%-8s %10.3f s" % (name, time.time() - start)
+
+
+def run(zone_counts):
+    """
+    Runs the benchmark
+    :param zone_counts: list of the numbers of zones to generate files for
+    :return: None
+    """
+    directory = tempfile.mkdtemp()
+    loader = config.SafeLoader
+    try:
+        for zone_count in zone_counts:
+            file_name = os.path.join(directory, 'config' + str(zone_count) + '.yml')
+            write_config(file_name, zone_count)
+            print str(zone_count) + " zones, " + str(os.path.getsize(file_name)) + " bytes"
+            config.SafeLoader = yaml.SafeLoader
+            measure('python', lambda: config.Config(file_name))
+            if loader is not yaml.SafeLoader:
+                config.SafeLoader = loader
+                measure('libyaml', lambda: config.Config(file_name))
+            measure('stream', lambda: config.Config(file_name, stream=True))
+    finally:
+        config.SafeLoader = loader
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark loading generated configuration files")
+    parser.add_argument('--zones', type=int, nargs='+', default=[10, 100, 1000], metavar='N',
+                        help='Numbers of zones to generate files for (default 10 100 1000)')
+    args = parser.parse_args()
+
+    run(args.zones)
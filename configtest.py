@@ -1,6 +1,11 @@
+import os
+import shutil
+import tempfile
 import unittest
+import yaml
 
 import config
+import dns_record
 
 
 # Copyright (c) 2016 John Gateley
@@ -125,10 +130,10 @@ class ConfigTestCase(unittest.TestCase):
         self.check_zone_soa_email(desired_zones, 'zone.com')
         self.check_zone_soa_email(desired_zones, 'zone2.com')
         zone_to_test = desired_zones['zone.com']
-        self.assertEqual(['A::3.3.3.3'], sorted(zone_to_test.records.keys()))
+        self.assertEqual([('A', '', '3.3.3.3')], sorted(zone_to_test.records.keys()))
         self.check_record(zone_to_test, 'A', '', '3.3.3.3', None, None)
         zone_to_test = desired_zones['zone2.com']
-        self.assertEqual(['A::4.4.4.4'], sorted(zone_to_test.records.keys()))
+        self.assertEqual([('A', '', '4.4.4.4')], sorted(zone_to_test.records.keys()))
         self.check_record(zone_to_test, 'A', '', '4.4.4.4', None, None)
 
     def test_a_records(self):
@@ -141,9 +146,10 @@ class ConfigTestCase(unittest.TestCase):
         self.assertEqual(1, len(desired_zones.keys()))
         self.check_zone_soa_email(desired_zones, 'zone.com')
         zone_to_test = desired_zones['zone.com']
-        self.assertEqual(['A:www1:3.3.3.3', 'A:www2:4.4.4.4', 'A:www4:1.1.1.1', 'A:www5:2.2.2.2', 'A:www7:1.2.3.4',
-                          'A:www7:2.3.4.5', 'AAAA:www2:2600:3c00::1111', 'AAAA:www3:2600::2222',
-                          'AAAA:www5:2600:3c00::f6e6:7287', 'AAAA:www6:2600:3c00::f6e6:7288'],
+        self.assertEqual([('A', 'www1', '3.3.3.3'), ('A', 'www2', '4.4.4.4'), ('A', 'www4', '1.1.1.1'),
+                          ('A', 'www5', '2.2.2.2'), ('A', 'www7', '1.2.3.4'), ('A', 'www7', '2.3.4.5'),
+                          ('AAAA', 'www2', '2600:3c00::1111'), ('AAAA', 'www3', '2600::2222'),
+                          ('AAAA', 'www5', '2600:3c00::f6e6:7287'), ('AAAA', 'www6', '2600:3c00::f6e6:7288')],
                          sorted(zone_to_test.records.keys()))
         self.check_record(zone_to_test, 'A', 'www1', '3.3.3.3', None, None)
         self.check_record(zone_to_test, 'A', 'www2', '4.4.4.4', None, None)
@@ -166,7 +172,8 @@ class ConfigTestCase(unittest.TestCase):
         self.assertEqual(1, len(desired_zones.keys()))
         self.check_zone_soa_email(desired_zones, 'zone.com')
         zone_to_test = desired_zones['zone.com']
-        self.assertEqual(['CNAME:www1:www.one.com', 'CNAME:www2:www.expansion.com', 'CNAME:www3:zone.com'],
+        self.assertEqual([('CNAME', 'www1', 'www.one.com'), ('CNAME', 'www2', 'www.expansion.com'),
+                          ('CNAME', 'www3', 'zone.com')],
                          sorted(zone_to_test.records.keys()))
         self.check_record(zone_to_test, 'CNAME', 'www1', 'www.one.com', None, None)
         self.check_record(zone_to_test, 'CNAME', 'www2', 'www.expansion.com', None, None)
@@ -182,7 +189,7 @@ class ConfigTestCase(unittest.TestCase):
         self.assertEqual(1, len(desired_zones.keys()))
         self.check_zone_soa_email(desired_zones, 'zone.com')
         zone_to_test = desired_zones['zone.com']
-        self.assertEqual(['CNAME:www:zone.com'], sorted(zone_to_test.records.keys()))
+        self.assertEqual([('CNAME', 'www', 'zone.com')], sorted(zone_to_test.records.keys()))
         self.check_record(zone_to_test, 'CNAME', 'www', 'zone.com', None, None)
 
     def test_txt_records(self):
@@ -195,7 +202,7 @@ class ConfigTestCase(unittest.TestCase):
         self.assertEqual(1, len(desired_zones.keys()))
         self.check_zone_soa_email(desired_zones, 'zone.com')
         zone_to_test = desired_zones['zone.com']
-        self.assertEqual(['TXT:www1:foo', 'TXT:www2:expansion'], sorted(zone_to_test.records.keys()))
+        self.assertEqual([('TXT', 'www1', 'foo'), ('TXT', 'www2', 'expansion')], sorted(zone_to_test.records.keys()))
         self.check_record(zone_to_test, 'TXT', 'www1', 'foo', None, None)
         self.check_record(zone_to_test, 'TXT', 'www2', 'expansion', None, None)
 
@@ -209,9 +216,83 @@ class ConfigTestCase(unittest.TestCase):
         self.assertEqual(1, len(desired_zones.keys()))
         self.check_zone_soa_email(desired_zones, 'zone.com')
         zone_to_test = desired_zones['zone.com']
-        self.assertEqual(['MX::mx1.foo.com'], sorted(zone_to_test.records.keys()))
+        self.assertEqual([('MX', '', 'mx1.foo.com')], sorted(zone_to_test.records.keys()))
         self.check_record(zone_to_test, 'MX', '', 'mx1.foo.com', 10, None)
 
+    def test_srv_caa_ns_records(self):
+        """
+        Test SRV, CAA and NS records, their fields and defaults
+        """
+        conf = config.Config("test_data/SRV_CAA_NS_record_test.yml")
+        zone_to_test = conf.get_desired_dns()['zone.com']
+        self.assertEqual([('CAA', '', ('letsencrypt.org', 'issue')), ('CAA', '', ('letsencrypt.org', 'issuewild')),
+                          ('NS', 'sub', 'ns1.zone.com'), ('SRV', '_sip', ('sip.foo.com', 'tcp')),
+                          ('SRV', '_sip', ('sip.foo.com', 'udp'))], sorted(zone_to_test.records.keys()))
+        udp = zone_to_test.records[('SRV', '_sip', ('sip.foo.com', 'udp'))]
+        self.assertEqual((10, 5, 5060), (udp.priority, udp.weight, udp.port))
+        tcp = zone_to_test.records[('SRV', '_sip', ('sip.foo.com', 'tcp'))]
+        self.assertEqual((0, 0, 5060), (tcp.priority, tcp.weight, tcp.port))
+        self.assertEqual(3600, zone_to_test.records[('CAA', '', ('letsencrypt.org', 'issuewild'))].ttl_seconds)
+        with self.assertRaises(Exception) as context:
+            conf.parse_zone('zone.com', {'SRV': [{'host': '_sip', 'target': 'sip', 'protocol': 'tcp'}]})
+        self.assertEqual('Missing port in SRV record _sip of zone zone.com', context.exception.message)
+
+    def test_address_index(self):
+        """
+        IPs aliases are resolved once, and IPv6 addresses are put in canonical form
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(directory, 'config.yml')
+            with open(file_name, 'w') as config_file:
+                config_file.write('IPs:\n  web: 1.2.3.4 2600:0:0::0:1\nzones:\n'
+                                  '  zone.com: { A: [ { host: www, target: web }, { host: , target: web } ] }\n'
+                                  '  zone2.com: { A: [ { host: www, target: 2600::0:2 } ] }\n')
+            conf = config.Config(file_name)
+            self.check_record(conf.zones['zone.com'], 'AAAA', 'www', '2600::1', None, None)
+            self.check_record(conf.zones['zone.com'], 'AAAA', '', '2600::1', None, None)
+            self.check_record(conf.zones['zone2.com'], 'AAAA', 'www', '2600::2', None, None)
+            self.assertEqual({'web': [('A', '1.2.3.4'), ('AAAA', '2600::1')], '2600::0:2': [('AAAA', '2600::2')]},
+                             conf.addresses)
+            self.assertRaises(Exception, config.classify_address, '1.2.3')
+        finally:
+            shutil.rmtree(directory)
+
+    def test_stream(self):
+        """
+        Streaming gives the same zones as loading the whole file, with either YAML loader
+        """
+        loader = config.SafeLoader
+        try:
+            for config.SafeLoader in [yaml.SafeLoader, loader]:
+                for file_name in ['examples/web_and_mail_server.yml', 'test_data/nested_families.yml',
+                                  'test_data/A_record_test.yml', 'test_data/empty.yml']:
+                    loaded = config.Config(file_name).get_desired_dns()
+                    streamed = config.Config(file_name, stream=True).get_desired_dns()
+                    self.assertEqual(sorted((name, zone.fingerprint()) for name, zone in loaded.items()),
+                                     sorted((name, zone.fingerprint()) for name, zone in streamed.items()))
+        finally:
+            config.SafeLoader = loader
+
+    def test_stream_zones_last(self):
+        """
+        When streaming, nothing may follow the zones, and aliases still work
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(directory, 'config.yml')
+            with open(file_name, 'w') as config_file:
+                config_file.write('zones:\n  zone.com: &zone\n    SOA_email: a@b.com\n  zone2.com: *zone\n')
+            self.assertEqual(['zone.com', 'zone2.com'],
+                             sorted(config.Config(file_name, stream=True).get_desired_dns()))
+            with open(file_name, 'a') as config_file:
+                config_file.write('IPs:\n  foo: 1.2.3.4\n')
+            with self.assertRaises(Exception) as context:
+                config.Config(file_name, stream=True)
+            self.assertTrue(context.exception.message.startswith('Zones must be the last top level entry'))
+        finally:
+            shutil.rmtree(directory)
+
     def check_zone_soa_email(self, zones, name):
         zone = zones[name]
         self.assertEqual(name, zone.domain)
@@ -226,7 +307,7 @@ class ConfigTestCase(unittest.TestCase):
         self.assertEqual(ttl_seconds, zone.ttl_seconds)
 
     def check_record(self, zone, record_type, name, target, priority, ttl_seconds):
-        key_name = record_type + ':' + name + ':' + target
+        key_name = dns_record.RecordKey(record_type, name, target)
         self.assertTrue(key_name in zone.records.keys())
         record = zone.records[key_name]
         self.assertEqual(record_type, record.record_type)
@@ -0,0 +1,237 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import dns_record
+import fragments
+import os
+import sys
+import time
+import update
+
+
+class Daemon:
+    """
+    Long running reconcile: keeps the desired zones and the last known Linode zones in memory, so a change to the
+    configuration costs neither interpreter startup nor a full fetch from Linode.
+
+    The config file (or each file of a split configuration) is polled for changes of its modification time and
+    size. Once the files stop changing for debounce seconds, so an editor saving several times or a deployment
+    copying several files is applied once, the configuration is loaded again and only the zones whose desired
+    fingerprint changed (see Zone.fingerprint) are diffed against the zones in memory and applied. The zones that
+    were changed are then fetched again, so the zones in memory carry the Linode IDs of new records.
+
+    Changes made outside this program are not seen by polling the configuration; every drift_interval seconds all
+    zones are fetched from Linode and fully reconciled. A failed apply or fetch is reported on stderr and the zones
+    in memory are dropped, so the next configuration change or drift check runs a full reconcile. The string intern
+    pool (see dns_record.intern_value) is emptied after each reload or reconcile, so it does not grow for as long as
+    the daemon runs.
+    """
+
+    def __init__(self, linode_api, config_file, compiled_file=None, parse_processes=1, fetch_concurrency=1,
+                 apply_concurrency=1, reuse_records=False, poll_interval=2, debounce=1, drift_interval=3600,
+                 metrics_file=None, prometheus_file=None, clock=time.time, sleep=time.sleep, stderr=sys.stderr):
+        """
+        :param linode_api: The API object, kept open while the daemon runs
+        :param config_file: config file name, or directory or glob pattern of config files
+        :param compiled_file: file name of the compiled configuration, so unchanged files are not parsed again
+        :param parse_processes: number of processes parsing the files of a configuration split across several files
+        :param fetch_concurrency: number of zones whose records are fetched at the same time
+        :param apply_concurrency: number of zones whose changes are applied at the same time
+        :param reuse_records: True to change records into desired records of another name instead of deleting them
+        :param poll_interval: seconds between two polls of the config files
+        :param debounce: seconds the config files must stay unchanged before they are loaded
+        :param drift_interval: seconds between two full reconciles
+        :param metrics_file: file name to write the metrics to as JSON after each reconcile, None for none
+        :param prometheus_file: file name to write the metrics to in the Prometheus text format, None for none
+        :param clock: function returning the current time in seconds
+        :param sleep: function that waits for the given number of seconds
+        :param stderr: stream failures are reported to
+        :return: Daemon object
+        """
+        self.linode_api = linode_api
+        self.config_file = config_file
+        self.compiled_file = compiled_file
+        self.parse_processes = parse_processes
+        self.fetch_concurrency = fetch_concurrency
+        self.apply_concurrency = apply_concurrency
+        self.reuse_records = reuse_records
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.drift_interval = drift_interval
+        self.metrics_file = metrics_file
+        self.prometheus_file = prometheus_file
+        self.clock = clock
+        self.sleep = sleep
+        self.stderr = stderr
+        self.file_times = None
+        self.changed_at = None
+        self.checked_at = None
+        self.desired = None
+        self.existing = None
+
+    def run(self):
+        """
+        Loads the configuration, then polls until interrupted
+        :return: None
+        """
+        self.start()
+        while True:
+            self.sleep(self.poll_interval)
+            self.poll()
+
+    def start(self):
+        """
+        Loads the configuration. The first poll then runs a full reconcile.
+        :return: None
+        """
+        self.file_times = self.watched_file_times()
+        self.desired = update.load_desired(self.config_file, self.compiled_file, parse_processes=self.parse_processes)
+
+    def poll(self):
+        """
+        Checks the config files, and applies what is due: the changed zones once the files settled, or a full
+        reconcile. The phase times reported afterwards cover this cycle only.
+        :return: None
+        """
+        now = self.clock()
+        file_times = self.watched_file_times()
+        if file_times != self.file_times:
+            self.file_times = file_times
+            self.changed_at = now
+        worked = False
+        try:
+            if self.changed_at is not None and now - self.changed_at >= self.debounce:
+                self.changed_at = None
+                self.linode_api.metrics.reset_phases()
+                worked = True
+                self.reload()
+            if self.checked_at is None or now - self.checked_at >= self.drift_interval:
+                if not worked:
+                    self.linode_api.metrics.reset_phases()
+                worked = True
+                self.reconcile()
+        except Exception as e:
+            self.existing = None
+            self.stderr.write('Reconcile failed: ' + str(e) + '\n')
+        if worked:
+            dns_record.clear_interned()
+            self.report()
+
+    def watched_file_times(self):
+        """
+        :return: dictionary of the modification time and size of each config file, None for a missing file
+        """
+        if fragments.is_fragments(self.config_file):
+            file_names = fragments.fragment_files(self.config_file)
+        else:
+            file_names = [self.config_file]
+        file_times = {}
+        for file_name in file_names:
+            try:
+                status = os.stat(file_name)
+                file_times[file_name] = (status.st_mtime, status.st_size)
+            except OSError:
+                file_times[file_name] = None
+        return file_times
+
+    def reload(self):
+        """
+        Loads the configuration again, and applies the zones whose desired state changed. A configuration that
+        does not load is reported, and the previous one is kept.
+        :return: None
+        """
+        try:
+            desired = update.load_desired(self.config_file, self.compiled_file, parse_processes=self.parse_processes)
+        except Exception as e:
+            self.stderr.write('Loading ' + self.config_file + ' failed, keeping the previous configuration: ' +
+                             str(e) + '\n')
+            return
+        changed = changed_zones(self.desired, desired)
+        self.desired = desired
+        if self.existing is None:
+            self.checked_at = None
+        elif changed:
+            self.apply(changed)
+
+    def reconcile(self):
+        """
+        Fetches every zone from Linode and applies all differences
+        :return: None
+        """
+        self.checked_at = self.clock()
+        self.existing = None
+        with self.linode_api.metrics.phase('fetch'):
+            existing = update.get_linode_dns(self.linode_api, self.fetch_concurrency)
+        self.existing = existing
+        self.apply(set(existing) | set(self.desired))
+
+    def apply(self, domains):
+        """
+        Diffs and applies some zones, then fetches the zones that were changed again
+        :param domains: names of the zones
+        :return: None
+        :raises: a single error listing every zone whose changes failed
+        """
+        existing = dict((domain, self.existing[domain]) for domain in domains if domain in self.existing)
+        desired = dict((domain, self.desired[domain]) for domain in domains if domain in self.desired)
+        with self.linode_api.metrics.phase('diff'):
+            change_plan = update.plan_changes(existing, desired, self.reuse_records)
+        try:
+            with self.linode_api.metrics.phase('apply'):
+                update.execute_plan(self.linode_api, change_plan, self.apply_concurrency)
+        finally:
+            if not self.linode_api.dry_run:
+                self.refresh(set(zone for zone, _ in change_plan.by_zone()))
+
+    def refresh(self, domains):
+        """
+        Fetches some zones from Linode again
+        :param domains: names of the zones
+        :return: None
+        """
+        if not domains:
+            return
+        json_zones = [json_zone for json_zone in self.linode_api.list_zones() if json_zone['DOMAIN'] in domains]
+        with self.linode_api.metrics.phase('fetch'):
+            zones = update.get_linode_dns(self.linode_api, self.fetch_concurrency, json_zones=json_zones)
+        for domain in domains:
+            self.existing.pop(domain, None)
+        self.existing.update(zones)
+
+    def report(self):
+        """
+        Writes the changes logged so far, and the metrics files
+        :return: None
+        """
+        self.linode_api.change_log.flush()
+        if self.metrics_file is not None:
+            self.linode_api.metrics.save(self.metrics_file)
+        if self.prometheus_file is not None:
+            self.linode_api.metrics.save_prometheus(self.prometheus_file)
+
+
+def changed_zones(old_desired, new_desired):
+    """
+    :param old_desired: dictionary of the previously desired zones
+    :param new_desired: dictionary of the desired zones
+    :return: set of the names of the zones that were added, removed or changed
+    """
+    changed = set(old_desired) ^ set(new_desired)
+    for domain in set(old_desired) & set(new_desired):
+        if old_desired[domain].fingerprint() != new_desired[domain].fingerprint():
+            changed.add(domain)
+    return changed
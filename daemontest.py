@@ -0,0 +1,106 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import StringIO
+import os
+import shutil
+import tempfile
+import unittest
+
+import api
+import changelog
+import daemon
+import instrumentation
+import mock_server
+
+
+class DaemonTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = mock_server.MockServer()
+        self.server.start()
+        self.directory = tempfile.mkdtemp()
+        self.config_file = os.path.join(self.directory, 'config.yml')
+        shutil.copy('examples/web_and_mail_server.yml', self.config_file)
+        self.now = 1000.0
+        self.linode_api = api.Api('key', False, base_url=self.server.url,
+                                  change_log=changelog.ChangeLog(level=changelog.QUIET),
+                                  metrics=instrumentation.Metrics(clock=lambda: self.now))
+        self.stderr = StringIO.StringIO()
+        self.daemon = daemon.Daemon(self.linode_api, self.config_file, debounce=1, drift_interval=3600,
+                                    clock=lambda: self.now, stderr=self.stderr)
+
+    def tearDown(self):
+        self.linode_api.close()
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def poll(self, seconds):
+        self.now += seconds
+        self.server.mock.reset_counters()
+        self.daemon.poll()
+        return dict(self.server.mock.calls)
+
+    def test_debounced_apply(self):
+        """
+        A config change is applied once the file settles, and only to the zones that changed
+        """
+        self.daemon.start()
+        self.assertEqual(3, self.poll(0)['domain.create'])
+        self.assertEqual({}, self.poll(10))
+        with open(self.config_file, 'a') as config_file:
+            config_file.write('    A: [ { host: shop, target: testing } ]\n')
+        self.assertEqual({}, self.poll(0.5))
+        self.assertEqual({}, self.poll(0.5))
+        self.assertEqual({'domain.list': 1, 'domain.resource.create': 2, 'domain.resource.list': 1}, self.poll(1))
+        self.assertEqual({}, self.poll(10))
+
+    def test_drift(self):
+        """
+        Changes made at Linode are corrected by the periodic full reconcile
+        """
+        self.daemon.start()
+        self.poll(0)
+        resource = [resource for records in self.server.mock.resources.values() for resource in records.values()
+                    if resource[u'TYPE'] == u'A'][0]
+        target = resource[u'TARGET']
+        resource[u'TARGET'] = u'10.0.0.1'
+        self.assertEqual({}, self.poll(10))
+        self.assertEqual({'domain.list': 2, 'domain.resource.list': 4, 'domain.resource.update': 1}, self.poll(3600))
+        self.assertEqual(target, resource[u'TARGET'])
+
+    def test_phases_per_cycle(self):
+        """
+        The phase times reported after each cycle cover that cycle only
+        """
+        self.daemon.start()
+        with self.linode_api.metrics.phase('fetch'):
+            self.now += 1000
+        self.poll(0)
+        self.assertEqual({'fetch': 0, 'diff': 0, 'apply': 0}, self.linode_api.metrics.to_dict()['phases'])
+
+    def test_bad_config(self):
+        """
+        A config that does not load is reported, and the previous config is kept
+        """
+        self.daemon.start()
+        self.poll(0)
+        with open(self.config_file, 'a') as config_file:
+            config_file.write('  - [ not a zone\n')
+        self.assertEqual({}, self.poll(0))
+        self.assertEqual({}, self.poll(2))
+        self.assertEqual(3, len(self.daemon.desired))
+        self.assertTrue(self.stderr.getvalue().startswith('Loading ' + self.config_file + ' failed'))
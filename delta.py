@@ -0,0 +1,262 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""
+Whole-fleet diff. The existing and desired fleets are joined on zone name, and the records of each zone present in
+both are hash joined on their record keys: each existing record is looked up once in the desired records, and the
+desired records are only scanned for additions when some of them were not matched. An unchanged record, the
+common case, costs one dictionary lookup and a comparison of its TTL and of the few fields of its type (see
+dns_record.RECORD_TYPES). Changed fields are only listed for records that differ. Without matching, the results are
+the same as those of update.zones_delta, zone_delta, records_delta and record_delta.
+
+Records are keyed by type, name and target, so a record whose target changes looks like a delete and an add. The
+matching stage pairs such orphans back up: existing and desired records left over with the same type and name are
+matched with a minimum-cost assignment, the cost being the number of fields that differ, and each pair becomes a
+single change to the existing record. Optionally, records still left over are matched by type alone, so that their
+Linode records are reused under a new name instead of being deleted and recreated.
+"""
+
+import collections
+
+ZONE_COLUMNS = ['soa_email', 'refresh_seconds', 'retry_seconds', 'expire_seconds', 'ttl_seconds']
+RECORD_COLUMNS = ['priority', 'weight', 'port', 'protocol', 'tag', 'ttl_seconds']
+MATCH_COLUMNS = ['name', 'target'] + RECORD_COLUMNS
+
+
+class FleetDelta(object):
+    """
+    The differences between two fleets of zones
+    zones_deleted: names of zones that exist but are not desired
+    zones_updated: names of zones that exist and are desired
+    zones_added: names of zones that are desired but do not exist
+    zone_changes: dictionary of zone name to the list of changed zone fields, only for zones with changes
+    records_deleted: dictionary of zone name to the keys of records to be deleted
+    records_changed: dictionary of zone name to a dictionary of record key to the list of changed record fields,
+                     only for records with changes
+    records_added: dictionary of zone name to the keys of records to be added, not for zones to be added
+    records_matched: dictionary of zone name to a dictionary of existing record key to the pair of the desired
+                     record key it is changed into and the list of changed record fields. Matched records are in
+                     neither records_deleted nor records_added.
+    """
+    def __init__(self):
+        self.zones_deleted = []
+        self.zones_updated = []
+        self.zones_added = []
+        self.zone_changes = {}
+        self.records_deleted = {}
+        self.records_changed = {}
+        self.records_added = {}
+        self.records_matched = {}
+
+
+def zone_row(zone):
+    """
+    :param zone: a zone
+    :return: tuple of the values of the zone columns
+    """
+    return zone.soa_email, zone.refresh_seconds, zone.retry_seconds, zone.expire_seconds, zone.ttl_seconds
+
+
+def record_row(record):
+    """
+    Only the fields of the record's type (see dns_record.RECORD_TYPES) matter, so the other columns are None
+    :param record: a record
+    :return: tuple of the values of the record columns
+    """
+    fields = record.fields()
+    return tuple(getattr(record, column) if column in fields or column == 'ttl_seconds' else None
+                 for column in RECORD_COLUMNS)
+
+
+def changed_columns(existing_row, desired_row, columns):
+    """
+    :param existing_row: row of existing values
+    :param desired_row: row of desired values
+    :param columns: names of the columns in the rows
+    :return: list of the names of the columns that differ
+    """
+    return [column for column, existing, desired in zip(columns, existing_row, desired_row) if existing != desired]
+
+
+def match_row(record):
+    """
+    :param record: a record
+    :return: tuple of the values of the match columns
+    """
+    return (record.name, record.target) + record_row(record)
+
+
+def fleet_delta(existing, desired, match_records=True, reuse_records=False):
+    """
+    Computes all the differences between two fleets in one pass
+    :param existing: dictionary of existing zones
+    :param desired: dictionary of desired zones
+    :param match_records: True to turn deletes and adds of records with the same type and name into changes
+    :param reuse_records: True to also turn deletes and adds of records with the same type into changes
+    :return: FleetDelta
+    """
+    delta = FleetDelta()
+    for domain in existing:
+        if domain in desired:
+            delta.zones_updated.append(domain)
+        else:
+            delta.zones_deleted.append(domain)
+    delta.zones_added = [domain for domain in desired if domain not in existing]
+    for domain in delta.zones_updated:
+        existing_row = zone_row(existing[domain])
+        desired_row = zone_row(desired[domain])
+        if existing_row != desired_row:
+            delta.zone_changes[domain] = changed_columns(existing_row, desired_row, ZONE_COLUMNS)
+        join_records(delta, domain, existing[domain].records, desired[domain].records)
+        if match_records and domain in delta.records_deleted and domain in delta.records_added:
+            match_orphans(delta, domain, existing[domain].records, desired[domain].records, reuse_records)
+    return delta
+
+
+def join_records(delta, domain, existing_records, desired_records):
+    """
+    Joins the records of a zone, adding the differences to the delta
+    :param delta: FleetDelta to add to
+    :param domain: name of the zone
+    :param existing_records: dictionary of record key to existing record
+    :param desired_records: dictionary of record key to desired record
+    :return: None
+    """
+    deleted = []
+    changed = {}
+    for key, existing_record in existing_records.iteritems():
+        desired_record = desired_records.get(key)
+        if desired_record is None:
+            deleted.append(key)
+        elif desired_record is not existing_record and (existing_record.ttl_seconds != desired_record.ttl_seconds or
+                                                        fields_differ(existing_record, desired_record)):
+            changed[key] = changed_columns(record_row(existing_record), record_row(desired_record), RECORD_COLUMNS)
+    if deleted:
+        delta.records_deleted[domain] = deleted
+    if changed:
+        delta.records_changed[domain] = changed
+    if len(existing_records) - len(deleted) < len(desired_records):
+        delta.records_added[domain] = [key for key in desired_records if key not in existing_records]
+
+
+def fields_differ(existing_record, desired_record):
+    """
+    :param existing_record: a record
+    :param desired_record: a record of the same type
+    :return: True if any of the fields of their type differ
+    """
+    for field in existing_record.fields():
+        if getattr(existing_record, field) != getattr(desired_record, field):
+            return True
+    return False
+
+
+def match_orphans(delta, domain, existing_records, desired_records, reuse_records):
+    """
+    Pairs up the deleted and added records of a zone, moving the pairs to the matched records of the delta
+    :param delta: FleetDelta to update
+    :param domain: name of the zone
+    :param existing_records: dictionary of record key to existing record
+    :param desired_records: dictionary of record key to desired record
+    :param reuse_records: True to also pair records of the same type but different names
+    :return: None
+    """
+    deleted = sorted(delta.records_deleted[domain])
+    added = sorted(delta.records_added[domain])
+    matched = {}
+    groupings = [lambda key: (key.record_type, key.name)]
+    if reuse_records:
+        groupings.append(lambda key: key.record_type)
+    for grouping in groupings:
+        deleted_groups = collections.defaultdict(list)
+        for key in deleted:
+            deleted_groups[grouping(key)].append(key)
+        added_groups = collections.defaultdict(list)
+        for key in added:
+            added_groups[grouping(key)].append(key)
+        for group, existing_keys in deleted_groups.iteritems():
+            desired_keys = added_groups.get(group)
+            if not desired_keys:
+                continue
+            existing_rows = [match_row(existing_records[key]) for key in existing_keys]
+            desired_rows = [match_row(desired_records[key]) for key in desired_keys]
+            costs = [[len(changed_columns(existing_row, desired_row, MATCH_COLUMNS)) for desired_row in desired_rows]
+                     for existing_row in existing_rows]
+            for row, column in assignment(costs):
+                matched[existing_keys[row]] = (desired_keys[column],
+                                               changed_columns(existing_rows[row], desired_rows[column],
+                                                               MATCH_COLUMNS))
+        deleted = [key for key in deleted if key not in matched]
+        paired = set(desired_key for desired_key, _ in matched.itervalues())
+        added = [key for key in added if key not in paired]
+    delta.records_matched[domain] = matched
+    for records, keys in [(delta.records_deleted, deleted), (delta.records_added, added)]:
+        if keys:
+            records[domain] = keys
+        else:
+            del records[domain]
+
+
+def assignment(costs):
+    """
+    Minimum-cost assignment between rows and columns (the Hungarian algorithm, in O(n^2 m) time).
+    Each row is assigned a different column, or each column a different row if there are fewer columns than rows.
+    :param costs: list of rows of the cost matrix, all of the same length
+    :return: list of (row, column) pairs
+    """
+    if len(costs) > len(costs[0]):
+        transposed = [list(column) for column in zip(*costs)]
+        return sorted((row, column) for column, row in assignment(transposed))
+    rows = len(costs)
+    columns = len(costs[0])
+    infinity = float('inf')
+    row_potential = [0] * (rows + 1)
+    column_potential = [0] * (columns + 1)
+    column_row = [0] * (columns + 1)
+    previous = [0] * (columns + 1)
+    for row in range(1, rows + 1):
+        column_row[0] = row
+        current = 0
+        slack = [infinity] * (columns + 1)
+        used = [False] * (columns + 1)
+        while True:
+            used[current] = True
+            current_row = column_row[current]
+            smallest = infinity
+            next_column = 0
+            for column in range(1, columns + 1):
+                if not used[column]:
+                    cost = costs[current_row - 1][column - 1] - row_potential[current_row] - column_potential[column]
+                    if cost < slack[column]:
+                        slack[column] = cost
+                        previous[column] = current
+                    if slack[column] < smallest:
+                        smallest = slack[column]
+                        next_column = column
+            for column in range(columns + 1):
+                if used[column]:
+                    row_potential[column_row[column]] += smallest
+                    column_potential[column] -= smallest
+                else:
+                    slack[column] -= smallest
+            current = next_column
+            if column_row[current] == 0:
+                break
+        while current:
+            column_row[current] = column_row[previous[current]]
+            current = previous[current]
+    return sorted((column_row[column] - 1, column - 1) for column in range(1, columns + 1) if column_row[column])
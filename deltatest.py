@@ -0,0 +1,170 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import itertools
+import random
+import unittest
+
+import delta
+import dns_record
+import dns_zone
+import update
+
+
+def random_fleet(rng, zone_count, record_count):
+    """
+    Builds a fleet of zones with records drawn from a small pool, so two fleets built this way overlap
+    """
+    zones = {}
+    for i in rng.sample(range(zone_count * 2), zone_count):
+        domain = 'zone' + str(i) + '.com'
+        zone = dns_zone.Zone(domain, i, 'master', 'admin@' + domain, None, rng.choice([None, 3600]), None,
+                             rng.choice([None, 300]))
+        for j in rng.sample(range(record_count * 2), record_count):
+            record_type = rng.choice(['A', 'MX', 'TXT'])
+            zone.add_record(dns_record.Record(domain, i, j, record_type, 'host' + str(j), 'target' + str(j % 3),
+                                              rng.choice([10, 20]), rng.choice([0, 300])))
+        zones[domain] = zone
+    return zones
+
+
+class FleetDeltaTestCase(unittest.TestCase):
+    def test_same_as_zone_delta(self):
+        """
+        Without matching, the fleet delta finds the same changes as the zone by zone and record by record functions
+        """
+        rng = random.Random(1)
+        existing = random_fleet(rng, 30, 20)
+        desired = random_fleet(rng, 30, 20)
+        fleet = delta.fleet_delta(existing, desired, match_records=False)
+        zones = update.zones_delta(existing, desired)
+        self.assertEqual(sorted(zones[0]), sorted(fleet.zones_deleted))
+        self.assertEqual(sorted(zones[1]), sorted(fleet.zones_updated))
+        self.assertEqual(sorted(zones[2]), sorted(fleet.zones_added))
+        self.assertTrue(fleet.records_deleted and fleet.records_changed and fleet.records_added)
+        for domain in zones[1]:
+            existing_zone = existing[domain]
+            desired_zone = desired[domain]
+            self.assertEqual(update.zone_delta(existing_zone, desired_zone), fleet.zone_changes.get(domain, []))
+            records = update.records_delta(existing_zone.records, desired_zone.records)
+            self.assertEqual(sorted(records[0]), sorted(fleet.records_deleted.get(domain, [])))
+            self.assertEqual(sorted(records[2]), sorted(fleet.records_added.get(domain, [])))
+            changed = {}
+            for key in records[1]:
+                fields = update.record_delta(existing_zone.records[key], desired_zone.records[key])
+                if fields:
+                    changed[key] = fields
+            self.assertEqual(changed, fleet.records_changed.get(domain, {}))
+
+    def test_priority_only_for_mx(self):
+        """
+        Priority differences are ignored for records other than MX
+        """
+        existing = dns_zone.Zone('zone.com', None, None, None, None, None, None, None)
+        desired = dns_zone.Zone('zone.com', None, None, None, None, None, None, None)
+        for zone, priority in [(existing, 10), (desired, 20)]:
+            zone.add_record(dns_record.Record('zone.com', None, None, 'A', 'www', '1.1.1.1', priority, None))
+            zone.add_record(dns_record.Record('zone.com', None, None, 'MX', '', 'mx.zone.com', priority, None))
+        fleet = delta.fleet_delta({'zone.com': existing}, {'zone.com': desired})
+        self.assertEqual({dns_record.RecordKey('MX', '', 'mx.zone.com'): ['priority']},
+                         fleet.records_changed['zone.com'])
+
+    def test_type_fields(self):
+        """
+        The fields of each record type are compared, and only those
+        """
+        existing = dns_zone.Zone('zone.com', None, None, None, None, None, None, None)
+        desired = dns_zone.Zone('zone.com', None, None, None, None, None, None, None)
+        for zone, port in [(existing, 5060), (desired, 5061)]:
+            zone.add_record(dns_record.Record('zone.com', None, None, 'A', 'www', '1.1.1.1', None, None, port=port))
+            zone.add_record(dns_record.Record('zone.com', None, None, 'SRV', '_sip', 'sip.zone.com', 10, None, 5,
+                                              port, 'udp'))
+        fleet = delta.fleet_delta({'zone.com': existing}, {'zone.com': desired})
+        self.assertEqual({dns_record.RecordKey('SRV', '_sip', ('sip.zone.com', 'udp')): ['port']},
+                         fleet.records_changed['zone.com'])
+
+
+class MatchTestCase(unittest.TestCase):
+    def zones(self, existing_records, desired_records):
+        existing = dns_zone.Zone('zone.com', 1, None, None, None, None, None, None)
+        for resource_id, (record_type, name, target) in enumerate(existing_records):
+            existing.add_record(dns_record.Record('zone.com', 1, resource_id, record_type, name, target, None, None))
+        desired = dns_zone.Zone('zone.com', None, None, None, None, None, None, None)
+        for record_type, name, target in desired_records:
+            desired.add_record(dns_record.Record('zone.com', None, None, record_type, name, target, None, None))
+        return {'zone.com': existing}, {'zone.com': desired}
+
+    def test_target_change(self):
+        """
+        A changed target is a change to the existing record, not a delete and an add
+        """
+        existing, desired = self.zones([('A', 'www', '1.1.1.1'), ('A', 'mail', '3.3.3.3')],
+                                       [('A', 'www', '2.2.2.2'), ('A', 'mail', '3.3.3.3')])
+        fleet = delta.fleet_delta(existing, desired)
+        self.assertEqual({}, fleet.records_deleted)
+        self.assertEqual({}, fleet.records_added)
+        self.assertEqual({('A', 'www', '1.1.1.1'): (('A', 'www', '2.2.2.2'), ['target'])},
+                         fleet.records_matched['zone.com'])
+
+    def test_multi_valued(self):
+        """
+        Records of a name with several targets are paired so that the fewest fields change, and what cannot be
+        paired is still deleted or added. Records of other names are only reused when asked to.
+        """
+        existing, desired = self.zones([('A', 'www', '1.1.1.1'), ('A', 'www', '1.1.1.2'), ('MX', '', 'mx.a.com'),
+                                        ('TXT', 'old', 'v=spf1 -all')],
+                                       [('A', 'www', '1.1.1.2'), ('A', 'www', '1.1.1.3'), ('A', 'www', '1.1.1.4'),
+                                        ('MX', 'mail', 'mx.a.com'), ('TXT', 'new', 'v=spf1 -all')])
+        existing['zone.com'].records[('A', 'www', '1.1.1.1')].ttl_seconds = 300
+        desired['zone.com'].records[('A', 'www', '1.1.1.4')].ttl_seconds = 300
+        fleet = delta.fleet_delta(existing, desired)
+        self.assertEqual({('A', 'www', '1.1.1.1'): (('A', 'www', '1.1.1.4'), ['target'])},
+                         fleet.records_matched['zone.com'])
+        self.assertEqual([('MX', '', 'mx.a.com'), ('TXT', 'old', 'v=spf1 -all')],
+                         sorted(fleet.records_deleted['zone.com']))
+        self.assertEqual([('A', 'www', '1.1.1.3'), ('MX', 'mail', 'mx.a.com'), ('TXT', 'new', 'v=spf1 -all')],
+                         sorted(fleet.records_added['zone.com']))
+        fleet = delta.fleet_delta(existing, desired, reuse_records=True)
+        self.assertEqual({('A', 'www', '1.1.1.1'): (('A', 'www', '1.1.1.4'), ['target']),
+                          ('MX', '', 'mx.a.com'): (('MX', 'mail', 'mx.a.com'), ['name']),
+                          ('TXT', 'old', 'v=spf1 -all'): (('TXT', 'new', 'v=spf1 -all'), ['name'])},
+                         fleet.records_matched['zone.com'])
+        self.assertEqual({}, fleet.records_deleted)
+        self.assertEqual([('A', 'www', '1.1.1.3')], fleet.records_added['zone.com'])
+
+    def test_assignment(self):
+        """
+        The assignment has the lowest total cost, for square and rectangular matrices
+        """
+        rng = random.Random(1)
+        for rows, columns in [(1, 1), (3, 3), (4, 6), (6, 4), (5, 5)]:
+            costs = [[rng.randint(0, 4) for _ in range(columns)] for _ in range(rows)]
+            pairs = delta.assignment(costs)
+            self.assertEqual(min(rows, columns), len(pairs))
+            self.assertEqual(len(pairs), len(set(row for row, _ in pairs)))
+            self.assertEqual(len(pairs), len(set(column for _, column in pairs)))
+            if rows <= columns:
+                best = min(sum(costs[row][column] for row, column in enumerate(permutation))
+                           for permutation in itertools.permutations(range(columns), rows))
+            else:
+                best = min(sum(costs[row][column] for column, row in enumerate(permutation))
+                           for permutation in itertools.permutations(range(rows), columns))
+            self.assertEqual(best, sum(costs[row][column] for row, column in pairs))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,37 +15,167 @@
 # DEALINGS IN THE SOFTWARE.
 
 
-class Record:
+import collections
+import socket
+
+
+RecordKey = collections.namedtuple('RecordKey', ['record_type', 'name', 'target'])
+"""
+The key of a record within its zone. Records are matched between Linode and the configuration file by key.
+For types with key fields (see RecordType), target is a tuple of the target and the values of the key fields.
+"""
+
+RecordType = collections.namedtuple('RecordType', ['fields', 'key_fields'])
+"""
+What matters for a type of record, besides its type, name, target and TTL.
+fields: the other fields that are compared, sent to Linode and read back from it
+key_fields: those of the fields that tell apart records with the same type, name and target, so they are part of
+            the record key
+"""
+
+RECORD_TYPES = {
+    'A': RecordType((), ()),
+    'AAAA': RecordType((), ()),
+    'CNAME': RecordType((), ()),
+    'MX': RecordType(('priority',), ()),
+    'NS': RecordType((), ()),
+    'TXT': RecordType((), ()),
+    'SRV': RecordType(('priority', 'weight', 'port', 'protocol'), ('protocol',)),
+    'CAA': RecordType(('tag',), ('tag',)),
+}
+
+OTHER_TYPE = RecordType((), ())
+"""
+How records of types not in RECORD_TYPES are treated: by type, name, target and TTL only
+"""
+
+LINODE_FIELDS = {'priority': 'PRIORITY', 'weight': 'WEIGHT', 'port': 'PORT', 'protocol': 'PROTOCOL', 'tag': 'TAG'}
+"""
+The name of each optional field in the JSON returned by Linode
+"""
+
+
+def record_type(type_name):
+    """
+    :param type_name: name of a record type, such as MX
+    :return: its RecordType
+    """
+    return RECORD_TYPES.get(type_name, OTHER_TYPE)
+
+
+interned = {}
+
+
+def intern_value(value):
+    """
+    Returns the canonical instance of a string, so that equal names and targets repeated across records and zones
+    (a family's DKIM TXT target, the empty host name) are kept in memory once. Unlike the intern builtin this
+    accepts unicode, which is what the Linode JSON contains.
+    :param value: string to intern, or None
+    :return: the interned string
+    """
+    if value is None:
+        return None
+    return interned.setdefault(value, value)
+
+
+def clear_interned():
+    """
+    Empties the intern pool once a run is over, so that a long running process does not keep every name and
+    target it has ever seen. Strings still referenced by records stay alive; they are just no longer shared with
+    records created afterwards.
+    :return: None
+    """
+    interned.clear()
+
+
+class Record(object):
     """
     The Record class.
     domain_name: the name of the domain this record belongs to
     domain_id: the Linode ID of the domain, only filled in via the API, not for records in YAML configuration file
     resource_id: the Linode ID of the record, only filled in via the API
-    record_type: "A", "AAAA", "CNAME", "MX", or "TXT"
-    name: the host of the record
-    target: the target of the record
-    priority: the priority of the record, only used for MX
+    record_type: "A", "AAAA", "CAA", "CNAME", "MX", "NS", "SRV" or "TXT"
+    name: the host of the record, for SRV the service
+    target: the target of the record, for CAA the value
+    priority: the priority of the record, only used for MX and SRV
     ttl_seconds: the time to live seconds. 0 indicates default
+    weight: the weight of the record, only used for SRV
+    port: the port of the record, only used for SRV
+    protocol: the protocol of the record, only used for SRV
+    tag: the property tag of the record (issue, issuewild or iodef), only used for CAA
+    Which of priority, weight, port, protocol and tag a record uses depends on its type, see RECORD_TYPES.
+    Records use slots: a fleet has many of them, and a per-instance dictionary would dominate their size.
     """
-    def __init__(self, domain_name, domain_id, resource_id, record_type, name, target, priority, ttl_seconds):
-        self.domain_name = domain_name
+    __slots__ = ['domain_name', 'domain_id', 'resource_id', 'record_type', 'name', 'target', 'priority',
+                 'ttl_seconds', 'weight', 'port', 'protocol', 'tag']
+
+    def __init__(self, domain_name, domain_id, resource_id, record_type, name, target, priority, ttl_seconds,
+                 weight=None, port=None, protocol=None, tag=None):
+        self.domain_name = intern_value(domain_name)
         self.domain_id = domain_id
         self.resource_id = resource_id
-        self.record_type = record_type
-        self.name = name
-        self.target = target
+        self.record_type = intern_value(record_type)
+        self.name = intern_value(name)
+        self.target = intern_value(target)
         self.priority = priority
         self.ttl_seconds = None
         if ttl_seconds != 0:
             self.ttl_seconds = ttl_seconds
+        self.weight = weight
+        self.port = port
+        self.protocol = intern_value(protocol)
+        self.tag = intern_value(tag)
+
+    def key(self):
+        """
+        The key of the record within its zone
+        :return: RecordKey
+        """
+        key_fields = record_type(self.record_type).key_fields
+        if key_fields:
+            return RecordKey(self.record_type, self.name,
+                             (self.target,) + tuple(getattr(self, field) for field in key_fields))
+        return RecordKey(self.record_type, self.name, self.target)
+
+    def fields(self):
+        """
+        :return: names of the fields that matter for the record's type besides type, name, target and TTL
+        """
+        return record_type(self.record_type).fields
+
+
+def canonical_ipv6(address):
+    """
+    The canonical text form of an IPv6 address (RFC 5952: lower case, leading zeros dropped, longest run of zero
+    groups compressed), so that equal addresses written differently compare equal
+    :param address: IPv6 address
+    :return: the canonical form, or address itself if it is not a valid IPv6 address
+    """
+    try:
+        return socket.inet_ntop(socket.AF_INET6, socket.inet_pton(socket.AF_INET6, address))
+    except (socket.error, ValueError, AttributeError):  # AttributeError: no inet_pton here
+        return address
 
 
 def from_json(json, domain_name):
     """
-    Create a record object from the JSON returned from the Linode API
+    Create a record object from the JSON returned from the Linode API.
+    AAAA targets are put in canonical form, like those from the configuration file. Of weight, port, protocol and
+    tag, only the fields of the record's type are kept.
     :param json: JSON returned from Linode
     :param domain_name: Name of the domain/zone
     :return:
     """
-    return Record(domain_name, json['DOMAINID'], json['RESOURCEID'], json['TYPE'], json['NAME'], json['TARGET'],
-                  json['PRIORITY'], json['TTL_SEC'])
+    target = json['TARGET']
+    if json['TYPE'] == 'AAAA':
+        target = canonical_ipv6(target)
+    record = Record(domain_name, json['DOMAINID'], json['RESOURCEID'], json['TYPE'], json['NAME'], target,
+                    json['PRIORITY'], json['TTL_SEC'])
+    for field in record.fields():
+        if field != 'priority':
+            value = json.get(LINODE_FIELDS[field])
+            if isinstance(value, basestring):
+                value = intern_value(value)
+            setattr(record, field, value)
+    return record
@@ -15,7 +15,15 @@
 # DEALINGS IN THE SOFTWARE.
 
 import copy
+import dns_record
+import hashlib
 import jinja2
+import json
+
+
+TEMPLATE_RECORD_TYPES = ['CNAME', 'MX', 'NS', 'SRV', 'TXT']
+
+template_cache = {}
 
 
 class Zone:
@@ -30,14 +38,17 @@ class Zone:
     expire_seconds: expire seconds value
     ttl_seconds: time-to-live seconds value
     records: dictionary mapping record keys to records
+    families: names of the families the zone uses, in the configuration file
 
-    Record keys are the record type (A, AAAA, CNAME, MX or TXT), the host, and the target separated by colons
+    Record keys are the record type (see dns_record.RECORD_TYPES), the host, and the target (see RecordKey)
 
     All *_seconds values have 0 for default
 
-    Zone records support replacing {{ zone }} with the zone name in CNAME target fields
+    Zone records support replacing {{ zone }} with the zone name in CNAME, MX, NS, SRV and TXT target fields
 
     Zones support merging: A zone is merged with the zone representing a family when families are used
+    Records inherited from a family are shared by every zone in the family, so they must be treated as read only.
+    A zone that needs a different version of an inherited record (see instantiate) replaces it with a copy.
     """
 
     def __init__(self, domain, domain_id, domain_type, soa_email, refresh_seconds, retry_seconds, expire_seconds,
@@ -59,26 +70,51 @@ class Zone:
         if ttl_seconds != 0:
             self.ttl_seconds = ttl_seconds
         self.records = {}
+        self.families = []
 
     def add_record(self, record):
         """
-        Adds a record, creating the key
+        Adds a record, keyed by its RecordKey
         :param record: record to add
         :return: None
         """
-        self.records[record.record_type + ':' + record.name + ':' + record.target] = record
+        self.records[record.key()] = record
 
     def instantiate(self):
         """ Replaces {{ zone }} with actual zone
+        Targets change, and so do their record keys, so the records dictionary is rebuilt
         :return:
         """
-        for record_key in self.records:
-            record = self.records[record_key]
-            if record.record_type == 'CNAME':
-                self.records.pop(record_key)
-                template = jinja2.Template(record.target)
-                record.target = template.render(zone=self.domain)
-                self.add_record(record)
+        records = self.records.values()
+        self.records = {}
+        for record in records:
+            if record.record_type in TEMPLATE_RECORD_TYPES:
+                target = render_target(record.target, self.domain)
+                if target != record.target:
+                    record = copy.copy(record)
+                    record.target = dns_record.intern_value(target)
+            self.add_record(record)
+
+    def fingerprint(self):
+        """
+        Fingerprint of the zone's fields and records, the same for any two zones describing the same DNS.
+        Linode IDs are not part of the fingerprint.
+        :return: hex digest string
+        """
+        records = sorted(record_values(record) for record in self.records.values())
+        content = [self.domain, self.soa_email, self.refresh_seconds, self.retry_seconds, self.expire_seconds,
+                   self.ttl_seconds, records]
+        return hashlib.sha1(json.dumps(content, sort_keys=True)).hexdigest()
+
+    def to_dict(self):
+        """
+        The zone's fields and records as JSON types, without Linode IDs. Records are lists of their field values.
+        :return: dictionary, see from_dict
+        """
+        records = sorted(record_values(record) for record in self.records.values())
+        return {'domain': self.domain, 'fields': [self.soa_email, self.refresh_seconds, self.retry_seconds,
+                                                  self.expire_seconds, self.ttl_seconds], 'records': records,
+                'families': self.families}
 
     def merge(self, other):
         """
@@ -86,6 +122,7 @@ class Zone:
         from families. The self zone is the master zone, and fields from other that don't exist in master are
         added to master. Fields that do exist are skipped. Records that don't exist in master and do exist in
         other are added to master. No record-leve merge takes place.
+        Added records are not copied: they are shared with other, and copied only if they need to change.
         :param other: zone to take missing values from
         :return: None
         """
@@ -103,7 +140,49 @@ class Zone:
         other_records = set(other.records.keys())
         to_be_added = other_records - existing_records
         for record in to_be_added:
-            self.add_record(copy.deepcopy(other.records[record]))
+            self.add_record(other.records[record])
+
+
+def render_target(target, domain):
+    """
+    Expands {{ zone }} in a record target. Targets without templates are returned as is, without involving Jinja,
+    and compiled templates are cached by their source, so a family target shared by many zones is compiled once.
+    :param target: the target, possibly a Jinja template
+    :param domain: the zone name
+    :return: the expanded target
+    """
+    if '{{' not in target:
+        return target
+    template = template_cache.get(target)
+    if template is None:
+        template = jinja2.Template(target)
+        template_cache[target] = template
+    return template.render(zone=domain)
+
+
+def from_dict(zone_dict):
+    """
+    Create a zone object from the dictionary made by Zone.to_dict
+    :param zone_dict: dictionary from to_dict
+    :return: the zone
+    """
+    soa_email, refresh_seconds, retry_seconds, expire_seconds, ttl_seconds = zone_dict['fields']
+    domain = zone_dict['domain']
+    zone = Zone(domain, None, None, soa_email, refresh_seconds, retry_seconds, expire_seconds, ttl_seconds)
+    for record_type, name, target, priority, record_ttl_seconds, weight, port, protocol, tag in zone_dict['records']:
+        zone.add_record(dns_record.Record(domain, None, None, record_type, name, target, priority,
+                                          record_ttl_seconds, weight, port, protocol, tag))
+    zone.families = zone_dict['families']
+    return zone
+
+
+def record_values(record):
+    """
+    :param record: a record
+    :return: list of the record's field values, without Linode IDs
+    """
+    return [record.record_type, record.name, record.target, record.priority, record.ttl_seconds, record.weight,
+            record.port, record.protocol, record.tag]
 
 
 def from_json(json):
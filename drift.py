@@ -0,0 +1,217 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""
+Drift check: reports the changes made at Linode outside this program, without fetching every zone.
+The zone list (domain.list) is always fetched: it shows zones that are missing or unexpected and zones whose fields
+(SOA email, refresh, retry, expire, TTL) differ from the configuration. Records can only be checked by fetching
+each zone's records, so at most a fixed number of zones (the budget) have their records fetched per run, chosen by
+a DriftCursor kept in a state file. Over successive runs every zone is checked in turn.
+
+Drift is reported as one JSON object per line and zone: the operations that would bring the zone back in sync
+(see plan.Operation). A last line summarizes the run.
+"""
+
+
+import api
+import argparse
+import copy
+import dns_zone
+import instrumentation
+import json
+import os
+import sys
+import time
+import update
+
+
+DRIFT_VERSION = 1
+
+
+class DriftCursor:
+    """
+    Which zones had their records checked for drift, and when, kept in a JSON file between runs.
+    Zones whose records are checked next are those never checked, then those whose domain.list entry (summary)
+    changed since they were last checked, as someone edited them at Linode, then those checked longest ago. With
+    a budget of B zones per run, a fleet of N zones is covered every N / B runs.
+    """
+
+    def __init__(self, file_name=None):
+        """
+        Loads the state file, if it exists
+        :param file_name: name of the state file, None to keep no state (zones are then checked in name order)
+        :return: DriftCursor object
+        """
+        self.file_name = file_name
+        self.zones = {}
+        if file_name is not None and os.path.exists(file_name):
+            with open(file_name) as cursor_file:
+                data = json.load(cursor_file)
+            if data.get('version') == DRIFT_VERSION:
+                self.zones = data['zones']
+
+    def schedule(self, json_zones, budget):
+        """
+        :param json_zones: the zones to choose from, as returned by domain.list
+        :param budget: number of zones to choose
+        :return: the names of the zones whose records are checked next
+        """
+        def priority(json_zone):
+            entry = self.zones.get(json_zone['DOMAIN'])
+            if entry is None:
+                return 0, 0, json_zone['DOMAIN']
+            return 1 if entry['summary'] != json_zone else 2, entry['checked'], json_zone['DOMAIN']
+        return [json_zone['DOMAIN'] for json_zone in sorted(json_zones, key=priority)[:budget]]
+
+    def record(self, json_zone, checked):
+        """
+        Remembers that a zone's records were checked
+        :param json_zone: the zone's entry from domain.list
+        :param checked: time of the check
+        :return: None
+        """
+        self.zones[json_zone['DOMAIN']] = {'checked': checked, 'summary': json_zone}
+
+    def prune(self, domains):
+        """
+        Forgets the zones that no longer exist
+        :param domains: names of the zones that exist
+        :return: None
+        """
+        for domain in set(self.zones) - set(domains):
+            del self.zones[domain]
+
+    def save(self):
+        """
+        Writes the state file, if there is one
+        :return: None
+        """
+        if self.file_name is None:
+            return
+        data = {'version': DRIFT_VERSION, 'zones': self.zones}
+        instrumentation.write_atomically(self.file_name, lambda out: json.dump(data, out))
+
+
+def check_drift(linode_api, desired, cursor, budget, fetch_concurrency=1):
+    """
+    Finds the drift between Linode and the desired zones. Every zone's fields are checked, and the records of at
+    most budget zones.
+    :param linode_api: The API object
+    :param desired: dictionary of desired zones
+    :param cursor: the DriftCursor, updated but not saved
+    :param budget: number of zones whose records are fetched
+    :param fetch_concurrency: number of zones whose records are fetched at the same time
+    :return: triple of the ChangePlan that would undo the drift, the names of the zones whose records were checked,
+             and a summary dictionary: the number of zones at Linode, of zones whose records were checked, and of
+             zones whose records were never checked
+    """
+    json_zones = linode_api.list_zones()
+    cursor.prune([json_zone['DOMAIN'] for json_zone in json_zones])
+    in_both = [json_zone for json_zone in json_zones if json_zone['DOMAIN'] in desired]
+    checked = cursor.schedule(in_both, budget)
+    existing = dict((json_zone['DOMAIN'], dns_zone.from_json(json_zone)) for json_zone in json_zones)
+    update.fetch_records(linode_api, [existing[domain] for domain in checked], fetch_concurrency)
+    now = time.time()
+    for json_zone in in_both:
+        if json_zone['DOMAIN'] in checked:
+            cursor.record(json_zone, now)
+    compared = dict(desired)
+    for json_zone in in_both:
+        if json_zone['DOMAIN'] not in checked:
+            compared[json_zone['DOMAIN']] = fields_only(desired[json_zone['DOMAIN']])
+    summary = {'zones': len(json_zones), 'records_checked': len(checked),
+               'never_checked': len([json_zone for json_zone in in_both if json_zone['DOMAIN'] not in cursor.zones])}
+    return update.plan_changes(existing, compared), checked, summary
+
+
+def fields_only(zone):
+    """
+    :param zone: a zone
+    :return: a copy of the zone without its records
+    """
+    fields = copy.copy(zone)
+    fields.records = {}
+    return fields
+
+
+def report(change_plan, checked, summary, out=None):
+    """
+    Writes the drift as JSON lines: one per zone that drifted, then a summary
+    :param change_plan: the ChangePlan that would undo the drift
+    :param checked: names of the zones whose records were checked
+    :param summary: summary dictionary from check_drift, the number of zones that drifted is added
+    :param out: file to write to, None for stdout
+    :return: None
+    """
+    out = out or sys.stdout
+    checked = set(checked)
+    for zone, operations in change_plan.by_zone():
+        out.write(json.dumps({'zone': zone, 'records_checked': zone in checked,
+                              'operations': [zone_operation.to_json() for zone_operation in operations]},
+                             sort_keys=True) + '\n')
+    summary = dict(summary, drifted=len(change_plan.by_zone()))
+    out.write(json.dumps({'summary': summary}, sort_keys=True) + '\n')
+
+
+def run(api_key, config_file, budget, state_file=None, fetch_concurrency=1, compiled_file=None, parse_processes=1,
+        **api_options):
+    """
+    Runs a drift check and reports it on stdout
+    :param api_key:
+    :param config_file: config file name, or directory or glob pattern of config files
+    :param budget: number of zones whose records are fetched
+    :param state_file: file name of the DriftCursor, None to check the first zones in name order every time
+    :param fetch_concurrency: number of zones whose records are fetched at the same time
+    :param compiled_file: file name of the compiled configuration, None to always parse the YAML configuration
+    :param parse_processes: number of processes parsing the files of a configuration split across several files
+    :param api_options: keyword arguments for api.Api
+    :return: True if drift was found
+    """
+    desired = update.load_desired(config_file, compiled_file, parse_processes=parse_processes)
+    cursor = DriftCursor(state_file)
+    linode_api = api.Api(api_key, True, **api_options)
+    try:
+        change_plan, checked, summary = check_drift(linode_api, desired, cursor, budget, fetch_concurrency)
+    finally:
+        linode_api.close()
+    cursor.save()
+    report(change_plan, checked, summary)
+    return len(change_plan) > 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Report changes made at Linode that the configuration does not have")
+    parser.add_argument('api_key', help='Linode API key')
+    parser.add_argument('config_file', help='YAML config file, or a directory or glob pattern of config files')
+    parser.add_argument('--budget', type=int, default=10, metavar='N',
+                        help='Fetch the records of at most N zones per run (default 10)')
+    parser.add_argument('--state', metavar='FILE',
+                        help='Keep in FILE which zones were checked, so successive runs cover all zones')
+    parser.add_argument('--fetch-concurrency', type=int, default=1, metavar='N',
+                        help='Fetch the records of up to N zones at the same time (default 1)')
+    parser.add_argument('--batch-size', type=int, default=0, metavar='N',
+                        help='Fetch the records of up to N zones in a single batch API call (default 0: no batching)')
+    parser.add_argument('--compiled-config', metavar='FILE',
+                        help='Keep a compiled copy of the configuration in FILE, so it is only parsed when it changes')
+    parser.add_argument('--parse-processes', type=int, default=1, metavar='N',
+                        help='Parse the files of a split configuration in N processes (default 1)')
+    parser.add_argument('--api-url', default=api.LINODE_URL, metavar='URL', help='Linode API URL')
+    args = parser.parse_args()
+
+    drifted = run(args.api_key, args.config_file, args.budget, args.state, args.fetch_concurrency,
+                  args.compiled_config, args.parse_processes, batch_size=args.batch_size, base_url=args.api_url)
+    sys.exit(1 if drifted else 0)
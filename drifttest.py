@@ -0,0 +1,109 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import StringIO
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import api
+import changelog
+import drift
+import mock_server
+import update
+
+
+def json_zone(domain, soa_email='admin@zone.com'):
+    return {'DOMAIN': domain, 'DOMAINID': 1, 'SOA_EMAIL': soa_email}
+
+
+class DriftCursorTestCase(unittest.TestCase):
+    def test_schedule(self):
+        """
+        Zones never checked go first, then zones whose summary changed, then those checked longest ago
+        """
+        cursor = drift.DriftCursor()
+        cursor.record(json_zone('a.com'), 20)
+        cursor.record(json_zone('b.com'), 10)
+        cursor.record(json_zone('c.com'), 30)
+        zones = [json_zone('a.com'), json_zone('b.com'), json_zone('c.com', 'other@zone.com'), json_zone('d.com')]
+        self.assertEqual(['d.com', 'c.com', 'b.com', 'a.com'], cursor.schedule(zones, 4))
+        self.assertEqual(['d.com', 'c.com'], cursor.schedule(zones, 2))
+
+
+class CheckDriftTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = mock_server.MockServer()
+        self.server.start()
+        self.directory = tempfile.mkdtemp()
+        update.apply_delta('key', 'examples/web_and_mail_server.yml', False, base_url=self.server.url,
+                           change_log=changelog.ChangeLog(level=changelog.QUIET))
+        self.desired = update.load_desired('examples/web_and_mail_server.yml')
+        self.cursor = drift.DriftCursor(os.path.join(self.directory, 'drift.json'))
+        self.linode_api = api.Api('key', True, base_url=self.server.url)
+
+    def tearDown(self):
+        self.linode_api.close()
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def check(self, budget=1):
+        self.server.mock.reset_counters()
+        change_plan, checked, summary = drift.check_drift(self.linode_api, self.desired, self.cursor, budget)
+        self.cursor.save()
+        self.cursor = drift.DriftCursor(self.cursor.file_name)
+        return change_plan, checked, summary
+
+    def test_rotation(self):
+        """
+        Each run fetches the records of one zone, and successive runs cover the fleet
+        """
+        [resource] = [resource for records in self.server.mock.resources.values() for resource in records.values()
+                      if resource[u'NAME'] == u'production' and resource[u'TYPE'] == u'A']
+        resource[u'TARGET'] = u'10.0.0.1'
+        change_plan, checked, summary = self.check()
+        self.assertEqual(['coolcats.com'], checked)
+        self.assertEqual(0, len(change_plan))
+        self.assertEqual({'zones': 3, 'records_checked': 1, 'never_checked': 2}, summary)
+        self.assertEqual({'domain.list': 1, 'domain.resource.list': 1}, dict(self.server.mock.calls))
+        self.assertEqual(['fastcars.com'], self.check()[1])
+        change_plan, checked, summary = self.check()
+        self.assertEqual(['hostingcorp.com'], checked)
+        self.assertEqual([('hostingcorp.com', 'modify_record')],
+                         [(operation.zone, operation.action) for operation in change_plan])
+        self.assertEqual(0, summary['never_checked'])
+        self.assertEqual(['coolcats.com'], self.check()[1])
+
+    def test_zone_fields(self):
+        """
+        Zone field drift is found for every zone from the zone list alone
+        """
+        domain = [domain for domain in self.server.mock.domains.values() if domain[u'DOMAIN'] == u'fastcars.com'][0]
+        domain[u'SOA_EMAIL'] = u'someone@else.com'
+        change_plan, checked, summary = self.check(budget=0)
+        self.assertEqual([], checked)
+        self.assertEqual({'domain.list': 1}, dict(self.server.mock.calls))
+        self.assertEqual([('fastcars.com', 'modify_zone')],
+                         [(operation.zone, operation.action) for operation in change_plan])
+        out = StringIO.StringIO()
+        drift.report(change_plan, checked, summary, out)
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual('fastcars.com', lines[0]['zone'])
+        self.assertFalse(lines[0]['records_checked'])
+        self.assertEqual(1, lines[1]['summary']['drifted'])
@@ -0,0 +1,233 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import config
+import dns_zone
+import glob
+import hashlib
+import instrumentation
+import json
+import multiprocessing
+import os
+import yaml
+
+
+SHARED_SECTIONS = ['IPs', 'FQDNs', 'TXTs', 'families']
+FRAGMENTS_VERSION = 4
+
+# The Config holding the shared sections in a parsing process, set up once by the pool initializer
+worker_config = None
+
+
+def is_fragments(path):
+    """
+    :param path: config file name, directory or glob pattern
+    :return: True if path names a directory or a glob pattern rather than a single config file
+    """
+    return os.path.isdir(path) or glob.has_magic(path)
+
+
+def fragment_files(path):
+    """
+    :param path: directory or glob pattern
+    :return: sorted list of the config files it names. For a directory, these are its .yml and .yaml files.
+    """
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, '*.yml')) + glob.glob(os.path.join(path, '*.yaml')))
+    return sorted(glob.glob(path))
+
+
+class FragmentConfig:
+    """
+    A configuration split across several YAML files (fragments), for example one file per customer.
+    Each fragment has the same syntax as a single config file. The IPs, FQDNs, TXTs and families sections of all
+    fragments are merged, so a family or alias defined in one fragment can be used by zones in any other; the same
+    entry may only be defined twice if both definitions are the same. Each zone is defined in one fragment only.
+
+    Fragments are loaded and their zones parsed across a pool of processes. With a cache file, each fragment's
+    raw data and parsed zones are kept, keyed by a hash of the fragment's content: an unchanged fragment is not
+    loaded from YAML again, and its zones are not parsed again unless the merged shared sections changed.
+
+    Usage is like config.Config: get_desired_dns, desired_zone_names and iter_desired_dns.
+    """
+
+    def __init__(self, path, cache_file_name=None, processes=1):
+        """
+        Loads and parses the fragments
+        :param path: directory or glob pattern naming the fragments
+        :param cache_file_name: name of the cache file, None for no cache
+        :param processes: number of processes loading and parsing fragments, 1 to do it in this process
+        :return: FragmentConfig object
+        :raises error if no fragment is found, on conflicting definitions, and from parsing
+        """
+        self.file_names = fragment_files(path)
+        if not self.file_names:
+            raise Exception("No config files found: " + path)
+        self.cache_file_name = cache_file_name
+        self.processes = processes
+        self.loaded = 0
+        self.parsed = 0
+        self.zones = {}
+        self.parse(self.load_cache())
+
+    def load_cache(self):
+        """
+        :return: dictionary of file name to cache entry, empty if there is no cache
+        """
+        if self.cache_file_name is None or not os.path.exists(self.cache_file_name):
+            return {}
+        with open(self.cache_file_name) as cache_file:
+            data = json.load(cache_file)
+        if data.get('version') != FRAGMENTS_VERSION:
+            return {}
+        return data['files']
+
+    def parse(self, cache):
+        """
+        Loads the fragments that changed, merges the shared sections, and parses the zones that need it
+        :param cache: dictionary of file name to cache entry
+        :return: None
+        """
+        hashes = {}
+        for file_name in self.file_names:
+            with open(file_name, 'rb') as fragment_file:
+                hashes[file_name] = hashlib.sha1(fragment_file.read()).hexdigest()
+        entries = dict((file_name, cache[file_name]) for file_name in self.file_names
+                       if file_name in cache and cache[file_name]['hash'] == hashes[file_name])
+        to_load = [file_name for file_name in self.file_names if file_name not in entries]
+        for file_name, data in zip(to_load, self.map(load_fragment, to_load)):
+            entries[file_name] = {'hash': hashes[file_name], 'data': data, 'shared_hash': None, 'zones': {}}
+        self.loaded = len(to_load)
+        shared = merge_shared([(file_name, entries[file_name]['data']) for file_name in self.file_names])
+        shared_hash = hashlib.sha1(json.dumps(shared, sort_keys=True)).hexdigest()
+        to_parse = [file_name for file_name in self.file_names if entries[file_name]['shared_hash'] != shared_hash]
+        parsed = self.map(parse_fragment_zones, [entries[file_name]['data'].get('zones') or {}
+                                                 for file_name in to_parse], shared)
+        for file_name, zones in zip(to_parse, parsed):
+            entries[file_name]['shared_hash'] = shared_hash
+            entries[file_name]['zones'] = zones
+        self.parsed = len(to_parse)
+        for file_name in self.file_names:
+            for zone_name, zone_dict in entries[file_name]['zones'].iteritems():
+                if zone_name in self.zones:
+                    raise Exception("Zone " + zone_name + " is defined in more than one config file, including " +
+                                    file_name)
+                self.zones[zone_name] = dns_zone.from_dict(zone_dict)
+        if self.cache_file_name is not None and (to_load or to_parse or len(cache) != len(entries)):
+            self.save_cache(entries)
+
+    def map(self, function, items, shared=None):
+        """
+        Applies a function to items, across the process pool if there is one and there are several items
+        :param function: module level function of one item
+        :param items: list of items
+        :param shared: shared sections, set up in each process before the function runs
+        :return: list of results
+        """
+        if self.processes <= 1 or len(items) <= 1:
+            set_up_worker(shared)
+            try:
+                return map(function, items)
+            finally:
+                set_up_worker(None)
+        pool = multiprocessing.Pool(min(self.processes, len(items)), set_up_worker, (shared,))
+        try:
+            return pool.map(function, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def save_cache(self, entries):
+        """
+        Writes the cache file
+        :param entries: dictionary of file name to cache entry
+        :return: None
+        """
+        data = {'version': FRAGMENTS_VERSION, 'files': entries}
+        instrumentation.write_atomically(self.cache_file_name, lambda out: json.dump(data, out, separators=(',', ':')))
+
+    def get_desired_dns(self):
+        return self.zones
+
+    def desired_zone_names(self):
+        """
+        :return: the names of the desired zones
+        """
+        return list(self.zones.keys())
+
+    def iter_desired_dns(self):
+        """
+        :return: generator of (zone name, zone) pairs
+        """
+        for zone_name in self.zones:
+            yield zone_name, self.zones[zone_name]
+
+
+def load_fragment(file_name):
+    """
+    Loads a fragment from YAML. Runs in a pool process.
+    :param file_name: name of the fragment
+    :return: the fragment's data, an empty dictionary for an empty file
+    """
+    with open(file_name) as yaml_file:
+        data = yaml.load(yaml_file, Loader=config.SafeLoader) or {}
+    for top_level_key in data:
+        if top_level_key != 'zones' and top_level_key not in SHARED_SECTIONS:
+            raise Exception("Unrecognized top level entry in YAML file " + file_name + ": " + top_level_key)
+    return data
+
+
+def merge_shared(fragments):
+    """
+    Merges the shared sections of the fragments
+    :param fragments: list of (file name, data) pairs
+    :return: dictionary of section name to merged section
+    :raises error if an entry has different definitions
+    """
+    shared = dict((section, {}) for section in SHARED_SECTIONS)
+    defined_in = {}
+    for file_name, data in fragments:
+        for section in SHARED_SECTIONS:
+            for name, value in (data.get(section) or {}).iteritems():
+                if name in shared[section] and shared[section][name] != value:
+                    raise Exception("Conflicting definitions of " + section + " entry " + str(name) + " in " +
+                                    defined_in[(section, name)] + " and " + file_name)
+                shared[section][name] = value
+                defined_in[(section, name)] = file_name
+    return shared
+
+
+def set_up_worker(shared):
+    """
+    Builds the Config holding the shared sections that parse_fragment_zones uses. Runs once in each pool process.
+    :param shared: dictionary of section name to merged section, None to clear
+    :return: None
+    """
+    global worker_config
+    worker_config = None
+    if shared is not None:
+        worker_config = config.Config(None, lazy=True, yaml_data=shared)
+
+
+def parse_fragment_zones(raw_zones):
+    """
+    Parses the zones of a fragment. Runs in a pool process.
+    :param raw_zones: the zones section of the fragment
+    :return: dictionary of zone name to the zone's to_dict form
+    """
+    worker_config.raw_zones = raw_zones
+    return dict((zone_name, worker_config.parse_desired_zone(zone_name).to_dict()) for zone_name in raw_zones)
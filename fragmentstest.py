@@ -0,0 +1,139 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import config
+import fragments
+
+
+SHARED = '''IPs:
+  production: 1.1.1.1 2600::1111
+  testing: 2.2.2.2 2600::2222
+  production_ipv6: 2600::1111
+  testing_ipv6: 2600::2222
+FQDNs:
+  production: production.HostingCorp.com
+  testing: test.HostingCorp.com
+  mx: mx.HostingCorp.com
+TXTs:
+  DKIM: v=DKIM1; k=rsa; p=MIG...QAB
+  SPF: v=spf1 ip4:1.1.1.1 ip6:2600::1111 -all
+families:
+  admin: { SOA_email: admin@HostingCorp.com }
+  mailer:
+    MX: [ { host: , target: mx, priority: 10 } ]
+    TXT: [ { host: , target: SPF }, { host: mail._domainkey, target: DKIM } ]
+'''
+
+HOSTINGCORP = '''zones:
+  hostingcorp.com:
+    families: [ admin, mailer ]
+    A:
+      - { host: production, target: production }
+      - { host: testing, target: testing }
+      - { host: mx, target: production }
+      - { host: ipv6, target: production_ipv6 }
+      - { host: ipv6test, target: testing_ipv6 }
+'''
+
+CUSTOMERS = '''families:
+  web:
+    A: [ { host: , target: production } ]
+    CNAME:
+      - { host: www, target: "{{ zone }}" }
+      - { host: test, target: testing }
+      - { host: ipv6, target: ipv6.HostingCorp.com }
+      - { host: ipv6test, target: ipv6test.HostingCorp.com }
+zones:
+  fastcars.com:
+    families: [ admin, mailer, web ]
+  coolcats.com:
+    families: [ admin, mailer, web ]
+'''
+
+
+class FragmentConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config_directory = os.path.join(self.directory, 'config')
+        os.mkdir(self.config_directory)
+        for file_name, content in [('shared.yml', SHARED), ('hostingcorp.yml', HOSTINGCORP),
+                                   ('customers.yaml', CUSTOMERS)]:
+            self.write(file_name, content)
+        self.cache_file = os.path.join(self.directory, 'cache.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, file_name, content):
+        with open(os.path.join(self.config_directory, file_name), 'w') as fragment_file:
+            fragment_file.write(content)
+
+    def assertSameZones(self, expected, actual):
+        self.assertEqual(sorted((name, zone.fingerprint()) for name, zone in expected.items()),
+                         sorted((name, zone.fingerprint()) for name, zone in actual.items()))
+
+    def test_fragments(self):
+        """
+        Fragments give the same zones as the single file they were split from, with or without a process pool
+        """
+        single = config.Config('examples/web_and_mail_server.yml').get_desired_dns()
+        self.assertSameZones(single, fragments.FragmentConfig(self.config_directory).get_desired_dns())
+        pattern = os.path.join(self.config_directory, '*.y*ml')
+        self.assertTrue(fragments.is_fragments(pattern))
+        self.assertSameZones(single, fragments.FragmentConfig(pattern, processes=3).get_desired_dns())
+
+    def test_cache(self):
+        """
+        Unchanged fragments are neither loaded nor parsed again, unless the shared sections changed
+        """
+        single = config.Config('examples/web_and_mail_server.yml').get_desired_dns()
+        fragment_config = fragments.FragmentConfig(self.config_directory, self.cache_file)
+        self.assertEqual((3, 3), (fragment_config.loaded, fragment_config.parsed))
+        fragment_config = fragments.FragmentConfig(self.config_directory, self.cache_file)
+        self.assertEqual((0, 0), (fragment_config.loaded, fragment_config.parsed))
+        self.assertSameZones(single, fragment_config.get_desired_dns())
+        self.write('hostingcorp.yml', HOSTINGCORP + '      - { host: new, target: testing }\n')
+        fragment_config = fragments.FragmentConfig(self.config_directory, self.cache_file)
+        self.assertEqual((1, 1), (fragment_config.loaded, fragment_config.parsed))
+        self.write('shared.yml', SHARED.replace('1.1.1.1 2600', '1.1.1.2 2600'))
+        fragment_config = fragments.FragmentConfig(self.config_directory, self.cache_file)
+        self.assertEqual((1, 3), (fragment_config.loaded, fragment_config.parsed))
+        self.assertTrue(('A', '', '1.1.1.2') in fragment_config.get_desired_dns()['fastcars.com'].records)
+
+    def test_conflicts(self):
+        """
+        Shared entries may only be redefined identically, and a zone is only defined once
+        """
+        self.write('again.yml', 'FQDNs:\n  mx: mx.HostingCorp.com\n')
+        fragments.FragmentConfig(self.config_directory)
+        self.write('again.yml', 'FQDNs:\n  mx: mx2.HostingCorp.com\n')
+        with self.assertRaises(Exception) as context:
+            fragments.FragmentConfig(self.config_directory)
+        self.assertTrue(context.exception.message.startswith('Conflicting definitions of FQDNs entry mx'))
+        self.write('again.yml', 'zones:\n  fastcars.com: { families: [ admin ] }\n')
+        with self.assertRaises(Exception) as context:
+            fragments.FragmentConfig(self.config_directory)
+        self.assertTrue(context.exception.message.startswith('Zone fastcars.com is defined in more than one'))
+
+
+if __name__ == '__main__':
+    unittest.main()
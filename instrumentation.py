@@ -0,0 +1,227 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import bisect
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+PROMETHEUS_PREFIX = 'linode_dns_'
+METRICS_VERSION = 1
+
+
+class Metrics:
+    """
+    Instrumentation of a run: the wall time of each phase (loading the config, fetching, diffing, applying), and
+    for each API action the number of HTTP requests, their latency as a histogram, and the bytes sent and
+    received. Other events, such as retries and seconds spent throttled, are kept as named counters.
+    Metrics can be written as a short text summary, as JSON, and in the Prometheus text exposition format (for the
+    node exporter's textfile collector). Requests may be recorded from several threads.
+    """
+
+    def __init__(self, clock=time.time):
+        """
+        :param clock: function returning the current time in seconds, used to time the phases
+        :return: Metrics object
+        """
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()
+        self.phases = collections.OrderedDict()
+        self.requests = collections.Counter()
+        self.latency_buckets = {}
+        self.latency_sum = collections.Counter()
+        self.bytes_sent = collections.Counter()
+        self.bytes_received = collections.Counter()
+
+    def count(self, name, amount=1):
+        """
+        Adds to a counter
+        :param name: name of the counter, for example retries or throttled_seconds
+        :param amount: amount to add
+        :return: None
+        """
+        with self.lock:
+            self.counters[name] += amount
+
+    def request(self, action, seconds, bytes_sent, bytes_received):
+        """
+        Records an HTTP request to the API
+        :param action: the API action
+        :param seconds: the request's latency
+        :param bytes_sent: size of the request's URL and body
+        :param bytes_received: size of the response body
+        :return: None
+        """
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self.lock:
+            self.requests[action] += 1
+            if action not in self.latency_buckets:
+                self.latency_buckets[action] = [0] * (len(LATENCY_BUCKETS) + 1)
+            self.latency_buckets[action][bucket] += 1
+            self.latency_sum[action] += seconds
+            self.bytes_sent[action] += bytes_sent
+            self.bytes_received[action] += bytes_received
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Times a phase of the run, adding to its wall time
+        :param name: name of the phase
+        """
+        start = self.clock()
+        try:
+            yield
+        finally:
+            elapsed = self.clock() - start
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0) + elapsed
+
+    def reset_phases(self):
+        """
+        Forgets the phase times, so that they cover the next run only (a daemon calls this before each cycle)
+        :return: None
+        """
+        with self.lock:
+            self.phases.clear()
+
+    def to_dict(self):
+        """
+        :return: the metrics as a dictionary of JSON types
+        """
+        with self.lock:
+            actions = {}
+            for action in self.requests:
+                actions[action] = {'requests': self.requests[action], 'latency_seconds': self.latency_sum[action],
+                                   'latency_buckets': dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'],
+                                                               self.latency_buckets[action])),
+                                   'bytes_sent': self.bytes_sent[action],
+                                   'bytes_received': self.bytes_received[action]}
+            return {'version': METRICS_VERSION, 'time': time.time(), 'phases': dict(self.phases),
+                    'counters': dict(self.counters), 'actions': actions}
+
+    def summary(self):
+        """
+        :return: the metrics as lines of text
+        """
+        with self.lock:
+            lines = ['Phases: ' + (', '.join('%s %.3f s' % (name, seconds) for name, seconds in self.phases.items())
+                                   or 'none')]
+            for action in sorted(self.requests):
+                lines.append('%-24s %6d requests %10.3f s %10d bytes sent %10d bytes received' %
+                             (action, self.requests[action], self.latency_sum[action], self.bytes_sent[action],
+                              self.bytes_received[action]))
+            if self.counters:
+                lines.append('Counters: ' + ', '.join('%s %s' % (name, format_number(self.counters[name]))
+                                                      for name in sorted(self.counters)))
+            return lines
+
+    def prometheus(self):
+        """
+        :return: the metrics in the Prometheus text exposition format
+        """
+        lines = []
+        with self.lock:
+            add_family(lines, 'phase_duration_seconds', 'gauge', 'Wall time of each phase of the last run',
+                       [('{phase="%s"}' % name, seconds) for name, seconds in self.phases.items()])
+            add_family(lines, 'api_requests_total', 'counter', 'HTTP requests to the Linode API',
+                       [('{action="%s"}' % action, self.requests[action]) for action in sorted(self.requests)])
+            samples = []
+            for action in sorted(self.requests):
+                cumulative = 0
+                for bound, count in zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'],
+                                        self.latency_buckets[action]):
+                    cumulative += count
+                    samples.append(('_bucket{action="%s",le="%s"}' % (action, bound), cumulative))
+                samples.append(('_sum{action="%s"}' % action, self.latency_sum[action]))
+                samples.append(('_count{action="%s"}' % action, self.requests[action]))
+            add_family(lines, 'api_request_duration_seconds', 'histogram', 'Latency of HTTP requests to the Linode API',
+                       samples)
+            add_family(lines, 'api_sent_bytes_total', 'counter', 'Bytes sent to the Linode API',
+                       [('{action="%s"}' % action, self.bytes_sent[action]) for action in sorted(self.requests)])
+            add_family(lines, 'api_received_bytes_total', 'counter', 'Bytes received from the Linode API',
+                       [('{action="%s"}' % action, self.bytes_received[action]) for action in sorted(self.requests)])
+            for name in sorted(self.counters):
+                add_family(lines, name + '_total', 'counter', 'Total ' + name.replace('_', ' '),
+                           [('', self.counters[name])])
+        return '\n'.join(lines) + '\n'
+
+    def save(self, file_name):
+        """
+        Writes the metrics as JSON
+        :param file_name: name of the file
+        :return: None
+        """
+        write_atomically(file_name, json.dumps(self.to_dict(), sort_keys=True))
+
+    def save_prometheus(self, file_name):
+        """
+        Writes the metrics in the Prometheus text format. The file is replaced in one step, as the textfile
+        collector requires.
+        :param file_name: name of the file, which should end in .prom
+        :return: None
+        """
+        write_atomically(file_name, self.prometheus())
+
+
+def add_family(lines, name, metric_type, help_text, samples):
+    """
+    Adds a metric family in the Prometheus text format
+    :param lines: list of lines to add to
+    :param name: name of the metric, without the prefix
+    :param metric_type: counter, gauge or histogram
+    :param help_text: description of the metric
+    :param samples: list of (suffix and labels, value) pairs
+    :return: None
+    """
+    if not samples:
+        return
+    lines.append('# HELP ' + PROMETHEUS_PREFIX + name + ' ' + help_text)
+    lines.append('# TYPE ' + PROMETHEUS_PREFIX + name + ' ' + metric_type)
+    for labels, value in samples:
+        lines.append(PROMETHEUS_PREFIX + name + labels + ' ' + format_number(value))
+
+
+def format_number(value):
+    """
+    :param value: an int or a float
+    :return: the value as text, floats with millisecond precision or better
+    """
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+def write_atomically(file_name, content):
+    """
+    Writes a file in one step, so that readers never see a partial file and an interrupted write leaves the old file
+    :param file_name: name of the file
+    :param content: the text to write, or a function writing to the open file (such as a json.dump of large data)
+    :return: None
+    """
+    temporary_name = file_name + '.tmp'
+    with open(temporary_name, 'w') as out:
+        if callable(content):
+            content(out)
+        else:
+            out.write(content)
+    os.rename(temporary_name, file_name)
@@ -0,0 +1,125 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import instrumentation
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.metrics = instrumentation.Metrics()
+        self.metrics.request('domain.list', 0.02, 100, 2000)
+        self.metrics.request('domain.list', 3, 100, 1000)
+        self.metrics.request('batch', 0.001, 500, 50)
+        self.metrics.count('retries')
+        with self.metrics.phase('fetch'):
+            pass
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_request(self):
+        """
+        Requests are counted per action, with their latency in the matching bucket
+        """
+        self.assertEqual(2, self.metrics.requests['domain.list'])
+        self.assertEqual(200, self.metrics.bytes_sent['domain.list'])
+        self.assertEqual(3000, self.metrics.bytes_received['domain.list'])
+        buckets = self.metrics.latency_buckets['domain.list']
+        self.assertEqual(1, buckets[instrumentation.LATENCY_BUCKETS.index(0.025)])
+        self.assertEqual(1, buckets[instrumentation.LATENCY_BUCKETS.index(5)])
+        self.assertEqual(2, sum(buckets))
+        self.assertIn('fetch', self.metrics.phases)
+
+    def test_phase(self):
+        """
+        Phases are timed with the metrics clock, and repeated phases add up
+        """
+        now = [10.0]
+        metrics = instrumentation.Metrics(clock=lambda: now[0])
+        for seconds in [1.5, 2]:
+            with metrics.phase('fetch'):
+                now[0] += seconds
+        with metrics.phase('apply'):
+            now[0] += 0.25
+        self.assertEqual({'fetch': 3.5, 'apply': 0.25}, metrics.to_dict()['phases'])
+        metrics.reset_phases()
+        self.assertEqual({}, metrics.to_dict()['phases'])
+
+    def test_prometheus(self):
+        """
+        Histogram buckets are cumulative, and each family has its help and type
+        """
+        text = self.metrics.prometheus()
+        self.assertIn('# TYPE linode_dns_api_request_duration_seconds histogram\n', text)
+        self.assertIn('linode_dns_api_request_duration_seconds_bucket{action="domain.list",le="0.01"} 0\n', text)
+        self.assertIn('linode_dns_api_request_duration_seconds_bucket{action="domain.list",le="0.025"} 1\n', text)
+        self.assertIn('linode_dns_api_request_duration_seconds_bucket{action="domain.list",le="+Inf"} 2\n', text)
+        self.assertIn('linode_dns_api_request_duration_seconds_count{action="domain.list"} 2\n', text)
+        self.assertIn('linode_dns_api_requests_total{action="batch"} 1\n', text)
+        self.assertIn('linode_dns_retries_total 1\n', text)
+        self.assertIn('linode_dns_phase_duration_seconds{phase="fetch"} ', text)
+
+    def test_save(self):
+        """
+        Metrics are written as JSON and Prometheus text, without leaving temporary files
+        """
+        json_file = os.path.join(self.directory, 'metrics.json')
+        prometheus_file = os.path.join(self.directory, 'metrics.prom')
+        self.metrics.save(json_file)
+        self.metrics.save_prometheus(prometheus_file)
+        with open(json_file) as saved:
+            saved_metrics = json.load(saved)
+        self.assertEqual(instrumentation.METRICS_VERSION, saved_metrics['version'])
+        self.assertEqual(2, saved_metrics['actions']['domain.list']['requests'])
+        self.assertEqual({'retries': 1}, saved_metrics['counters'])
+        with open(prometheus_file) as saved:
+            self.assertEqual(self.metrics.prometheus(), saved.read())
+        self.assertEqual(['metrics.json', 'metrics.prom'], sorted(os.listdir(self.directory)))
+
+    def test_write_atomically(self):
+        """
+        A file can be written from text or by a function writing to it, and a failed write leaves the old file
+        """
+        file_name = os.path.join(self.directory, 'data.json')
+        instrumentation.write_atomically(file_name, '{}')
+        instrumentation.write_atomically(file_name, lambda out: json.dump({'zones': 1}, out))
+        with open(file_name) as saved:
+            self.assertEqual({'zones': 1}, json.load(saved))
+
+        def fail(out):
+            out.write('{"zo')
+            raise IOError('disk full')
+        self.assertRaises(IOError, instrumentation.write_atomically, file_name, fail)
+        with open(file_name) as saved:
+            self.assertEqual({'zones': 1}, json.load(saved))
+
+    def test_summary(self):
+        """
+        The summary has a line for the phases, one per action, and one for the counters
+        """
+        lines = self.metrics.summary()
+        self.assertEqual(4, len(lines))
+        self.assertTrue(lines[0].startswith('Phases: fetch '))
+        self.assertTrue(lines[1].startswith('batch '))
+        self.assertEqual('Counters: retries 1', lines[3])
@@ -0,0 +1,360 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""
+A local stand-in for the Linode DNS API, for testing and benchmarking without a Linode account.
+It implements domain.list, domain.create, domain.update, domain.delete, domain.resource.list,
+domain.resource.create, domain.resource.update, domain.resource.delete and api.batch, keeping zones and
+records in memory. Responses can be slowed down and errors injected.
+
+Run it on its own and point update.py at it with --api-url:
+    python mock_server.py --port 8080 --latency 0.05
+    python update.py --api-url http://127.0.0.1:8080/ anykey config.yml
+"""
+
+
+import BaseHTTPServer
+import SocketServer
+import argparse
+import collections
+import json
+import random
+import threading
+import time
+import urlparse
+
+
+RATE_LIMIT_ERROR = 14
+
+
+class MockLinode:
+    """
+    The state of the stand-in API: zones and records, plus counters of the calls made.
+    domains: mapping from DomainID to the zone, in the JSON form domain.list returns
+    resources: mapping from DomainID to a mapping from ResourceID to the record, in the JSON form
+               domain.resource.list returns
+    requests: number of HTTP requests answered
+    connections: number of HTTP connections accepted
+    calls: mapping from action to the number of times it was called, including calls inside api.batch
+    latency: seconds each HTTP request is delayed
+    error_rate: fraction of calls answered with an ERRORARRAY entry (error_code)
+    server_error_rate: fraction of HTTP requests answered with HTTP 500
+    """
+
+    def __init__(self, latency=0, error_rate=0, server_error_rate=0, error_code=RATE_LIMIT_ERROR, seed=None):
+        """
+        :param latency: seconds each HTTP request is delayed
+        :param error_rate: fraction of calls answered with an error
+        :param server_error_rate: fraction of HTTP requests answered with HTTP 500
+        :param error_code: the Linode ERRORCODE of injected errors
+        :param seed: seed for choosing which calls fail, for repeatable runs
+        :return: MockLinode object
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.server_error_rate = server_error_rate
+        self.error_code = error_code
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.domains = collections.OrderedDict()
+        self.resources = {}
+        self.next_id = 1
+        self.requests = 0
+        self.connections = 0
+        self.calls = collections.Counter()
+
+    def reset_counters(self):
+        """
+        Zeroes the call counters
+        :return: None
+        """
+        with self.lock:
+            self.requests = 0
+            self.connections = 0
+            self.calls = collections.Counter()
+
+    def add_domain(self, domain, soa_email, ttl_sec=0):
+        """
+        Adds a zone directly, without counting a call. Used to set up fleets.
+        :return: the new DomainID
+        """
+        with self.lock:
+            return self.create_domain({'domain': domain, 'soa_email': soa_email, 'ttl_sec': ttl_sec})['DomainID']
+
+    def add_resource(self, domain_id, record_type, name, target, priority=0, ttl_sec=0):
+        """
+        Adds a record directly, without counting a call. Used to set up fleets.
+        :return: the new ResourceID
+        """
+        with self.lock:
+            return self.create_resource({'domainid': domain_id, 'type': record_type, 'name': name,
+                                         'target': target, 'priority': priority,
+                                         'ttl_sec': ttl_sec})['ResourceID']
+
+    def new_id(self):
+        new_id = self.next_id
+        self.next_id += 1
+        return new_id
+
+    def connection(self):
+        """
+        Counts a new HTTP connection
+        :return: None
+        """
+        with self.lock:
+            self.connections += 1
+
+    def server_error(self):
+        """
+        :return: True if the current HTTP request should fail with HTTP 500
+        """
+        with self.lock:
+            self.requests += 1
+            return self.random.random() < self.server_error_rate
+
+    def handle(self, action, params):
+        """
+        Answers a single HTTP request
+        :param action: the api_action
+        :param params: the request parameters, names in lower case
+        :return: the JSON response
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        if action == 'api.batch':
+            try:
+                request_array = json.loads(params.get('api_requestarray', ''))
+            except ValueError:
+                return response(action, error=(11, 'RequestArray isn\'t valid JSON or WDDX'))
+            results = []
+            for item in request_array:
+                item = dict((name.lower(), value) for name, value in item.items())
+                results.append(self.call(item.pop('api_action', ''), item))
+            return results
+        return self.call(action, params)
+
+    def call(self, action, params):
+        """
+        Answers a single API call
+        :param action: the api_action
+        :param params: the call parameters, names in lower case
+        :return: the JSON response
+        """
+        with self.lock:
+            self.calls[action] += 1
+            if self.random.random() < self.error_rate:
+                return response(action, error=(self.error_code, 'Injected error'))
+            handlers = {'domain.list': self.list_domains, 'domain.create': self.create_domain,
+                        'domain.update': self.update_domain, 'domain.delete': self.delete_domain,
+                        'domain.resource.list': self.list_resources, 'domain.resource.create': self.create_resource,
+                        'domain.resource.update': self.update_resource,
+                        'domain.resource.delete': self.delete_resource}
+            if action not in handlers:
+                return response(action, error=(3, 'The requested class does not exist'))
+            try:
+                return response(action, handlers[action](params))
+            except KeyError as e:
+                return response(action, error=(6, 'A required property is missing for this action: ' + str(e)))
+            except LookupError:
+                return response(action, error=(5, 'Object not found'))
+
+    def domain(self, params):
+        domain_id = int(params['domainid'])
+        if domain_id not in self.domains:
+            raise LookupError(domain_id)
+        return domain_id
+
+    def list_domains(self, params):
+        return list(self.domains.values())
+
+    def create_domain(self, params):
+        domain_id = self.new_id()
+        self.domains[domain_id] = {u'DOMAINID': domain_id, u'DOMAIN': params['domain'],
+                                   u'TYPE': params.get('type', 'master'), u'SOA_EMAIL': params.get('soa_email', ''),
+                                   u'REFRESH_SEC': 0, u'RETRY_SEC': 0, u'EXPIRE_SEC': 0, u'TTL_SEC': 0,
+                                   u'STATUS': 1, u'DESCRIPTION': u'', u'MASTER_IPS': u'', u'AXFR_IPS': u'none',
+                                   u'LPM_DISPLAYGROUP': u''}
+        self.resources[domain_id] = collections.OrderedDict()
+        self.update_domain(dict(params, domainid=domain_id))
+        return {'DomainID': domain_id}
+
+    def update_domain(self, params):
+        domain_id = self.domain(params)
+        for param, field in [('soa_email', u'SOA_EMAIL'), ('refresh_sec', u'REFRESH_SEC'),
+                             ('retry_sec', u'RETRY_SEC'), ('expire_sec', u'EXPIRE_SEC'), ('ttl_sec', u'TTL_SEC')]:
+            if param in params:
+                value = params[param]
+                if field != u'SOA_EMAIL':
+                    value = int(value or 0)
+                self.domains[domain_id][field] = value
+        return {'DomainID': domain_id}
+
+    def delete_domain(self, params):
+        domain_id = self.domain(params)
+        del self.domains[domain_id]
+        del self.resources[domain_id]
+        return {'DomainID': domain_id}
+
+    def list_resources(self, params):
+        return list(self.resources[self.domain(params)].values())
+
+    def create_resource(self, params):
+        domain_id = self.domain(params)
+        resource_id = self.new_id()
+        self.resources[domain_id][resource_id] = {u'DOMAINID': domain_id, u'RESOURCEID': resource_id,
+                                                  u'TYPE': params['type'].upper(), u'NAME': u'', u'TARGET': u'',
+                                                  u'PRIORITY': 0, u'WEIGHT': 0, u'PORT': 0, u'PROTOCOL': u'',
+                                                  u'TAG': u'', u'TTL_SEC': 0}
+        self.update_resource(dict(params, resourceid=resource_id))
+        return {'ResourceID': resource_id}
+
+    def update_resource(self, params):
+        domain_id = self.domain(params)
+        resource_id = int(params['resourceid'])
+        if resource_id not in self.resources[domain_id]:
+            raise LookupError(resource_id)
+        resource = self.resources[domain_id][resource_id]
+        for param, field in [('name', u'NAME'), ('target', u'TARGET'), ('protocol', u'PROTOCOL'), ('tag', u'TAG'),
+                             ('priority', u'PRIORITY'), ('weight', u'WEIGHT'), ('port', u'PORT'),
+                             ('ttl_sec', u'TTL_SEC')]:
+            if param in params:
+                value = params[param]
+                if field in (u'PRIORITY', u'WEIGHT', u'PORT', u'TTL_SEC'):
+                    value = int(value or 0)
+                resource[field] = value
+        return {'ResourceID': resource_id}
+
+    def delete_resource(self, params):
+        domain_id = self.domain(params)
+        resource_id = int(params['resourceid'])
+        if resource_id not in self.resources[domain_id]:
+            raise LookupError(resource_id)
+        del self.resources[domain_id][resource_id]
+        return {'ResourceID': resource_id}
+
+
+def response(action, data=None, error=None):
+    """
+    Builds a Linode API response
+    :param action: the api_action
+    :param data: the DATA of a successful call
+    :param error: (ERRORCODE, ERRORMESSAGE) pair for a failed call
+    :return: the JSON response
+    """
+    errors = []
+    if error is not None:
+        errors.append({'ERRORCODE': error[0], 'ERRORMESSAGE': error[1]})
+        data = {}
+    return {'ACTION': action, 'DATA': data, 'ERRORARRAY': errors}
+
+
+class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Translates HTTP GET and POST requests into MockLinode calls
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.mock.connection()
+
+    def do_GET(self):
+        self.answer(urlparse.urlparse(self.path).query)
+
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        self.answer(urlparse.urlparse(self.path).query + '&' + self.rfile.read(length))
+
+    def answer(self, query):
+        mock = self.server.mock
+        if mock.server_error():
+            self.send_response(500)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        params = dict((name.lower(), values[-1])
+                      for name, values in urlparse.parse_qs(query, keep_blank_values=True).items())
+        body = json.dumps(mock.handle(params.pop('api_action', ''), params))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, message_format, *args):
+        pass
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class MockServer:
+    """
+    Serves a MockLinode over HTTP from a background thread.
+    Usage: create, start, point api.Api at url, and stop when done.
+    """
+
+    def __init__(self, mock=None, host='127.0.0.1', port=0):
+        """
+        :param mock: the MockLinode to serve, a new empty one if None
+        :param host: address to listen on
+        :param port: port to listen on, 0 picks a free port
+        :return: MockServer object
+        """
+        self.mock = mock or MockLinode()
+        self.server = ThreadingHTTPServer((host, port), RequestHandler)
+        self.server.mock = self.mock
+        self.url = 'http://' + host + ':' + str(self.server.server_address[1]) + '/'
+        self.thread = None
+
+    def start(self):
+        """
+        Starts serving in a background thread, checking for a stop request every 50 ms so stopping is quick
+        :return: None
+        """
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops serving
+        :return: None
+        """
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the Linode DNS API")
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('--latency', type=float, default=0, metavar='SECONDS', help='Delay for each HTTP request')
+    parser.add_argument('--error-rate', type=float, default=0, metavar='FRACTION',
+                        help='Fraction of calls answered with an API error')
+    parser.add_argument('--server-error-rate', type=float, default=0, metavar='FRACTION',
+                        help='Fraction of HTTP requests answered with HTTP 500')
+    parser.add_argument('--error-code', type=int, default=RATE_LIMIT_ERROR, help='ERRORCODE of injected API errors')
+    args = parser.parse_args()
+
+    server = MockServer(MockLinode(args.latency, args.error_rate, args.server_error_rate, args.error_code),
+                        port=args.port)
+    print "Serving on " + server.url
+    server.server.serve_forever()
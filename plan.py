@@ -0,0 +1,172 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import collections
+import json
+
+
+ADD_ZONE = 'add_zone'
+DELETE_ZONE = 'delete_zone'
+MODIFY_ZONE = 'modify_zone'
+ADD_RECORD = 'add_record'
+DELETE_RECORD = 'delete_record'
+MODIFY_RECORD = 'modify_record'
+ACTIONS = [ADD_ZONE, DELETE_ZONE, MODIFY_ZONE, ADD_RECORD, DELETE_RECORD, MODIFY_RECORD]
+
+ZONE_FIELDS = ['soa_email', 'refresh_seconds', 'retry_seconds', 'expire_seconds', 'ttl_seconds']
+RECORD_FIELDS = ['record_type', 'name', 'target', 'priority', 'ttl_seconds', 'weight', 'port', 'protocol', 'tag']
+
+PLAN_VERSION = 1
+
+
+class Operation(collections.namedtuple('Operation', ['action', 'zone', 'domain_id', 'resource_id', 'values',
+                                                     'changes'])):
+    """
+    A single change to make at Linode. Operations are immutable.
+    action: one of the ACTIONS
+    zone: the name of the zone the change is in
+    domain_id: the Linode ID of the zone, None for a zone that is added by the plan
+    resource_id: the Linode ID of the record, only for record deletes and modifies
+    values: tuple of (field, value) pairs. For zone and record adds these are the values of the new zone or record,
+            for record deletes and modifies they identify the existing record, and for zone deletes and modifies
+            they are empty
+    changes: tuple of (field, old value, new value) triples, only for modifies
+    """
+    __slots__ = ()
+
+    def value(self, field):
+        """
+        :param field: name of a zone or record field
+        :return: the value of the field in values, None if it is missing
+        """
+        for name, value in self.values:
+            if name == field:
+                return value
+        return None
+
+    def to_json(self):
+        """
+        :return: the operation as a JSON compatible dictionary
+        """
+        return {'action': self.action, 'zone': self.zone, 'domain_id': self.domain_id,
+                'resource_id': self.resource_id, 'values': dict(self.values),
+                'changes': [list(change) for change in self.changes]}
+
+
+def operation(action, zone, domain_id=None, resource_id=None, values=(), changes=()):
+    """
+    Create an operation
+    :param action: one of the ACTIONS
+    :param zone: name of the zone
+    :param domain_id: Linode ID of the zone
+    :param resource_id: Linode ID of the record
+    :param values: (field, value) pairs or a dictionary
+    :param changes: (field, old value, new value) triples
+    :return: Operation
+    :raises error for an unknown action
+    """
+    if action not in ACTIONS:
+        raise Exception("Unrecognized plan action: " + str(action))
+    if isinstance(values, dict):
+        values = sorted(values.items())
+    return Operation(action, zone, domain_id, resource_id, tuple(tuple(value) for value in values),
+                     tuple(tuple(change) for change in changes))
+
+
+def operation_from_json(json_operation):
+    """
+    Create an operation from its JSON form
+    :param json_operation: dictionary as produced by Operation.to_json
+    :return: Operation
+    """
+    return operation(json_operation['action'], json_operation['zone'], json_operation.get('domain_id'),
+                     json_operation.get('resource_id'), json_operation.get('values', {}),
+                     json_operation.get('changes', []))
+
+
+class ChangePlan:
+    """
+    An immutable, ordered list of operations that brings Linode in sync with the desired configuration.
+    Operations for a zone are contiguous and in the order they must be applied: the zone operation first, then
+    record deletes, record modifies and record adds. Zones are independent of each other.
+
+    A plan can be saved as JSON and applied later without fetching from Linode or parsing the configuration again.
+    It refers to zones and records by their Linode IDs, so it should be applied before anything else changes them.
+    """
+
+    def __init__(self, operations):
+        """
+        :param operations: iterable of Operation
+        :return: ChangePlan object
+        """
+        self.operations = tuple(operations)
+
+    def __len__(self):
+        return len(self.operations)
+
+    def __iter__(self):
+        return iter(self.operations)
+
+    def by_zone(self):
+        """
+        Groups the operations by zone
+        :return: list of (zone name, list of operations) pairs, in plan order
+        """
+        groups = collections.OrderedDict()
+        for zone_operation in self.operations:
+            groups.setdefault(zone_operation.zone, []).append(zone_operation)
+        return groups.items()
+
+    def to_json(self):
+        """
+        :return: the plan as a JSON string
+        """
+        return json.dumps({'version': PLAN_VERSION,
+                           'operations': [zone_operation.to_json() for zone_operation in self.operations]},
+                          indent=1, sort_keys=True)
+
+    def save(self, file_name):
+        """
+        Writes the plan to a file as JSON
+        :param file_name:
+        :return: None
+        """
+        with open(file_name, 'w') as plan_file:
+            plan_file.write(self.to_json())
+
+
+def from_json(text):
+    """
+    Create a plan from its JSON form
+    :param text: JSON string as produced by ChangePlan.to_json
+    :return: ChangePlan
+    :raises error for an unsupported plan version
+    """
+    data = json.loads(text)
+    if data.get('version') != PLAN_VERSION:
+        raise Exception("Unsupported plan version: " + str(data.get('version')))
+    return ChangePlan([operation_from_json(json_operation) for json_operation in data['operations']])
+
+
+def load(file_name):
+    """
+    Reads a plan saved by ChangePlan.save
+    :param file_name:
+    :return: ChangePlan
+    """
+    with open(file_name) as plan_file:
+        return from_json(plan_file.read())
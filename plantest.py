@@ -0,0 +1,62 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import unittest
+
+import plan
+
+
+class OperationTestCase(unittest.TestCase):
+    def test_operation(self):
+        """
+        Operations are immutable and expose their values
+        """
+        operation = plan.operation(plan.ADD_RECORD, 'zone.com', 1, values={'name': 'www', 'target': '1.2.3.4'})
+        self.assertEqual('www', operation.value('name'))
+        self.assertEqual(None, operation.value('priority'))
+        self.assertRaises(AttributeError, setattr, operation, 'zone', 'other.com')
+
+    def test_bad_action(self):
+        """
+        Unknown actions are rejected
+        """
+        self.assertRaises(Exception, plan.operation, 'rename_zone', 'zone.com')
+
+
+class ChangePlanTestCase(unittest.TestCase):
+    def test_json(self):
+        """
+        A plan survives a round trip through JSON
+        """
+        change_plan = plan.ChangePlan([
+            plan.operation(plan.ADD_ZONE, 'new.com', values={'soa_email': 'a@b.com'}),
+            plan.operation(plan.ADD_RECORD, 'new.com', values={'record_type': 'A', 'name': '', 'target': '1.1.1.1'}),
+            plan.operation(plan.MODIFY_RECORD, 'old.com', 2, 22, {'record_type': 'A', 'name': 'www'},
+                           [('ttl_seconds', None, 300)])])
+        loaded = plan.from_json(change_plan.to_json())
+        self.assertEqual(change_plan.operations, loaded.operations)
+        self.assertEqual(['new.com', 'old.com'], [zone for zone, _ in loaded.by_zone()])
+
+    def test_bad_version(self):
+        """
+        Plans from an unknown version are rejected
+        """
+        self.assertRaises(Exception, plan.from_json, '{"version": 99, "operations": []}')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -36,6 +36,76 @@ class ConstructorTestCase(unittest.TestCase):
         self.assertEqual(30, record.priority)
         self.assertEqual(None, record.ttl_seconds)
 
+    def test_json_fields(self):
+        """
+        Weight, port, protocol and tag are only kept for the record types that use them
+        """
+        srv = dns_record.from_json({u'DOMAINID': 1, u'PROTOCOL': u'tcp', u'TARGET': u'sip.domain.com', u'WEIGHT': 5,
+                                    u'NAME': u'_sip', u'RESOURCEID': 2, u'PRIORITY': 10, u'TYPE': u'SRV',
+                                    u'PORT': 5060, u'TTL_SEC': 0}, 'domain.com')
+        self.assertEqual((10, 5, 5060, 'tcp'), (srv.priority, srv.weight, srv.port, srv.protocol))
+        self.assertEqual(('SRV', '_sip', ('sip.domain.com', 'tcp')), srv.key())
+        caa = dns_record.from_json({u'DOMAINID': 1, u'TARGET': u'ca.org', u'NAME': u'', u'RESOURCEID': 3,
+                                    u'PRIORITY': 0, u'TYPE': u'CAA', u'TAG': u'issue', u'TTL_SEC': 0}, 'domain.com')
+        self.assertEqual(('CAA', '', ('ca.org', 'issue')), caa.key())
+        mx = dns_record.from_json({u'DOMAINID': 1, u'PROTOCOL': u'', u'TARGET': u'mx.domain.com', u'WEIGHT': 20,
+                                   u'NAME': u'', u'RESOURCEID': 4, u'PRIORITY': 30, u'TYPE': u'MX', u'PORT': 0,
+                                   u'TTL_SEC': 0}, 'domain.com')
+        self.assertEqual((None, None, None), (mx.weight, mx.port, mx.protocol))
+        self.assertEqual(('priority',), mx.fields())
+
+    def test_json_ipv6(self):
+        """
+        AAAA targets from Linode are put in canonical form
+        """
+        record = dns_record.from_json({u'DOMAINID': 1, u'TARGET': u'2600:3C00:0:0::0001', u'NAME': u'www',
+                                       u'RESOURCEID': 2, u'PRIORITY': 0, u'TYPE': u'AAAA', u'TTL_SEC': 0},
+                                      'domain.com')
+        self.assertEqual('2600:3c00::1', record.target)
+        self.assertEqual('not an address', dns_record.canonical_ipv6('not an address'))
+
+
+class KeyTestCase(unittest.TestCase):
+    def test_key(self):
+        """
+        Record keys are structured, so targets containing colons (IPv6 addresses, TXT values) stay unambiguous
+        """
+        record = dns_record.Record('domain.com', None, None, 'AAAA', 'www', '2600:3c00::1', None, None)
+        self.assertEqual(dns_record.RecordKey('AAAA', 'www', '2600:3c00::1'), record.key())
+        self.assertEqual('2600:3c00::1', record.key().target)
+        self.assertNotEqual(record.key(), dns_record.RecordKey('AAAA', 'www:2600', '3c00::1'))
+
+    def test_interned(self):
+        """
+        Equal names and targets, from the configuration file or from Linode, share one string instance
+        """
+        target = ''.join(['v=DKIM1; k=rsa; ', 'p=MIGfMA0GCSqGSIb3DQEBAQUAA4GNADCBiQ'])
+        record1 = dns_record.Record('domain.com', None, None, 'TXT', 'mail._domainkey', target, None, None)
+        record2 = dns_record.from_json({u'DOMAINID': 1, u'TARGET': unicode(target), u'NAME': u'mail._domainkey',
+                                        u'RESOURCEID': 2, u'PRIORITY': 0, u'TYPE': u'TXT', u'TTL_SEC': 0},
+                                       'domain2.com')
+        self.assertTrue(record1.target is record2.target)
+        self.assertTrue(record1.name is record2.name)
+
+    def test_clear_interned(self):
+        """
+        Clearing the pool drops strings that are no longer shared, while existing records keep their values
+        """
+        record = dns_record.Record('domain.com', None, None, 'A', 'www', '1.1.1.1', None, None)
+        self.assertTrue(dns_record.interned)
+        dns_record.clear_interned()
+        self.assertEqual({}, dns_record.interned)
+        self.assertEqual('1.1.1.1', record.target)
+
+    def test_slots(self):
+        """
+        Records have no per-instance dictionary
+        """
+        record = dns_record.Record('domain.com', None, None, 'A', 'www', '1.1.1.1', None, None)
+        self.assertFalse(hasattr(record, '__dict__'))
+        with self.assertRaises(AttributeError):
+            record.other = 1
+
 
 if __name__ == '__main__':
     unittest.main()
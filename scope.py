@@ -0,0 +1,89 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import fnmatch
+
+
+class Scope:
+    """
+    The zones a run is limited to: the zones whose name matches one of the zone patterns, and the zones that use
+    one of the families, directly or through another family. Patterns are shell style globs, such as
+    *.example.com, and are matched without regard to case. Zones at Linode that are not in the configuration are
+    only in scope when their name matches a pattern, so a run limited to families never deletes a zone.
+    """
+
+    def __init__(self, zone_patterns=(), families=()):
+        """
+        :param zone_patterns: zone names or glob patterns
+        :param families: family names
+        :return: Scope object
+        """
+        self.zone_patterns = [pattern.lower() for pattern in zone_patterns]
+        self.families = set(families)
+
+    def matches_name(self, domain):
+        """
+        :param domain: name of a zone
+        :return: True if the name matches one of the zone patterns
+        """
+        domain = domain.lower()
+        for pattern in self.zone_patterns:
+            if fnmatch.fnmatchcase(domain, pattern):
+                return True
+        return False
+
+    def selects(self, domain, families):
+        """
+        :param domain: name of a desired zone
+        :param families: names of the families the zone uses
+        :return: True if the zone is in scope
+        """
+        return self.matches_name(domain) or not self.families.isdisjoint(families)
+
+    def selects_raw_zone(self, domain, raw_zone, families=None):
+        """
+        :param domain: name of a zone in the configuration
+        :param raw_zone: the zone's raw data from the configuration, which may not be valid yet
+        :param families: mapping from family name to the parsed family, whose families the zone also uses
+        :return: True if the zone is in scope
+        """
+        zone_families = []
+        if isinstance(raw_zone, dict) and isinstance(raw_zone.get('families'), list):
+            for family in raw_zone['families']:
+                if isinstance(family, basestring):
+                    zone_families.append(family)
+                    if families is not None and family in families:
+                        zone_families.extend(families[family].families)
+        return self.selects(domain, zone_families)
+
+    def filter_desired(self, desired):
+        """
+        :param desired: dictionary of desired zones
+        :return: dictionary of the desired zones in scope
+        """
+        return dict((domain, zone) for domain, zone in desired.iteritems() if self.selects(domain, zone.families))
+
+    def filter_json_zones(self, json_zones, desired_names):
+        """
+        :param json_zones: the zones at Linode, as returned by domain.list
+        :param desired_names: names of the desired zones in scope
+        :return: the zones at Linode in scope: those that are desired and in scope, and those not desired whose name
+                 matches a pattern
+        """
+        desired_names = set(desired_names)
+        return [json_zone for json_zone in json_zones
+                if json_zone['DOMAIN'] in desired_names or self.matches_name(json_zone['DOMAIN'])]
@@ -0,0 +1,80 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import config
+import scope
+
+
+class ScopeTestCase(unittest.TestCase):
+    def test_selects(self):
+        """
+        Zones are in scope by name or glob pattern, without regard to case, or by family
+        """
+        zone_scope = scope.Scope(['example.com', '*.Customer.net'], ['web'])
+        self.assertTrue(zone_scope.selects('Example.com', []))
+        self.assertTrue(zone_scope.selects('shop.customer.net', []))
+        self.assertFalse(zone_scope.selects('customer.net', []))
+        self.assertTrue(zone_scope.selects('other.com', ['admin', 'web']))
+        self.assertFalse(zone_scope.selects('other.com', ['admin']))
+        self.assertTrue(zone_scope.selects_raw_zone('other.com', {'families': ['web']}))
+        self.assertFalse(zone_scope.selects_raw_zone('other.com', None))
+
+    def test_filter_json_zones(self):
+        """
+        Zones at Linode are in scope when desired and in scope, or when their name matches a pattern
+        """
+        zone_scope = scope.Scope(['old.*'], ['web'])
+        json_zones = [{'DOMAIN': 'web.com'}, {'DOMAIN': 'mail.com'}, {'DOMAIN': 'old.com'}]
+        self.assertEqual([{'DOMAIN': 'web.com'}, {'DOMAIN': 'old.com'}],
+                         zone_scope.filter_json_zones(json_zones, ['web.com']))
+
+    def test_config(self):
+        """
+        A config with a scope only builds the zones in scope, and zones remember their families
+        """
+        conf = config.Config('examples/web_and_mail_server.yml', scope=scope.Scope(families=['web']))
+        self.assertEqual(['coolcats.com', 'fastcars.com'], sorted(conf.get_desired_dns()))
+        self.assertEqual(['admin', 'mailer', 'web'], conf.get_desired_dns()['fastcars.com'].families)
+        conf = config.Config('examples/web_and_mail_server.yml', stream=True, scope=scope.Scope(['h*']))
+        self.assertEqual(['hostingcorp.com'], sorted(conf.get_desired_dns()))
+
+    def test_nested_families(self):
+        """
+        A zone that gets a family through another family is in scope for that family, streamed or not
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            config_file = os.path.join(directory, 'config.yml')
+            with open(config_file, 'w') as out:
+                out.write('families:\n'
+                          '  apache: { families: [ web ], SOA_email: a@b.com }\n'
+                          '  web: { A: [ { host: , target: 1.2.3.4 } ] }\n'
+                          'zones:\n'
+                          '  site.com: { families: [ apache ] }\n'
+                          '  other.com: { SOA_email: a@b.com }\n')
+            for stream in [False, True]:
+                conf = config.Config(config_file, stream=stream, scope=scope.Scope(families=['web']))
+                self.assertEqual(['site.com'], sorted(conf.get_desired_dns()))
+                self.assertEqual(['apache', 'web'], conf.get_desired_dns()['site.com'].families)
+                self.assertEqual(1, len(conf.get_desired_dns()['site.com'].records))
+        finally:
+            shutil.rmtree(directory)
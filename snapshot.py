@@ -0,0 +1,96 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import instrumentation
+import json
+import os
+import threading
+import time
+
+
+SNAPSHOT_VERSION = 1
+
+
+class Snapshot:
+    """
+    A local copy of the state of Linode, kept in a JSON file between runs.
+    For each zone it holds the zone's domain.list entry (its summary), the zone's domain.resource.list result,
+    and when that result was fetched.
+
+    Like an HTTP ETag, the summary is used to revalidate the cached records: when the zone's current summary from
+    domain.list is the same as the cached one, and the cached records are not older than max_age seconds, the
+    cached records are used instead of calling domain.resource.list. Changing a zone's records does not change its
+    summary, so zones changed by this program are invalidated after applying, and changes made by hand in the
+    Linode Manager are only seen once the cached records expire.
+    """
+
+    def __init__(self, file_name, max_age):
+        """
+        Loads the snapshot file, if it exists
+        :param file_name: name of the snapshot file
+        :param max_age: seconds cached records stay valid
+        :return: Snapshot object
+        """
+        self.file_name = file_name
+        self.max_age = max_age
+        self.zones = {}
+        self.lock = threading.Lock()
+        if os.path.exists(file_name):
+            with open(file_name) as snapshot_file:
+                data = json.load(snapshot_file)
+            if data.get('version') == SNAPSHOT_VERSION:
+                self.zones = data['zones']
+
+    def records(self, json_zone):
+        """
+        Looks up the cached records of a zone
+        :param json_zone: the zone's current entry from domain.list
+        :return: the cached domain.resource.list result, None if there is none or it is no longer valid
+        """
+        with self.lock:
+            entry = self.zones.get(json_zone['DOMAIN'])
+        if entry is None or entry['summary'] != json_zone or time.time() - entry['fetched'] > self.max_age:
+            return None
+        return entry['records']
+
+    def store(self, json_zone, json_records):
+        """
+        Caches the records of a zone
+        :param json_zone: the zone's current entry from domain.list
+        :param json_records: the zone's domain.resource.list result
+        :return: None
+        """
+        with self.lock:
+            self.zones[json_zone['DOMAIN']] = {'summary': json_zone, 'records': json_records, 'fetched': time.time()}
+
+    def invalidate(self, domain):
+        """
+        Forgets the cached records of a zone, so they are fetched again next time
+        :param domain: name of the zone
+        :return: None
+        """
+        with self.lock:
+            self.zones.pop(domain, None)
+
+    def save(self):
+        """
+        Writes the snapshot file
+        :return: None
+        """
+        with self.lock:
+            data = {'version': SNAPSHOT_VERSION, 'zones': self.zones}
+            instrumentation.write_atomically(self.file_name, lambda out: json.dump(data, out))
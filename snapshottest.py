@@ -0,0 +1,66 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import snapshot
+
+
+JSON_ZONE = {u'DOMAIN': u'zone.com', u'DOMAINID': 1, u'TYPE': u'master', u'SOA_EMAIL': u'a@b.com',
+             u'REFRESH_SEC': 0, u'RETRY_SEC': 0, u'EXPIRE_SEC': 0, u'TTL_SEC': 0}
+JSON_RECORDS = [{u'DOMAINID': 1, u'RESOURCEID': 11, u'TYPE': u'A', u'NAME': u'www', u'TARGET': u'1.1.1.1',
+                 u'PRIORITY': 0, u'TTL_SEC': 0}]
+
+
+class SnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'snapshot.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_revalidation(self):
+        """
+        Cached records survive a save and load, and are only used while the zone summary is unchanged
+        """
+        cache = snapshot.Snapshot(self.file_name, 3600)
+        self.assertEqual(None, cache.records(JSON_ZONE))
+        cache.store(JSON_ZONE, JSON_RECORDS)
+        cache.save()
+        cache = snapshot.Snapshot(self.file_name, 3600)
+        self.assertEqual(JSON_RECORDS, cache.records(JSON_ZONE))
+        changed_zone = dict(JSON_ZONE)
+        changed_zone[u'TTL_SEC'] = 300
+        self.assertEqual(None, cache.records(changed_zone))
+        cache.invalidate(u'zone.com')
+        self.assertEqual(None, cache.records(JSON_ZONE))
+
+    def test_max_age(self):
+        """
+        Cached records expire
+        """
+        cache = snapshot.Snapshot(self.file_name, -1)
+        cache.store(JSON_ZONE, JSON_RECORDS)
+        self.assertEqual(None, cache.records(JSON_ZONE))
+
+
+if __name__ == '__main__':
+    unittest.main()
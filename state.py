@@ -0,0 +1,84 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import instrumentation
+import json
+import os
+
+
+STATE_VERSION = 1
+
+
+class AppliedState:
+    """
+    What was last applied to Linode, kept in a JSON file between runs for incremental reconciles.
+    For each zone it holds the fingerprint of the desired zone that was applied (see Zone.fingerprint), and the
+    zone's domain.list entry (its summary) just after applying.
+
+    A zone is unchanged when its desired fingerprint and its current summary both match the stored ones: the
+    configuration of the zone did not change, and nobody changed the zone's fields at Linode. Unchanged zones do
+    not need to be fetched or diffed. Changes to a zone's records made outside this program do not change the
+    summary, so they are only corrected once the zone's configuration changes or the state file is removed.
+    """
+
+    def __init__(self, file_name):
+        """
+        Loads the state file, if it exists
+        :param file_name: name of the state file
+        :return: AppliedState object
+        """
+        self.file_name = file_name
+        self.zones = {}
+        if os.path.exists(file_name):
+            with open(file_name) as state_file:
+                data = json.load(state_file)
+            if data.get('version') == STATE_VERSION:
+                self.zones = data['zones']
+
+    def unchanged(self, fingerprint, json_zone):
+        """
+        :param fingerprint: fingerprint of the desired zone
+        :param json_zone: the zone's current entry from domain.list
+        :return: True if the zone was applied with this fingerprint and its summary has not changed since
+        """
+        entry = self.zones.get(json_zone['DOMAIN'])
+        return entry is not None and entry['fingerprint'] == fingerprint and entry['summary'] == json_zone
+
+    def record(self, fingerprint, json_zone):
+        """
+        Remembers that a zone is in sync
+        :param fingerprint: fingerprint of the desired zone
+        :param json_zone: the zone's entry from domain.list, after applying
+        :return: None
+        """
+        self.zones[json_zone['DOMAIN']] = {'fingerprint': fingerprint, 'summary': json_zone}
+
+    def forget(self, domain):
+        """
+        Forgets a zone, so it is fetched and diffed next time
+        :param domain: name of the zone
+        :return: None
+        """
+        self.zones.pop(domain, None)
+
+    def save(self):
+        """
+        Writes the state file
+        :return: None
+        """
+        data = {'version': STATE_VERSION, 'zones': self.zones}
+        instrumentation.write_atomically(self.file_name, lambda out: json.dump(data, out))
@@ -0,0 +1,57 @@
+# Copyright (c) 2016 John Gateley
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions
+# of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+# TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import state
+
+
+JSON_ZONE = {u'DOMAIN': u'zone.com', u'DOMAINID': 1, u'TYPE': u'master', u'SOA_EMAIL': u'a@b.com',
+             u'REFRESH_SEC': 0, u'RETRY_SEC': 0, u'EXPIRE_SEC': 0, u'TTL_SEC': 0}
+
+
+class AppliedStateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'state.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_unchanged(self):
+        """
+        A zone is unchanged only while both its fingerprint and its summary match, and survives a save and load
+        """
+        applied_state = state.AppliedState(self.file_name)
+        self.assertFalse(applied_state.unchanged('abc', JSON_ZONE))
+        applied_state.record('abc', JSON_ZONE)
+        applied_state.save()
+        applied_state = state.AppliedState(self.file_name)
+        self.assertTrue(applied_state.unchanged('abc', JSON_ZONE))
+        self.assertFalse(applied_state.unchanged('abd', JSON_ZONE))
+        changed_zone = dict(JSON_ZONE)
+        changed_zone[u'SOA_EMAIL'] = u'c@d.com'
+        self.assertFalse(applied_state.unchanged('abc', changed_zone))
+        applied_state.forget(u'zone.com')
+        self.assertFalse(applied_state.unchanged('abc', JSON_ZONE))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -26,28 +26,151 @@ Computes the delta, and applies it.
 
 import api
 import argparse
+import changelog
+import collections
+import compiled
 import config
+import daemon
+import delta
 import dns_record
 import dns_zone
+import fragments
+import itertools
+import plan
+import scope
+import snapshot
+import state
+import sys
+from multiprocessing.pool import ThreadPool
 
 
-def get_linode_dns(linode_api):
+def get_linode_dns(linode_api, fetch_concurrency=1, linode_snapshot=None, json_zones=None):
     """ Get the existing zone configuration from Linode
     :param linode_api: The API object
+    :param fetch_concurrency: number of zones whose records are fetched at the same time
+    :param linode_snapshot: optional Snapshot, zones whose cached records are still valid are not fetched again
+    :param json_zones: the zones to get, as returned by domain.list, None to list and get all zones
     :return: dictionary of zones
+    :raises: a single error listing every zone whose records could not be fetched
     """
+    if json_zones is None:
+        json_zones = linode_api.list_zones()
+    zones = [dns_zone.from_json(json_zone) for json_zone in json_zones]
+    to_be_fetched = []
+    for json_zone, zone in zip(json_zones, zones):
+        json_records = None
+        if linode_snapshot is not None:
+            json_records = linode_snapshot.records(json_zone)
+        if json_records is None:
+            to_be_fetched.append((json_zone, zone))
+        else:
+            add_json_records(zone, json_records)
+    fetched = fetch_records(linode_api, [zone for _, zone in to_be_fetched], fetch_concurrency)
+    if linode_snapshot is not None:
+        for (json_zone, _), json_records in zip(to_be_fetched, fetched):
+            linode_snapshot.store(json_zone, json_records)
     linode_zones = {}
-    json_zones = linode_api.list_zones()
-    for json_zone in json_zones:
-        zone = dns_zone.from_json(json_zone)
+    for zone in zones:
         linode_zones[zone.domain] = zone
-        json_records = linode_api.list_records(zone)
-        for json_record in json_records:
-            record = dns_record.from_json(json_record, zone.domain)
-            zone.add_record(record)
     return linode_zones
 
 
+def fetch_records(linode_api, zones, fetch_concurrency=1):
+    """ Fetch the records of each zone from Linode and add them to the zone.
+    With a fetch_concurrency above 1 the zones are fetched from a bounded thread pool. When the API batches calls,
+    the zones are fetched batch_size at a time, each group in a single api.batch call. Records are always added
+    in the order Linode returns them, so the result does not depend on the concurrency or batching.
+    :param linode_api: The API object
+    :param zones: list of zones, domain IDs must exist
+    :param fetch_concurrency: number of zones (or groups of zones when batching) fetched at the same time
+    :return: list of the JSON records of each zone, in the same order as zones
+    :raises: a single error listing every zone whose records could not be fetched
+    """
+    if linode_api.batch_size > 1:
+        groups = [zones[start:start + linode_api.batch_size] for start in range(0, len(zones), linode_api.batch_size)]
+    else:
+        groups = [[zone] for zone in zones]
+    group_results = run_in_pool(lambda group: fetch_group_records(linode_api, group), groups, fetch_concurrency)
+    results = [result for group_result in group_results for result in group_result]
+    errors = []
+    for zone, (json_records, error) in zip(zones, results):
+        if error is not None:
+            errors.append(zone.domain + ': ' + error)
+            continue
+        add_json_records(zone, json_records)
+    if errors:
+        raise Exception("Fetching records failed for " + str(len(errors)) + " zone(s): " + "; ".join(errors))
+    return [json_records for json_records, _ in results]
+
+
+def add_json_records(zone, json_records):
+    """ Add records returned by Linode to a zone
+    :param zone: the zone
+    :param json_records: the zone's domain.resource.list result
+    :return: None
+    """
+    for json_record in json_records:
+        zone.add_record(dns_record.from_json(json_record, zone.domain))
+
+
+def fetch_group_records(linode_api, zones):
+    """ Fetch the records of a group of zones, capturing any error so the caller can report all failures together
+    :param linode_api: The API object
+    :param zones: zones to fetch (domain IDs must exist), a single zone unless the API batches calls
+    :return: list of pairs of the JSON records (or None) and the error message (or None), one per zone
+    """
+    try:
+        if linode_api.batch_size > 1:
+            return linode_api.list_records_batch(zones)
+        return [(linode_api.list_records(zones[0]), None)]
+    except Exception as e:
+        return [(None, str(e))] * len(zones)
+
+
+def run_in_pool(function, items, concurrency):
+    """ Call a function on each item, from a bounded thread pool when concurrency is above 1
+    :param function: function of one argument
+    :param items: list of arguments
+    :param concurrency: number of calls made at the same time
+    :return: list of results, in the same order as items
+    """
+    if concurrency <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    pool = ThreadPool(min(concurrency, len(items)))
+    try:
+        return pool.map(function, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def bounded_imap(function, items, concurrency):
+    """ Call a function on each item, from a bounded thread pool when concurrency is above 1, yielding the results
+    in the same order as the items. At most concurrency calls are in progress, and items are only taken from the
+    iterable when there is room for them, so items that are built lazily are not built ahead of time.
+    :param function: function of one argument
+    :param items: iterable of arguments
+    :param concurrency: number of calls made at the same time
+    :return: generator of results
+    """
+    if concurrency <= 1:
+        for item in items:
+            yield function(item)
+        return
+    pool = ThreadPool(concurrency)
+    try:
+        in_flight = collections.deque()
+        for item in items:
+            if len(in_flight) >= concurrency:
+                yield in_flight.popleft().get()
+            in_flight.append(pool.apply_async(function, (item,)))
+        while in_flight:
+            yield in_flight.popleft().get()
+    finally:
+        pool.close()
+        pool.join()
+
+
 def dictionary_delta(existing_dict, desired_dict):
     """ Compute the delta between two dictionaries
     :param existing_dict:
@@ -113,61 +236,625 @@ def record_delta(existing_record, desired_record):
         changed_fields.append('name')
     if existing_record.target != desired_record.target:
         changed_fields.append('target')
-    if (existing_record.priority != desired_record.priority) and (existing_record.record_type == 'MX'):
-        changed_fields.append('priority')
+    for field in existing_record.fields():
+        if getattr(existing_record, field) != getattr(desired_record, field):
+            changed_fields.append(field)
     if existing_record.ttl_seconds != desired_record.ttl_seconds:
         changed_fields.append('ttl_seconds')
     return changed_fields
 
 
-def apply_delta(api_key, config_file, dry_run):
+def apply_delta(api_key, config_file, dry_run, fetch_concurrency=1, apply_concurrency=1, plan_in=None, plan_out=None,
+                cache_file=None, cache_max_age=3600, state_file=None, stream=False, reuse_records=False,
+                compiled_file=None, stream_config=False, parse_processes=1, stats=False, metrics_file=None,
+                prometheus_file=None, zone_scope=None, **api_options):
     """
     Loads the Linode configuration (aka existing)
     Loads the YAML configuration (aka desired)
-    Computes the zones to be added, deleted and modified.
-    Deletes the zones as needed
-    Adds the zones as needed
-    Computes the changes for each zone that needs to be modified
-    Computes the record changes for each zone that needs to be modified
+    Computes the plan: the zones to be added, deleted and modified, and for each zone that needs to be modified
+    the changes to the zone and its records.
+    Saves the plan if asked to, and applies it.
+    When a saved plan is given, it is applied as is, without fetching from Linode or loading the YAML configuration.
+    When a cache file is given, zones are fetched through a local Snapshot of Linode kept in that file.
+    When a state file is given, the run is incremental: zones whose configuration and Linode summary did not change
+    since they were last applied are neither fetched nor diffed (see state.AppliedState).
+    When a compiled file is given, the desired zones are loaded from a compiled copy of the YAML configuration
+    while the configuration is unchanged (see compiled.CompiledConfig).
+    The configuration may be a directory or glob pattern of files instead of a single file (see
+    fragments.FragmentConfig); the compiled file then caches each of the files.
+    When streaming, zones are fetched, diffed and applied one at a time (see stream_changes); no plan is computed,
+    so saved plans, the cache, the state file and the compiled file are not used.
+    When a scope is given, only the zones in scope are built from the configuration, have their records fetched,
+    and are applied; zones at Linode out of scope are left alone.
     :param api_key:
     :param config_file:
     :param dry_run:
+    :param fetch_concurrency: number of zones whose records are fetched at the same time
+    :param apply_concurrency: number of zones whose changes are applied at the same time
+    :param plan_in: file name of a saved plan to apply instead of computing one
+    :param plan_out: file name to save the computed plan in
+    :param cache_file: file name of the Snapshot of Linode, None to always fetch everything
+    :param cache_max_age: seconds cached zone records stay valid
+    :param state_file: file name of the AppliedState for incremental runs, None to reconcile every zone
+    :param stream: True to fetch, diff and apply zone by zone
+    :param reuse_records: True to change records into desired records of another name instead of deleting them
+    :param compiled_file: file name of the compiled configuration, None to always parse the YAML configuration
+    :param stream_config: True to read the YAML configuration one zone at a time (see config.Config)
+    :param parse_processes: number of processes parsing the files of a configuration split across several files
+    :param stats: True to print a summary of the run's metrics (see instrumentation.Metrics) on stderr
+    :param metrics_file: file name to write the run's metrics to as JSON
+    :param prometheus_file: file name to write the run's metrics to in the Prometheus text format
+    :param zone_scope: scope.Scope limiting the zones that are loaded, fetched and applied, None for all zones
+    :param api_options: keyword arguments for api.Api: batching, connection pool, timeouts, URL, rate limit,
+                        retries and change log
     :return:
     """
-    linode_api = api.Api(api_key, dry_run)
-    existing = get_linode_dns(linode_api)
-    desired = config.Config(config_file).get_desired_dns()
-    changes = zones_delta(existing, desired)
-    to_be_deleted = changes[0]
-    to_be_updated = changes[1]
-    to_be_added = changes[2]
-    for zone in to_be_deleted:
-        linode_api.delete_zone(existing[zone])
-    for zone in to_be_updated:
-        field_changes = zone_delta(existing[zone], desired[zone])
-        linode_api.modify_zone(existing[zone], desired[zone], field_changes)
-        record_changes = records_delta(existing[zone].records, desired[zone].records)
-        records_to_be_deleted = record_changes[0]
-        records_to_be_updated = record_changes[1]
-        records_to_be_added = record_changes[2]
-        for record in records_to_be_deleted:
-            linode_api.delete_record(existing[zone].records[record])
-        for record in records_to_be_updated:
-            field_changes = record_delta(existing[zone].records[record], desired[zone].records[record])
-            linode_api.modify_record(existing[zone].records[record], desired[zone].records[record], field_changes)
-        for record in records_to_be_added:
-            linode_api.add_record(existing[zone], desired[zone].records[record])
-    for zone in to_be_added:
-        linode_api.add_zone(desired[zone])
-        for record_name in desired[zone].records.keys():
-            linode_api.add_record(desired[zone], desired[zone].records[record_name])
+    linode_api = api.Api(api_key, dry_run, **api_options)
+    phase = linode_api.metrics.phase
+    if stream:
+        try:
+            with phase('stream'):
+                if fragments.is_fragments(config_file):
+                    desired_config = fragments.FragmentConfig(config_file, processes=parse_processes)
+                else:
+                    desired_config = config.Config(config_file, lazy=True, stream=stream_config, scope=zone_scope)
+                stream_changes(linode_api, desired_config, fetch_concurrency, apply_concurrency, reuse_records,
+                               zone_scope)
+        finally:
+            finish_run(linode_api, stats, metrics_file, prometheus_file)
+        return
+    linode_snapshot = None
+    if cache_file is not None:
+        linode_snapshot = snapshot.Snapshot(cache_file, cache_max_age)
+    applied_state = None
+    if state_file is not None:
+        applied_state = state.AppliedState(state_file)
+    try:
+        desired = None
+        json_zones = None
+        if plan_in is not None:
+            change_plan = plan.load(plan_in)
+        else:
+            with phase('config'):
+                desired = load_desired(config_file, compiled_file, stream_config, parse_processes, zone_scope)
+            with phase('fetch'):
+                json_zones = linode_api.list_zones()
+                if zone_scope is not None:
+                    json_zones = zone_scope.filter_json_zones(json_zones, desired)
+                if applied_state is not None:
+                    json_zones, desired = skip_unchanged_zones(json_zones, desired, applied_state)
+                existing = get_linode_dns(linode_api, fetch_concurrency, linode_snapshot, json_zones)
+            with phase('diff'):
+                change_plan = plan_changes(existing, desired, reuse_records)
+        if plan_out is not None:
+            change_plan.save(plan_out)
+        succeeded = False
+        try:
+            with phase('apply'):
+                execute_plan(linode_api, change_plan, apply_concurrency)
+            succeeded = True
+        finally:
+            if linode_snapshot is not None:
+                if not dry_run:
+                    for zone, _ in change_plan.by_zone():
+                        linode_snapshot.invalidate(zone)
+                linode_snapshot.save()
+            if applied_state is not None and not dry_run:
+                update_applied_state(linode_api, applied_state, desired, change_plan, succeeded, json_zones)
+    finally:
+        finish_run(linode_api, stats, metrics_file, prometheus_file)
+
+
+def run_daemon(api_key, config_file, dry_run, fetch_concurrency=1, apply_concurrency=1, reuse_records=False,
+               compiled_file=None, parse_processes=1, poll_interval=2, debounce=1, drift_interval=3600, stats=False,
+               metrics_file=None, prometheus_file=None, **api_options):
+    """
+    Runs a daemon.Daemon until interrupted
+    :param api_key:
+    :param config_file:
+    :param dry_run:
+    :param fetch_concurrency: number of zones whose records are fetched at the same time
+    :param apply_concurrency: number of zones whose changes are applied at the same time
+    :param reuse_records: True to change records into desired records of another name instead of deleting them
+    :param compiled_file: file name of the compiled configuration, None to always parse the YAML configuration
+    :param parse_processes: number of processes parsing the files of a configuration split across several files
+    :param poll_interval: seconds between two checks of the config files
+    :param debounce: seconds the config files must stay unchanged before they are applied
+    :param drift_interval: seconds between two full reconciles
+    :param stats: True to print a summary of the metrics on stderr when interrupted
+    :param metrics_file: file name to write the metrics to as JSON after each reconcile
+    :param prometheus_file: file name to write the metrics to in the Prometheus text format after each reconcile
+    :param api_options: keyword arguments for api.Api
+    :return: None
+    """
+    linode_api = api.Api(api_key, dry_run, **api_options)
+    try:
+        daemon.Daemon(linode_api, config_file, compiled_file, parse_processes, fetch_concurrency, apply_concurrency,
+                      reuse_records, poll_interval, debounce, drift_interval, metrics_file, prometheus_file).run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        finish_run(linode_api, stats, metrics_file, prometheus_file)
+
+
+def load_desired(config_file, compiled_file=None, stream_config=False, parse_processes=1, zone_scope=None):
+    """
+    Loads the desired zones from the YAML configuration
+    :param config_file: config file name, or directory or glob pattern of config files
+    :param compiled_file: file name of the compiled configuration, None to always parse the YAML configuration
+    :param stream_config: True to read the YAML configuration one zone at a time (see config.Config)
+    :param parse_processes: number of processes parsing the files of a configuration split across several files
+    :param zone_scope: scope.Scope limiting the zones, None for all zones. A single config file only builds the
+                       zones in scope; compiled and split configurations are filtered once loaded.
+    :return: dictionary of desired zones
+    """
+    if fragments.is_fragments(config_file):
+        desired = fragments.FragmentConfig(config_file, compiled_file, parse_processes).get_desired_dns()
+    elif compiled_file is not None:
+        desired = compiled.CompiledConfig(compiled_file).get_desired_dns(config_file)
+    else:
+        return config.Config(config_file, stream=stream_config, scope=zone_scope).get_desired_dns()
+    if zone_scope is not None:
+        desired = zone_scope.filter_desired(desired)
+    return desired
+
+
+def finish_run(linode_api, stats, metrics_file, prometheus_file):
+    """
+    Closes the API object, empties the string intern pool, and reports the run's metrics
+    :param linode_api: The API object
+    :param stats: True to print a summary of the metrics on stderr
+    :param metrics_file: file name to write the metrics to as JSON, None for none
+    :param prometheus_file: file name to write the metrics to in the Prometheus text format, None for none
+    :return: None
+    """
+    linode_api.close()
+    dns_record.clear_interned()
+    if stats:
+        sys.stderr.write('\n'.join(linode_api.metrics.summary()) + '\n')
+    if metrics_file is not None:
+        linode_api.metrics.save(metrics_file)
+    if prometheus_file is not None:
+        linode_api.metrics.save_prometheus(prometheus_file)
+
+
+def skip_unchanged_zones(json_zones, desired, applied_state):
+    """
+    Leaves out the zones that are unchanged since they were last applied
+    :param json_zones: the zones at Linode, as returned by domain.list
+    :param desired: dictionary of desired zones
+    :param applied_state: the AppliedState
+    :return: pair of the zones at Linode and the dictionary of desired zones that still need to be reconciled
+    """
+    unchanged = set()
+    for json_zone in json_zones:
+        domain = json_zone['DOMAIN']
+        if domain in desired and applied_state.unchanged(desired[domain].fingerprint(), json_zone):
+            unchanged.add(domain)
+    return ([json_zone for json_zone in json_zones if json_zone['DOMAIN'] not in unchanged],
+            dict((domain, zone) for domain, zone in desired.items() if domain not in unchanged))
+
+
+def update_applied_state(linode_api, applied_state, desired, change_plan, succeeded, json_zones):
+    """
+    Records the zones that are now in sync, and forgets the zones that may not be.
+    When the plan failed, some of its zones may be half applied, so all of them are forgotten. When it succeeded,
+    zones are listed again, since applying may have changed their summaries.
+    :param linode_api: The API object
+    :param applied_state: the AppliedState, saved once updated
+    :param desired: dictionary of the desired zones that were reconciled, None when a saved plan was applied
+    :param change_plan: the plan that was applied
+    :param succeeded: True if the whole plan was applied
+    :param json_zones: the zones at Linode that were reconciled, as returned by domain.list before applying
+    :return: None
+    """
+    planned = set(zone for zone, _ in change_plan.by_zone())
+    for zone in planned:
+        applied_state.forget(zone)
+    if desired is not None:
+        if succeeded and planned:
+            json_zones = linode_api.list_zones()
+        for json_zone in json_zones:
+            domain = json_zone['DOMAIN']
+            if domain in desired and (succeeded or domain not in planned):
+                applied_state.record(desired[domain].fingerprint(), json_zone)
+    applied_state.save()
+
+
+def plan_changes(existing, desired, reuse_records=False):
+    """
+    Computes the plan that brings the existing zones in sync with the desired zones.
+    Zones to be deleted come first, then zones to be modified, then zones to be added, each in name order.
+    :param existing: dictionary of existing zones
+    :param desired: dictionary of desired zones
+    :param reuse_records: True to change records into desired records of another name instead of deleting them
+    :return: ChangePlan
+    """
+    fleet = delta.fleet_delta(existing, desired, reuse_records=reuse_records)
+    operations = []
+    for zone in sorted(fleet.zones_deleted):
+        operations += plan_zone_delta(existing[zone], None, fleet)
+    for zone in sorted(fleet.zones_updated):
+        operations += plan_zone_delta(existing[zone], desired[zone], fleet)
+    for zone in sorted(fleet.zones_added):
+        operations += plan_zone_delta(None, desired[zone], fleet)
+    return plan.ChangePlan(operations)
+
+
+def plan_zone(existing_zone, desired_zone, reuse_records=False):
+    """
+    Computes the operations for a single zone: the zone operation first, then record deletes, modifies and adds
+    :param existing_zone: existing zone, None if the zone is to be added
+    :param desired_zone: desired zone, None if the zone is to be deleted
+    :param reuse_records: True to change records into desired records of another name instead of deleting them
+    :return: list of operations
+    """
+    existing = {}
+    if existing_zone is not None:
+        existing[existing_zone.domain] = existing_zone
+    desired = {}
+    if desired_zone is not None:
+        desired[desired_zone.domain] = desired_zone
+    fleet = delta.fleet_delta(existing, desired, reuse_records=reuse_records)
+    return plan_zone_delta(existing_zone, desired_zone, fleet)
+
+
+def plan_zone_delta(existing_zone, desired_zone, fleet):
+    """
+    Computes the operations for a single zone from the differences already found for the fleet
+    :param existing_zone: existing zone, None if the zone is to be added
+    :param desired_zone: desired zone, None if the zone is to be deleted
+    :param fleet: FleetDelta covering the zone
+    :return: list of operations
+    """
+    if desired_zone is None:
+        return [plan.operation(plan.DELETE_ZONE, existing_zone.domain, existing_zone.domain_id)]
+    if existing_zone is None:
+        operations = [plan.operation(plan.ADD_ZONE, desired_zone.domain,
+                                     values=object_values(desired_zone, plan.ZONE_FIELDS))]
+        for record in sorted(desired_zone.records.keys()):
+            operations.append(plan.operation(plan.ADD_RECORD, desired_zone.domain,
+                                             values=object_values(desired_zone.records[record], plan.RECORD_FIELDS)))
+        return operations
+    domain = existing_zone.domain
+    operations = []
+    field_changes = fleet.zone_changes.get(domain)
+    if field_changes:
+        operations.append(plan.operation(plan.MODIFY_ZONE, domain, existing_zone.domain_id,
+                                         changes=object_changes(existing_zone, desired_zone, field_changes)))
+    for record in sorted(fleet.records_deleted.get(domain, [])):
+        existing_record = existing_zone.records[record]
+        operations.append(plan.operation(plan.DELETE_RECORD, domain, existing_record.domain_id,
+                                         existing_record.resource_id,
+                                         object_values(existing_record, plan.RECORD_FIELDS)))
+    records_changed = dict((record, (record, fields))
+                           for record, fields in fleet.records_changed.get(domain, {}).iteritems())
+    records_changed.update(fleet.records_matched.get(domain, {}))
+    for record in sorted(records_changed):
+        existing_record = existing_zone.records[record]
+        desired_record, field_changes = records_changed[record]
+        operations.append(plan.operation(plan.MODIFY_RECORD, domain, existing_record.domain_id,
+                                         existing_record.resource_id,
+                                         object_values(existing_record, plan.RECORD_FIELDS),
+                                         object_changes(existing_record, desired_zone.records[desired_record],
+                                                        field_changes)))
+    for record in sorted(fleet.records_added.get(domain, [])):
+        operations.append(plan.operation(plan.ADD_RECORD, domain, existing_zone.domain_id,
+                                         values=object_values(desired_zone.records[record], plan.RECORD_FIELDS)))
+    return operations
+
+
+def object_values(zone_or_record, fields):
+    """
+    :param zone_or_record: a zone or record
+    :param fields: names of the fields
+    :return: list of (field, value) pairs
+    """
+    return [(field, getattr(zone_or_record, field)) for field in fields]
+
+
+def object_changes(existing, desired, fields):
+    """
+    :param existing: existing zone or record
+    :param desired: desired zone or record
+    :param fields: names of the fields that change
+    :return: list of (field, old value, new value) triples
+    """
+    return [(field, getattr(existing, field), getattr(desired, field)) for field in fields]
+
+
+def apply_zones(linode_api, existing, desired, apply_concurrency=1):
+    """
+    Applies the delta between the existing and desired zones
+    :param linode_api: The API object
+    :param existing: dictionary of existing zones
+    :param desired: dictionary of desired zones
+    :param apply_concurrency: number of zones applied at the same time
+    :return: None
+    :raises: a single error listing every zone whose changes failed
+    """
+    execute_plan(linode_api, plan_changes(existing, desired), apply_concurrency)
+
+
+def execute_plan(linode_api, change_plan, apply_concurrency=1):
+    """
+    Applies a plan.
+    Each zone is independent of the others, so with an apply_concurrency above 1 zones are applied from a bounded
+    thread pool. Within a zone the operations are applied in plan order: a new zone is created before its records,
+    and record deletes go before record changes, which go before record adds.
+    :param linode_api: The API object
+    :param change_plan: ChangePlan
+    :param apply_concurrency: number of zones applied at the same time
+    :return: None
+    :raises: a single error listing every zone whose changes failed
+    """
+    work = change_plan.by_zone()
+    results = run_in_pool(lambda pair: execute_zone_or_error(linode_api, pair[0], pair[1]), work, apply_concurrency)
+    finish_apply(linode_api, [error for error in results if error is not None])
+
+
+def finish_apply(linode_api, errors):
+    """
+    Sends any calls the API object still has queued, and reports every failure together
+    :param linode_api: The API object
+    :param errors: error messages of the zones that failed
+    :return: None
+    :raises: a single error listing every zone whose changes failed
+    """
+    try:
+        linode_api.flush()
+    except Exception as e:
+        errors.append(str(e))
+    if errors:
+        raise Exception("Applying changes failed for " + str(len(errors)) + " zone(s): " + "; ".join(errors))
+
+
+def stream_changes(linode_api, desired_config, fetch_concurrency=1, apply_concurrency=1, reuse_records=False,
+                   zone_scope=None):
+    """
+    Streaming reconcile: fetches, diffs and applies one zone at a time instead of building the whole fleet first.
+    Zones that are no longer desired are deleted first; they need no records. Then each desired zone is built
+    (lazily, if the config is lazy), paired with its existing zone once that zone's records are fetched, planned
+    and applied, and then dropped. Fetching runs ahead of applying by at most fetch_concurrency zones, and at most
+    apply_concurrency zones are applied at once, so memory is bounded by the zones in flight rather than the
+    fleet, and the first changes land before the last zone is fetched.
+    :param linode_api: The API object
+    :param desired_config: the Config, preferably lazy
+    :param fetch_concurrency: number of zones whose records are fetched at the same time
+    :param apply_concurrency: number of zones applied at the same time
+    :param reuse_records: True to change records into desired records of another name instead of deleting them
+    :param zone_scope: scope.Scope limiting the zones, None for all zones
+    :return: None
+    :raises: a single error listing every zone that could not be fetched or applied
+    """
+    desired_names = set(desired_config.desired_zone_names())
+    json_zones = linode_api.list_zones()
+    desired_pairs = desired_config.iter_desired_dns()
+    if zone_scope is not None:
+        json_zones = zone_scope.filter_json_zones(json_zones, desired_names)
+        desired_pairs = ((domain, zone) for domain, zone in desired_pairs if zone_scope.selects(domain, zone.families))
+    json_zones = dict((json_zone['DOMAIN'], json_zone) for json_zone in json_zones)
+    to_be_deleted = ((dns_zone.from_json(json_zones[domain]), None, None)
+                     for domain in sorted(json_zones) if domain not in desired_names)
+    fetched = bounded_imap(lambda pair: fetch_zone_pair(linode_api, json_zones.get(pair[0]), pair[1]),
+                           desired_pairs, fetch_concurrency)
+    results = bounded_imap(lambda triple: apply_zone_pair(linode_api, triple[0], triple[1], triple[2], reuse_records),
+                           itertools.chain(to_be_deleted, fetched), apply_concurrency)
+    finish_apply(linode_api, [error for error in results if error is not None])
+
+
+def fetch_zone_pair(linode_api, json_zone, desired_zone):
+    """
+    Fetches the existing zone that goes with a desired zone
+    :param linode_api: The API object
+    :param json_zone: the zone's entry from domain.list, None if the zone does not exist at Linode
+    :param desired_zone: the desired zone
+    :return: triple of the existing zone (None if it does not exist), the desired zone, and the error message if
+             fetching failed
+    """
+    if json_zone is None:
+        return None, desired_zone, None
+    existing_zone = dns_zone.from_json(json_zone)
+    try:
+        fetch_records(linode_api, [existing_zone])
+    except Exception as e:
+        return existing_zone, desired_zone, str(e)
+    return existing_zone, desired_zone, None
+
+
+def apply_zone_pair(linode_api, existing_zone, desired_zone, fetch_error, reuse_records=False):
+    """
+    Plans and applies a single zone
+    :param linode_api: The API object
+    :param existing_zone: existing zone, None if the zone is to be added
+    :param desired_zone: desired zone, None if the zone is to be deleted
+    :param fetch_error: error message if fetching the existing zone failed, in which case nothing is applied
+    :param reuse_records: True to change records into desired records of another name instead of deleting them
+    :return: the error message, or None on success
+    """
+    if fetch_error is not None:
+        return fetch_error
+    domain = (existing_zone or desired_zone).domain
+    return execute_zone_or_error(linode_api, domain, plan_zone(existing_zone, desired_zone, reuse_records))
+
+
+def execute_zone_or_error(linode_api, domain, operations):
+    """ Applies the operations of one zone, capturing any error so the caller can report all failures together
+    :param linode_api: The API object
+    :param domain: name of the zone
+    :param operations: the operations for the zone, in plan order
+    :return: the error message, or None on success
+    """
+    try:
+        execute_zone(linode_api, domain, operations)
+    except Exception as e:
+        return domain + ': ' + str(e)
+    return None
+
+
+def execute_zone(linode_api, domain, operations):
+    """ Applies the operations of one zone, rebuilding the zone and record objects the API object expects
+    :param linode_api: The API object
+    :param domain: name of the zone
+    :param operations: the operations for the zone, in plan order
+    :return: None
+    """
+    zone = None
+    for zone_operation in operations:
+        if zone is None:
+            zone = dns_zone.Zone(domain, zone_operation.domain_id, None, None, None, None, None, None)
+        if zone_operation.action == plan.DELETE_ZONE:
+            linode_api.delete_zone(zone)
+        elif zone_operation.action == plan.ADD_ZONE:
+            zone = operation_zone(zone_operation)
+            linode_api.add_zone(zone)
+        elif zone_operation.action == plan.MODIFY_ZONE:
+            desired_zone = dns_zone.Zone(domain, zone.domain_id, None, None, None, None, None, None)
+            for field, old, new in zone_operation.changes:
+                setattr(zone, field, old)
+                setattr(desired_zone, field, new)
+            linode_api.modify_zone(zone, desired_zone, [change[0] for change in zone_operation.changes])
+        elif zone_operation.action == plan.ADD_RECORD:
+            linode_api.add_record(zone, operation_record(zone_operation, zone.domain_id))
+        elif zone_operation.action == plan.DELETE_RECORD:
+            linode_api.delete_record(operation_record(zone_operation, zone_operation.domain_id))
+        elif zone_operation.action == plan.MODIFY_RECORD:
+            record = operation_record(zone_operation, zone_operation.domain_id)
+            desired_record = operation_record(zone_operation, zone_operation.domain_id)
+            for field, old, new in zone_operation.changes:
+                setattr(record, field, old)
+                setattr(desired_record, field, new)
+            linode_api.modify_record(record, desired_record, [change[0] for change in zone_operation.changes])
+
+
+def operation_zone(zone_operation):
+    """
+    :param zone_operation: an add zone operation
+    :return: the zone described by the operation
+    """
+    zone = dns_zone.Zone(zone_operation.zone, zone_operation.domain_id, None, None, None, None, None, None)
+    for field in plan.ZONE_FIELDS:
+        setattr(zone, field, zone_operation.value(field))
+    return zone
+
+
+def operation_record(zone_operation, domain_id):
+    """
+    :param zone_operation: a record operation
+    :param domain_id: the Linode ID of the zone the record is in
+    :return: the record described by the operation
+    """
+    return dns_record.Record(zone_operation.zone, domain_id, zone_operation.resource_id,
+                             zone_operation.value('record_type'), zone_operation.value('name'),
+                             zone_operation.value('target'), zone_operation.value('priority'),
+                             zone_operation.value('ttl_seconds'), zone_operation.value('weight'),
+                             zone_operation.value('port'), zone_operation.value('protocol'),
+                             zone_operation.value('tag'))
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Update Linode DNS configuration to match specification")
     parser.add_argument('api_key', help='Linode API key')
-    parser.add_argument('config_file', help='Config file with desired DNS specification')
+    parser.add_argument('config_file', nargs='?',
+                        help='Config file with desired DNS specification, or a directory or glob of config files')
     parser.add_argument('-d', "--dryrun", action="store_true", help='Print changes on STDOUT, but do not execute them')
+    parser.add_argument('--fetch-concurrency', type=int, default=1, metavar='N',
+                        help='Number of zones whose records are fetched from Linode at the same time')
+    parser.add_argument('--batch-size', type=int, default=0, metavar='N',
+                        help='Send API calls N at a time through api.batch (0 sends each call on its own)')
+    parser.add_argument('--pool-size', type=int, default=10, metavar='N',
+                        help='Number of connections kept open to Linode')
+    parser.add_argument('--connect-timeout', type=float, default=10, metavar='SECONDS',
+                        help='Seconds to wait for a connection to Linode')
+    parser.add_argument('--read-timeout', type=float, default=60, metavar='SECONDS',
+                        help='Seconds to wait for Linode to answer a call')
+    parser.add_argument('--apply-concurrency', type=int, default=1, metavar='N',
+                        help='Number of zones whose changes are applied at the same time')
+    parser.add_argument('--save-plan', metavar='FILE', help='Save the computed changes as a JSON plan in FILE')
+    parser.add_argument('--plan', metavar='FILE',
+                        help='Apply the JSON plan saved in FILE instead of computing changes from the config file')
+    parser.add_argument('--cache', metavar='FILE',
+                        help='Keep a snapshot of Linode in FILE, and only fetch zones that changed since')
+    parser.add_argument('--cache-max-age', type=float, default=3600, metavar='SECONDS',
+                        help='Seconds a zone in the snapshot stays valid (default 3600)')
+    parser.add_argument('--state', metavar='FILE',
+                        help='Incremental mode: remember what was applied in FILE, and skip zones unchanged since')
+    parser.add_argument('--api-url', default=api.LINODE_URL, metavar='URL',
+                        help='URL of the Linode API, for example a mock_server.py stand-in')
+    parser.add_argument('--rate-limit', type=float, metavar='N',
+                        help='Send at most N requests per second on average (default: no limit)')
+    parser.add_argument('--burst', type=int, default=1, metavar='N',
+                        help='Send at most N requests at once before the rate limit applies')
+    parser.add_argument('--max-retries', type=int, default=3, metavar='N',
+                        help='Retry calls that fail with a transient error up to N times')
+    parser.add_argument('--retry-backoff', type=float, default=0.5, metavar='SECONDS',
+                        help='Longest wait before the first retry, doubled for each retry after')
+    parser.add_argument('--stream', action='store_true',
+                        help='Fetch, diff and apply zone by zone, keeping only the zones in flight in memory')
+    parser.add_argument('--reuse-records', action='store_true',
+                        help='Rename records that are no longer wanted into new records of the same type, instead '
+                             'of deleting them and creating the new ones')
+    parser.add_argument('--compiled-config', metavar='FILE',
+                        help='Keep the parsed config file in FILE, and skip parsing while the config is unchanged')
+    parser.add_argument('--stream-config', action='store_true',
+                        help='Read the config file one zone at a time; zones must be its last top level entry')
+    parser.add_argument('--parse-processes', type=int, default=1, metavar='N',
+                        help='Number of processes parsing the files of a config directory or glob')
+    parser.add_argument('--log-level', choices=changelog.LEVELS, default=changelog.VERBOSE,
+                        help='Report every change (verbose, the default), only the number of changes (summary), '
+                             'or nothing (quiet)')
+    parser.add_argument('--log-format', choices=changelog.FORMATS, default=changelog.TEXT,
+                        help='Report changes as text (the default) or as one JSON object per line')
+    parser.add_argument('--zone', action='append', default=[], metavar='PATTERN',
+                        help='Only load, fetch and apply the zones whose name matches PATTERN, a zone name or a glob '
+                             'such as *.example.com. Can be given several times')
+    parser.add_argument('--family', action='append', default=[], metavar='NAME',
+                        help='Only load, fetch and apply the zones that use the family NAME. Can be given several '
+                             'times')
+    parser.add_argument('--daemon', action='store_true',
+                        help='Keep running: apply the zones that changed whenever the config file changes, and '
+                             'reconcile all zones every --drift-interval seconds')
+    parser.add_argument('--poll-interval', type=float, default=2, metavar='SECONDS',
+                        help='With --daemon, seconds between two checks of the config file (default 2)')
+    parser.add_argument('--debounce', type=float, default=1, metavar='SECONDS',
+                        help='With --daemon, seconds the config file must stay unchanged before it is applied '
+                             '(default 1)')
+    parser.add_argument('--drift-interval', type=float, default=3600, metavar='SECONDS',
+                        help='With --daemon, seconds between two full reconciles (default 3600)')
+    parser.add_argument('--stats', action='store_true',
+                        help='Print the time spent in each phase and the API requests made on stderr')
+    parser.add_argument('--metrics-file', metavar='FILE', help='Write the metrics of the run to FILE as JSON')
+    parser.add_argument('--prometheus-file', metavar='FILE',
+                        help='Write the metrics of the run to FILE for the Prometheus textfile collector')
     args = parser.parse_args()
+    if (args.config_file is None) == (args.plan is None):
+        parser.error('exactly one of config_file and --plan is required')
+    if args.stream and (args.plan or args.save_plan or args.cache or args.state or args.compiled_config):
+        parser.error('--stream cannot be combined with --plan, --save-plan, --cache, --state or --compiled-config')
+    if (args.zone or args.family) and (args.plan or args.daemon):
+        parser.error('--zone and --family cannot be combined with --plan or --daemon')
+
+    if args.daemon and (args.config_file is None or args.save_plan or args.cache or args.state or args.stream):
+        parser.error('--daemon requires config_file, and cannot be combined with --save-plan, --cache, --state or '
+                     '--stream')
 
-    apply_delta(args.api_key, args.config_file, args.dryrun)
+    zone_scope = None
+    if args.zone or args.family:
+        zone_scope = scope.Scope(args.zone, args.family)
+    if args.daemon:
+        run_daemon(args.api_key, args.config_file, args.dryrun, args.fetch_concurrency, args.apply_concurrency,
+                   args.reuse_records, args.compiled_config, args.parse_processes, args.poll_interval, args.debounce,
+                   args.drift_interval, args.stats, args.metrics_file, args.prometheus_file,
+                   batch_size=args.batch_size, pool_size=args.pool_size, connect_timeout=args.connect_timeout,
+                   read_timeout=args.read_timeout, base_url=args.api_url, rate_limit=args.rate_limit,
+                   burst=args.burst, max_retries=args.max_retries, retry_backoff=args.retry_backoff,
+                   change_log=changelog.ChangeLog(level=args.log_level, output_format=args.log_format))
+    else:
+        apply_delta(args.api_key, args.config_file, args.dryrun, args.fetch_concurrency, args.apply_concurrency,
+                    args.plan, args.save_plan, args.cache, args.cache_max_age, args.state, args.stream,
+                    args.reuse_records, args.compiled_config, args.stream_config, args.parse_processes, args.stats,
+                    args.metrics_file, args.prometheus_file, zone_scope, batch_size=args.batch_size,
+                    pool_size=args.pool_size, connect_timeout=args.connect_timeout, read_timeout=args.read_timeout,
+                    base_url=args.api_url, rate_limit=args.rate_limit, burst=args.burst,
+                    max_retries=args.max_retries, retry_backoff=args.retry_backoff,
+                    change_log=changelog.ChangeLog(level=args.log_level, output_format=args.log_format))
@@ -15,10 +15,18 @@
 # DEALINGS IN THE SOFTWARE.
 
 
+import os
+import shutil
+import tempfile
 import unittest
 
+import changelog
 import dns_record
 import dns_zone
+import mock_server
+import plan
+import scope
+import snapshot
 import update
 
 
@@ -76,9 +84,9 @@ class DeltaRecordsTestCase(unittest.TestCase):
         self.assertEqual(1, len(records_delta[0]))
         self.assertEqual(1, len(records_delta[1]))
         self.assertEqual(1, len(records_delta[2]))
-        self.assertEqual('AAAA:aaaa_record:1.2.3.4', records_delta[0][0])
-        self.assertEqual('A:a_record:1.2.3.4', records_delta[1][0])
-        self.assertEqual('CNAME:cname_record:5.6.7.8', records_delta[2][0])
+        self.assertEqual(dns_record.RecordKey('AAAA', 'aaaa_record', '1.2.3.4'), records_delta[0][0])
+        self.assertEqual(dns_record.RecordKey('A', 'a_record', '1.2.3.4'), records_delta[1][0])
+        self.assertEqual(dns_record.RecordKey('CNAME', 'cname_record', '5.6.7.8'), records_delta[2][0])
 
 
 class DeltaRecordTestCase(unittest.TestCase):
@@ -87,10 +95,336 @@ class DeltaRecordTestCase(unittest.TestCase):
         Test delta on a single record
         """
         delta_data()
-        record_delta = update.record_delta(zone2.records['A:a_record:1.2.3.4'],
-                                           alternate_zone2.records['A:a_record:1.2.3.4'])
+        record_delta = update.record_delta(zone2.records[dns_record.RecordKey('A', 'a_record', '1.2.3.4')],
+                                           alternate_zone2.records[dns_record.RecordKey('A', 'a_record', '1.2.3.4')])
         self.assertEqual(['ttl_seconds'], record_delta)
 
 
+class FakeApi:
+    """
+    Stands in for api.Api, serving zones and records from memory
+    """
+    def __init__(self, zones, records, failing=(), batch_size=0):
+        self.zones = zones
+        self.records = records
+        self.failing = failing
+        self.batch_size = batch_size
+        self.batches = 0
+
+    def list_zones(self):
+        return self.zones
+
+    def list_records(self, zone):
+        if zone.domain in self.failing:
+            raise Exception("API call failed: boom")
+        return self.records[zone.domain_id]
+
+    def list_records_batch(self, zones):
+        self.batches += 1
+        results = []
+        for zone in zones:
+            if zone.domain in self.failing:
+                results.append((None, "boom"))
+            else:
+                results.append((self.records[zone.domain_id], None))
+        return results
+
+
+def fake_json_zone(domain, domain_id):
+    return {u'DOMAIN': domain, u'DOMAINID': domain_id, u'TYPE': u'master', u'SOA_EMAIL': u'a@b.com',
+            u'REFRESH_SEC': 0, u'RETRY_SEC': 0, u'EXPIRE_SEC': 0, u'TTL_SEC': 0}
+
+
+def fake_json_record(domain_id, resource_id, name, target):
+    return {u'DOMAINID': domain_id, u'RESOURCEID': resource_id, u'TYPE': u'A', u'NAME': name, u'TARGET': target,
+            u'PRIORITY': 0, u'TTL_SEC': 0}
+
+
+class GetLinodeDnsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def fake_api(self, failing=(), batch_size=0):
+        zones = [fake_json_zone('zone' + str(i), i) for i in range(10)]
+        records = {}
+        for i in range(10):
+            records[i] = [fake_json_record(i, i * 100 + j, 'host' + str(j), '1.1.1.' + str(j)) for j in range(i)]
+        return FakeApi(zones, records, failing, batch_size)
+
+    def test_concurrent_fetch(self):
+        """
+        Concurrent fetching builds the same zones as sequential fetching
+        """
+        sequential = update.get_linode_dns(self.fake_api())
+        concurrent = update.get_linode_dns(self.fake_api(), 4)
+        self.assertEqual(sorted(sequential.keys()), sorted(concurrent.keys()))
+        for domain in sequential:
+            self.assertEqual(sequential[domain].records.keys(), concurrent[domain].records.keys())
+
+    def test_snapshot_fetch(self):
+        """
+        Zones with valid records in the snapshot are not fetched again
+        """
+        cache = snapshot.Snapshot(os.path.join(self.directory, 'snapshot.json'), 3600)
+        first = update.get_linode_dns(self.fake_api(), 1, cache)
+        second = update.get_linode_dns(self.fake_api(failing=['zone' + str(i) for i in range(10)]), 1, cache)
+        for domain in first:
+            self.assertEqual(first[domain].records.keys(), second[domain].records.keys())
+
+    def test_fetch_errors_aggregated(self):
+        """
+        Every zone that fails is reported in a single error
+        """
+        try:
+            update.get_linode_dns(self.fake_api(failing=('zone3', 'zone7')), 4)
+            self.fail("Missed fetch error")
+        except Exception as e:
+            self.assertTrue(e.message.startswith("Fetching records failed for 2 zone(s)"))
+            self.assertTrue('zone3: API call failed: boom' in e.message)
+            self.assertTrue('zone7: API call failed: boom' in e.message)
+
+    def test_batched_fetch(self):
+        """
+        Batched fetching groups zones into api.batch calls and builds the same zones
+        """
+        sequential = update.get_linode_dns(self.fake_api())
+        batched_api = self.fake_api(batch_size=4)
+        batched = update.get_linode_dns(batched_api, 2)
+        self.assertEqual(3, batched_api.batches)
+        for domain in sequential:
+            self.assertEqual(sequential[domain].records.keys(), batched[domain].records.keys())
+
+
+class ApplyingApi:
+    """
+    Stands in for api.Api, recording the changes applied
+    """
+    def __init__(self, failing=()):
+        self.calls = []
+        self.failing = failing
+
+    def record(self, action, domain, name=None):
+        if domain in self.failing:
+            raise Exception("API call failed: boom")
+        self.calls.append((action, domain, name))
+
+    def add_zone(self, zone):
+        self.record('add_zone', zone.domain)
+
+    def delete_zone(self, zone):
+        self.record('delete_zone', zone.domain)
+
+    def modify_zone(self, zone, desired, fields):
+        if fields:
+            self.record('modify_zone', zone.domain)
+
+    def add_record(self, zone, record):
+        self.record('add_record', zone.domain, record.name)
+
+    def delete_record(self, record):
+        self.record('delete_record', record.domain_name, record.name)
+
+    def modify_record(self, record, desired, fields):
+        if fields:
+            self.record('modify_record', record.domain_name, record.name)
+
+    def flush(self):
+        pass
+
+
+class ApplyZonesTestCase(unittest.TestCase):
+    def fleet(self):
+        existing = {}
+        desired = {}
+        for i in range(8):
+            domain = 'zone' + str(i)
+            existing[domain] = dns_zone.Zone(domain, i, 'master', 'a@b.com', None, None, None, None)
+            existing[domain].add_record(dns_record.Record(domain, i, 1, 'A', 'old', '1.1.1.1', None, None))
+            desired[domain] = dns_zone.Zone(domain, None, None, 'a@b.com', None, None, None, None)
+            desired[domain].add_record(dns_record.Record(domain, None, None, 'A', 'new', '1.1.1.1', None, None))
+        existing['gone'] = dns_zone.Zone('gone', 99, 'master', 'a@b.com', None, None, None, None)
+        desired['fresh'] = dns_zone.Zone('fresh', None, None, 'a@b.com', None, None, None, None)
+        desired['fresh'].add_record(dns_record.Record('fresh', None, None, 'A', 'new', '1.1.1.1', None, None))
+        return existing, desired
+
+    def test_parallel_apply(self):
+        """
+        Parallel apply makes the same changes as sequential apply, and keeps the order within each zone
+        """
+        existing, desired = self.fleet()
+        sequential = ApplyingApi()
+        update.apply_zones(sequential, existing, desired)
+        parallel = ApplyingApi()
+        update.apply_zones(parallel, existing, desired, 4)
+        self.assertEqual(sorted(sequential.calls), sorted(parallel.calls))
+        for domain in list(desired.keys()) + ['gone']:
+            self.assertEqual([call for call in sequential.calls if call[1] == domain],
+                             [call for call in parallel.calls if call[1] == domain])
+        self.assertEqual([('add_zone', 'fresh', None), ('add_record', 'fresh', 'new')],
+                         [call for call in parallel.calls if call[1] == 'fresh'])
+        self.assertEqual([('delete_record', 'zone3', 'old'), ('add_record', 'zone3', 'new')],
+                         [call for call in parallel.calls if call[1] == 'zone3'])
+
+    def test_saved_plan(self):
+        """
+        A plan saved as JSON applies the same changes as the plan it came from
+        """
+        existing, desired = self.fleet()
+        change_plan = update.plan_changes(existing, desired)
+        direct = ApplyingApi()
+        update.execute_plan(direct, change_plan)
+        loaded = ApplyingApi()
+        update.execute_plan(loaded, plan.from_json(change_plan.to_json()))
+        self.assertEqual(direct.calls, loaded.calls)
+        self.assertEqual(8 * 2 + 3, len(change_plan))
+
+    def test_apply_errors_aggregated(self):
+        """
+        A failing zone does not stop the others, and every failure is reported together
+        """
+        existing, desired = self.fleet()
+        linode_api = ApplyingApi(failing=('zone2', 'zone5'))
+        try:
+            update.apply_zones(linode_api, existing, desired, 4)
+            self.fail("Missed apply error")
+        except Exception as e:
+            self.assertTrue(e.message.startswith("Applying changes failed for 2 zone(s)"))
+        self.assertEqual(6, len([call for call in linode_api.calls if call[0] == 'add_record' and
+                                 call[1].startswith('zone')]))
+
+    def test_reuse_records(self):
+        """
+        With reuse_records, a record no longer wanted becomes a wanted record of the same type
+        """
+        existing, desired = self.fleet()
+        linode_api = ApplyingApi()
+        update.execute_plan(linode_api, update.plan_changes(existing, desired, reuse_records=True))
+        self.assertEqual([('modify_record', 'zone3', 'old')], [call for call in linode_api.calls
+                                                                if call[1] == 'zone3'])
+
+
+class MockLinodeTestCase(unittest.TestCase):
+    """
+    Base for tests that run update.apply_delta against a mock_server stand-in
+    """
+    def setUp(self):
+        self.server = mock_server.MockServer()
+        self.server.start()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def apply(self, **options):
+        update.apply_delta('key', 'examples/web_and_mail_server.yml', False, base_url=self.server.url,
+                           change_log=changelog.ChangeLog(level=changelog.QUIET), **options)
+
+
+class IncrementalTestCase(MockLinodeTestCase):
+    def test_incremental(self):
+        """
+        Once applied, unchanged zones are neither fetched nor diffed
+        """
+        state_file = os.path.join(self.directory, 'state.json')
+        self.apply(state_file=state_file)
+        self.assertEqual(3, self.server.mock.calls['domain.create'])
+        self.server.mock.reset_counters()
+        self.apply(state_file=state_file)
+        self.assertEqual({'domain.list': 1}, dict(self.server.mock.calls))
+        self.server.mock.reset_counters()
+        self.apply()
+        self.assertEqual({'domain.list': 1, 'domain.resource.list': 3}, dict(self.server.mock.calls))
+
+
+class MatchTestCase(MockLinodeTestCase):
+    def test_target_change(self):
+        """
+        A record whose target changed is updated in place, keeping its Linode ID
+        """
+        self.apply()
+        resources = [resource for records in self.server.mock.resources.values() for resource in records.values()
+                     if resource[u'TYPE'] == u'A']
+        resource = resources[0]
+        target = resource[u'TARGET']
+        resource[u'TARGET'] = u'10.0.0.1'
+        self.server.mock.reset_counters()
+        self.apply()
+        self.assertEqual(1, self.server.mock.calls['domain.resource.update'])
+        self.assertEqual(0, self.server.mock.calls['domain.resource.create'])
+        self.assertEqual(0, self.server.mock.calls['domain.resource.delete'])
+        self.assertEqual(target, resource[u'TARGET'])
+
+
+class RecordTypesTestCase(MockLinodeTestCase):
+    def test_round_trip(self):
+        """
+        SRV, CAA and NS records, and record TTLs, read back from Linode the way they were sent
+        """
+        config_file = 'test_data/SRV_CAA_NS_record_test.yml'
+        update.apply_delta('key', config_file, False, base_url=self.server.url,
+                           change_log=changelog.ChangeLog(level=changelog.QUIET))
+        self.assertEqual(5, self.server.mock.calls['domain.resource.create'])
+        self.server.mock.reset_counters()
+        update.apply_delta('key', config_file, False, base_url=self.server.url,
+                           change_log=changelog.ChangeLog(level=changelog.QUIET))
+        self.assertEqual({'domain.list': 1, 'domain.resource.list': 1}, dict(self.server.mock.calls))
+
+
+class ScopeTestCase(MockLinodeTestCase):
+    def test_scope(self):
+        """
+        A scoped run only fetches and applies the zones in scope
+        """
+        self.apply()
+        self.server.mock.add_domain('stale.com', 'a@b.com')
+        self.server.mock.reset_counters()
+        self.apply(zone_scope=scope.Scope(['fastcars.com']))
+        self.assertEqual({'domain.list': 1, 'domain.resource.list': 1}, dict(self.server.mock.calls))
+        self.server.mock.reset_counters()
+        self.apply(zone_scope=scope.Scope(families=['web']), stream=True)
+        self.assertEqual({'domain.list': 1, 'domain.resource.list': 2}, dict(self.server.mock.calls))
+        self.server.mock.reset_counters()
+        self.apply(zone_scope=scope.Scope(['*.com'], ['web']))
+        self.assertEqual({'domain.list': 1, 'domain.resource.list': 4, 'domain.delete': 1},
+                         dict(self.server.mock.calls))
+
+
+class StreamTestCase(MockLinodeTestCase):
+    def test_stream(self):
+        """
+        Streaming makes the same changes as the full pipeline
+        """
+        self.apply(stream=True, fetch_concurrency=2, apply_concurrency=2)
+        self.assertEqual(3, self.server.mock.calls['domain.create'])
+        self.assertEqual(0, self.server.mock.calls['domain.resource.list'])
+        self.server.mock.reset_counters()
+        self.apply()
+        self.assertEqual({'domain.list': 1, 'domain.resource.list': 3}, dict(self.server.mock.calls))
+        self.server.mock.add_domain('stale.com', 'a@b.com')
+        self.server.mock.reset_counters()
+        self.apply(stream=True)
+        self.assertEqual({'domain.list': 1, 'domain.resource.list': 3, 'domain.delete': 1},
+                         dict(self.server.mock.calls))
+
+    def test_bounded_imap(self):
+        """
+        Results come back in order, and items are taken lazily
+        """
+        taken = []
+
+        def items():
+            for i in range(20):
+                taken.append(i)
+                yield i
+        results = update.bounded_imap(lambda i: i * i, items(), 4)
+        self.assertEqual(0, next(results))
+        self.assertTrue(len(taken) <= 5)
+        self.assertEqual([i * i for i in range(1, 20)], list(results))
+
+
 if __name__ == '__main__':
     unittest.main()
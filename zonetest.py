@@ -56,25 +56,67 @@ class ConstructorTestCase(unittest.TestCase):
 
     def test_copy_record(self):
         """
-        Tests a family record getting put in two zones, and later substitution could have unintended consequences
-        """
-        zone1 = dns_zone.from_json({u'STATUS': 1, u'RETRY_SEC': 0, u'DOMAIN': u'jfoo.net', u'DOMAINID': 894758,
-                                    u'TTL_SEC': 0, u'MASTER_IPS': u'', u'LPM_DISPLAYGROUP': u'',
-                                    u'SOA_EMAIL': u'domains@jfoo.org', u'AXFR_IPS': u'none', u'REFRESH_SEC': 0,
-                                    u'TYPE': u'master', u'EXPIRE_SEC': 0, u'DESCRIPTION': u''})
-        zone2 = dns_zone.from_json({u'STATUS': 1, u'RETRY_SEC': 0, u'DOMAIN': u'jfoo.org', u'DOMAINID': 894758,
-                                    u'TTL_SEC': 0, u'MASTER_IPS': u'', u'LPM_DISPLAYGROUP': u'',
-                                    u'SOA_EMAIL': u'domains@jfoo.org', u'AXFR_IPS': u'none', u'REFRESH_SEC': 0,
-                                    u'TYPE': u'master', u'EXPIRE_SEC': 0, u'DESCRIPTION': u''})
-        record = dns_record.from_json({u'DOMAINID': 894758, u'PROTOCOL': u'', u'TARGET': u'mx1.oustrencats.com',
-                                       u'WEIGHT': 20, u'NAME': u'name', u'RESOURCEID': 7285261, u'PRIORITY': 0,
-                                       u'TYPE': u'MX', u'PORT': 0, u'TTL_SEC': 0}, 'domain.com')
-        zone1.add_record(record)
-        zone2.merge(zone1)
-        # This is a fragile test. Setting the target should also change the dictionary key
-        zone1.records['MX:name:mx1.oustrencats.com'].target = 'mx2.oustrencats.com'
-        self.assertEqual('mx2.oustrencats.com', zone1.records['MX:name:mx1.oustrencats.com'].target)
-        self.assertEqual(u'mx1.oustrencats.com', zone2.records['MX:name:mx1.oustrencats.com'].target)
+        Tests a family record getting put in two zones: the record is shared until substitution changes it, and
+        substitution in one zone has no unintended consequences in the other
+        """
+        family = dns_zone.Zone('family', None, None, None, None, None, None, None)
+        family.add_record(dns_record.Record('family', None, None, 'CNAME', 'www', '{{ zone }}', None, None))
+        family.add_record(dns_record.Record('family', None, None, 'MX', 'name', 'mx1.oustrencats.com', 10, None))
+        zone1 = dns_zone.Zone('jfoo.net', None, None, None, None, None, None, None)
+        zone2 = dns_zone.Zone('jfoo.org', None, None, None, None, None, None, None)
+        zone1.merge(family)
+        zone2.merge(family)
+        zone1.instantiate()
+        zone2.instantiate()
+        mx_key = dns_record.RecordKey('MX', 'name', 'mx1.oustrencats.com')
+        self.assertTrue(zone1.records[mx_key] is family.records[mx_key])
+        self.assertTrue(zone2.records[mx_key] is family.records[mx_key])
+        self.assertEqual('jfoo.net', zone1.records[dns_record.RecordKey('CNAME', 'www', 'jfoo.net')].target)
+        self.assertEqual('jfoo.org', zone2.records[dns_record.RecordKey('CNAME', 'www', 'jfoo.org')].target)
+        self.assertEqual('{{ zone }}', family.records[dns_record.RecordKey('CNAME', 'www', '{{ zone }}')].target)
+
+
+class InstantiateTestCase(unittest.TestCase):
+    def test_instantiate(self):
+        """
+        {{ zone }} is expanded in CNAME, MX and TXT targets, and the record keys follow the new targets
+        """
+        zone = dns_zone.Zone('zone.com', None, None, None, None, None, None, None)
+        zone.add_record(dns_record.Record('zone.com', None, None, 'CNAME', 'www', '{{ zone }}', None, None))
+        zone.add_record(dns_record.Record('zone.com', None, None, 'MX', '', 'mx.{{ zone }}', 10, None))
+        zone.add_record(dns_record.Record('zone.com', None, None, 'TXT', '', 'v=spf1 include:{{ zone }} -all', None,
+                                          None))
+        zone.add_record(dns_record.Record('zone.com', None, None, 'A', 'www', '1.1.1.1', None, None))
+        zone.instantiate()
+        self.assertEqual([('A', 'www', '1.1.1.1'), ('CNAME', 'www', 'zone.com'), ('MX', '', 'mx.zone.com'),
+                          ('TXT', '', 'v=spf1 include:zone.com -all')], sorted(zone.records.keys()))
+
+    def test_template_cache(self):
+        """
+        Templates are compiled once per source, and plain targets skip Jinja
+        """
+        self.assertEqual('a.zone1.com', dns_zone.render_target('a.{{ zone }}', 'zone1.com'))
+        template = dns_zone.template_cache['a.{{ zone }}']
+        self.assertEqual('a.zone2.com', dns_zone.render_target('a.{{ zone }}', 'zone2.com'))
+        self.assertTrue(template is dns_zone.template_cache['a.{{ zone }}'])
+        self.assertEqual('plain.com', dns_zone.render_target('plain.com', 'zone1.com'))
+        self.assertFalse('plain.com' in dns_zone.template_cache)
+
+
+class FingerprintTestCase(unittest.TestCase):
+    def test_fingerprint(self):
+        """
+        Fingerprints ignore Linode IDs and record order, and change when a record changes
+        """
+        zone1 = dns_zone.Zone('zone1', None, None, 'account@domain.com', None, None, None, None)
+        zone1.add_record(dns_record.Record('zone1', None, None, 'A', 'www', '1.1.1.1', None, None))
+        zone1.add_record(dns_record.Record('zone1', None, None, 'A', 'www', '2.2.2.2', None, None))
+        zone2 = dns_zone.Zone('zone1', 5, 'master', 'account@domain.com', 0, 0, 0, 0)
+        zone2.add_record(dns_record.Record('zone1', 5, 51, 'A', 'www', '2.2.2.2', None, 0))
+        zone2.add_record(dns_record.Record('zone1', 5, 52, 'A', 'www', '1.1.1.1', None, 0))
+        self.assertEqual(zone1.fingerprint(), zone2.fingerprint())
+        zone2.add_record(dns_record.Record('zone1', 5, 53, 'A', 'www', '3.3.3.3', None, 0))
+        self.assertNotEqual(zone1.fingerprint(), zone2.fingerprint())
 
 
 class MergeTestCase(unittest.TestCase):
@@ -135,9 +177,9 @@ class MergeTestCase(unittest.TestCase):
         zone2.add_record(record4)
         zone1.merge(zone2)
         self.assertEqual(3, len(zone1.records))
-        result1 = zone1.records['A:www:foo']
-        result2 = zone1.records['A:www2:foo']
-        result3 = zone1.records['A:www3:bar']
+        result1 = zone1.records[dns_record.RecordKey('A', 'www', 'foo')]
+        result2 = zone1.records[dns_record.RecordKey('A', 'www2', 'foo')]
+        result3 = zone1.records[dns_record.RecordKey('A', 'www3', 'bar')]
         self.assertEqual('foo', result1.target)
         self.assertEqual('foo', result2.target)
         self.assertEqual(10, result2.ttl_seconds)